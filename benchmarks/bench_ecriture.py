@@ -0,0 +1,115 @@
+"""
+Écriture des résultats : taille et temps d'écriture de image_finale.fits
+pour chaque compression (reduction.sortie), comparés au FITS non
+compressé et au PNG 8 bits, puis temps d'une séquence de poses réduites
+avec les écritures faites tout de suite ou dans le thread d'entrées/sorties.
+
+Les poses sont générées (fond gaussien et étoiles gaussiennes, décalées
+d'une pose à l'autre) et écrites en FITS dans un dossier temporaire.
+
+Exemples :
+    python benchmarks/bench_ecriture.py
+    python benchmarks/bench_ecriture.py --taille 4096 --poses 6
+    python benchmarks/bench_ecriture.py --quantification 4 --sans-png
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+from benchmarks.bench_sequence import generer_champ, generer_pose
+from erosion import COURBE_NOYAUX, FWHM_PSF, reduire_fits_sequence
+from reduction.couleur import enregistrer_png
+from reduction.fusion import en_uint8
+from reduction.sequence import SequenceReducer
+from reduction.sortie import COMPRESSIONS, EcrivainFichiers, ReglagesSortie, ecrire_fits_compresse
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+
+def chronometrer(fonction):
+    debut = time.perf_counter()
+    resultat = fonction()
+    return time.perf_counter() - debut, resultat
+
+
+def taille_mo(chemin):
+    return os.path.getsize(chemin) / 1e6
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Taille et temps d'écriture des résultats.")
+    parser.add_argument("--taille", type=int, default=2048, help="côté des poses (en pixels)")
+    parser.add_argument("--densite", type=float, default=300, help="étoiles par mégapixel")
+    parser.add_argument("--poses", type=int, default=4, help="nombre de poses de la séquence")
+    # À 0.7 sigma (erosion.py), le bruit gaussien des poses générées donne
+    # des dizaines de milliers de détections : la détection cacherait l'écriture
+    parser.add_argument("--seuil", type=float, default=3.0, help="seuil de détection (en sigma)")
+    parser.add_argument("--quantification", type=float, default=16.0, help="quantification de RICE_1")
+    parser.add_argument("--sans-png", action="store_true", help="séquence écrite seulement en FITS")
+    parser.add_argument("--graine", type=int, default=0)
+    args = parser.parse_args(arguments)
+
+    rng = np.random.default_rng(args.graine)
+    x, y, flux = generer_champ(args.taille, args.densite, rng)
+    dossier = tempfile.mkdtemp(prefix="bench_ecriture_")
+    try:
+        poses = []
+        for i in range(args.poses):
+            chemin = os.path.join(dossier, f"pose_{i}.fits")
+            fits.PrimaryHDU(generer_pose(args.taille, x + 1.3 * i, y - 0.8 * i, flux, 1000.0, 10.0, 2.2, rng),
+                            header=fits.Header([("OBJECT", "bench")])).writeto(chemin)
+            poses.append(chemin)
+
+        # Une image finale en float32 (la première pose) écrite de chaque façon
+        image = fits.getdata(poses[0])
+        print(f"{args.taille}x{args.taille}, float32 : {image.nbytes / 1e6:.2f} Mo en mémoire")
+        print(f"{'format':<22} {'taille (Mo)':>12} {'temps (s)':>10} {'écart max':>10}")
+        chemin = os.path.join(dossier, "brut.fits")
+        temps, _ = chronometrer(lambda: fits.PrimaryHDU(image).writeto(chemin))
+        print(f"{'FITS non compressé':<22} {taille_mo(chemin):>12.2f} {temps:>10.3f} {0:>10.3g}")
+        for compression in COMPRESSIONS:
+            quantification = args.quantification if compression == "RICE_1" else None
+            chemin = os.path.join(dossier, f"{compression}.fits")
+            temps, _ = chronometrer(lambda: ecrire_fits_compresse(chemin, image, None, compression, quantification))
+            ecart = float(np.abs(fits.getdata(chemin, 1) - image).max())
+            nom = compression if quantification is None else f"{compression} (q={quantification:g})"
+            print(f"{nom:<22} {taille_mo(chemin):>12.2f} {temps:>10.3f} {ecart:>10.3g}")
+        chemin = os.path.join(dossier, "image.png")
+        minimum, maximum = image.min(), image.max()
+        temps, _ = chronometrer(
+            lambda: enregistrer_png(chemin, en_uint8((image - minimum) * (255 / (maximum - minimum)))))
+        print(f"{'PNG 8 bits':<22} {taille_mo(chemin):>12.2f} {temps:>10.3f} {'-':>10}")
+
+        # Séquence : écritures tout de suite, puis pendant le calcul de la pose suivante
+        sortie = ReglagesSortie(png=not args.sans_png, fits=True)
+        print(f"\n{args.poses} poses, sorties : {'FITS' if args.sans_png else 'FITS et PNG'}")
+        print(f"{'écriture':<14} {'temps (s)':>10} {'par pose (s)':>13}")
+        temps_synchrone = None
+        for asynchrone in (False, True):
+            sequence = SequenceReducer(args.seuil, FWHM_PSF, COURBE_NOYAUX)
+            debut = time.perf_counter()
+            with EcrivainFichiers(asynchrone=asynchrone) as ecrivain:
+                for i, pose in enumerate(poses):
+                    reduire_fits_sequence(sequence, pose, os.path.join(dossier, f"sortie_{i}"), afficher_infos=False,
+                                          ecrivain=ecrivain, sortie=sortie)
+            temps = time.perf_counter() - debut
+            nom = "thread" if asynchrone else "tout de suite"
+            gain = "" if temps_synchrone is None else f"  ({temps_synchrone / temps:.2f}x)"
+            print(f"{nom:<14} {temps:>10.3f} {temps / args.poses:>13.3f}{gain}")
+            temps_synchrone = temps
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
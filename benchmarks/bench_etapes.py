@@ -0,0 +1,289 @@
+"""
+Temps de chaque étape de la réduction sur des images FITS synthétiques :
+chargement, sigma_clipped_stats (et les estimations rapides du fond de
+reduction.fond), DAOStarFinder, masques, érosion, flou et fusion, pour
+le chemin simple (un noyau) et le chemin multitaille (un noyau par
+taille de la courbe) avec des carrés floutés, comme la version
+d'origine, puis avec les empreintes des étoiles (mesure, masque et
+moteur, comme erosion.py et l'interface), et enfin tout StarReducer de
+bout en bout.
+
+Les images sont générées avec une taille, une densité d'étoiles, une
+distribution de magnitudes et un bruit donnés, puis gardées dans un
+dossier pour les exécutions suivantes. Les résultats sont écrits en
+JSON (avec le commit courant) pour comparer deux versions du code.
+Une image de 16384x16384 demande environ 8 Go de mémoire (chargement
+en float64 comme dans erosion.py).
+
+Exemples :
+    python benchmarks/bench_etapes.py
+    python benchmarks/bench_etapes.py --tailles 1024 4096 16384 --densites 100 1000
+    python benchmarks/bench_etapes.py --comparer results/bench/avant.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+from astropy.stats import sigma_clipped_stats
+from photutils.detection import DAOStarFinder
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+from benchmarks.bench_masques import construire_masque, construire_masques
+from reduction.empreintes import empreintes_etoiles
+from reduction.fond import carte_fond, maillage_fond, statistiques_sous_echantillon
+from reduction.fusion import fusionner_empreintes
+from reduction.masques import positions_etoiles
+from reduction.noyaux import COURBE_NOYAUX
+from reduction.reducteur import StarReducer
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+# Réglages de la réduction (ceux d'erosion.py et de l'interface)
+ETOILES_RAYON = 6
+FWHM_PSF = 2.0
+THRESHOLD_SIGMA = 0.7
+NOYAU_SIMPLE = 5
+TAILLE_FLOU = 21
+
+# Lignes générées à la fois (limite la mémoire des grandes images)
+LIGNES_PAR_BANDE = 1024
+# Étoiles ajoutées à la fois
+ETOILES_PAR_LOT = 50_000
+
+
+def tirer_magnitudes(n, mag_min, mag_max, pente, rng):
+    """
+    Magnitudes entre mag_min et mag_max avec un nombre d'étoiles qui croît
+    comme 10 ** (pente * mag) (beaucoup d'étoiles faibles, peu de brillantes).
+    """
+    if pente == 0:
+        return rng.uniform(mag_min, mag_max, n)
+    a, b = 10 ** (pente * mag_min), 10 ** (pente * mag_max)
+    return np.log10(a + rng.uniform(0, 1, n) * (b - a)) / pente
+
+
+def generer_image(taille, densite, mag_min, mag_max, pente, fond, bruit, fwhm, rng):
+    """
+    Image float32 de taille × taille : fond gaussien (fond, bruit) et
+    densite étoiles par mégapixel, de profil gaussien de largeur fwhm et
+    de flux total 10 ** (-0.4 * mag).
+    """
+    image = np.empty((taille, taille), dtype=np.float32)
+    for y0 in range(0, taille, LIGNES_PAR_BANDE):
+        y1 = min(y0 + LIGNES_PAR_BANDE, taille)
+        image[y0:y1] = rng.normal(fond, bruit, (y1 - y0, taille))
+
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    rayon = int(np.ceil(4 * sigma))
+    dy, dx = np.mgrid[-rayon:rayon + 1, -rayon:rayon + 1]
+    profil = np.exp(-(dx ** 2 + dy ** 2) / (2 * sigma ** 2))
+    profil = (profil / profil.sum()).astype(np.float32)
+
+    nombre = int(round(densite * taille * taille / 1e6))
+    if taille <= 2 * rayon:
+        return image, 0
+    for debut in range(0, nombre, ETOILES_PAR_LOT):
+        n = min(ETOILES_PAR_LOT, nombre - debut)
+        x = rng.integers(rayon, taille - rayon, n)
+        y = rng.integers(rayon, taille - rayon, n)
+        flux = 10 ** (-0.4 * tirer_magnitudes(n, mag_min, mag_max, pente, rng))
+        np.add.at(image, (y[:, None, None] + dy, x[:, None, None] + dx),
+                  flux[:, None, None].astype(np.float32) * profil)
+    return image, nombre
+
+
+def fichier_synthetique(dossier, taille, densite, args):
+    """Chemin de l'image FITS de ces paramètres, générée si elle n'existe pas encore."""
+    nom = (f"synth_{taille}_d{densite:g}_m{args.mag_min:g}_{args.mag_max:g}_p{args.pente:g}"
+           f"_f{args.fond:g}_b{args.bruit:g}_s{args.graine}.fits")
+    chemin = os.path.join(dossier, nom)
+    if not os.path.exists(chemin):
+        rng = np.random.default_rng(args.graine)
+        image, nombre = generer_image(taille, densite, args.mag_min, args.mag_max, args.pente,
+                                      args.fond, args.bruit, args.fwhm_etoiles, rng)
+        hdu = fits.PrimaryHDU(image)
+        hdu.header["NBETOILE"] = (nombre, "etoiles generees")
+        hdu.header["FOND"] = (args.fond, "niveau du fond")
+        hdu.header["BRUIT"] = (args.bruit, "ecart-type du bruit du fond")
+        hdu.writeto(chemin + ".tmp", overwrite=True)
+        os.replace(chemin + ".tmp", chemin)
+    return chemin
+
+
+def chronometrer(temps, nom, fonction, repetitions):
+    """Meilleur temps de fonction sur repetitions essais, ajouté à temps[nom]."""
+    meilleur = float("inf")
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    temps[nom] = round(meilleur, 6)
+    return resultat
+
+
+def mesurer(chemin, repetitions, threshold_sigma=THRESHOLD_SIGMA):
+    """Temps de chaque étape (en secondes) pour une image FITS."""
+    temps = {}
+
+    def charger():
+        data = np.nan_to_num(fits.getdata(chemin))
+        image = ((data - data.min()) / (data.max() - data.min()) * 255).astype(np.uint8)
+        return image, data.astype(np.float64)
+
+    image, image_float = chronometrer(temps, "chargement", charger, repetitions)
+    moyenne, mediane, std = chronometrer(
+        temps, "statistiques", lambda: sigma_clipped_stats(image_float, sigma=3.0), repetitions)
+    # Estimations du fond de reduction.fond (sous-échantillon et carte du fond)
+    chronometrer(temps, "fond/sous-echantillon", lambda: statistiques_sous_echantillon(image_float), repetitions)
+    chronometrer(temps, "fond/carte", lambda: carte_fond(*maillage_fond(image_float), image_float.shape),
+                 repetitions)
+    sources = chronometrer(
+        temps, "detection",
+        lambda: DAOStarFinder(fwhm=FWHM_PSF, threshold=threshold_sigma * std)(image_float - mediane), repetitions)
+    if sources is None:
+        return temps, 0
+    x, y, mag = positions_etoiles(sources)
+
+    # Chemin simple : un masque pour toutes les étoiles, un seul noyau
+    masque = chronometrer(temps, "simple/masques", lambda: construire_masque(
+        image.shape, x, y, ETOILES_RAYON, 1.0, np.float32), repetitions)
+    image_eroded = chronometrer(temps, "simple/erosion", lambda: cv.erode(
+        image, np.ones((NOYAU_SIMPLE, NOYAU_SIMPLE), np.uint8)), repetitions)
+    masque_flou = chronometrer(temps, "simple/flou", lambda: cv.GaussianBlur(
+        masque, (TAILLE_FLOU, TAILLE_FLOU), 0), repetitions)
+    chronometrer(temps, "simple/fusion", lambda: np.clip(
+        masque_flou * image_eroded + (1 - masque_flou) * image.astype(np.float32), 0, 255
+    ).astype(np.uint8), repetitions)
+
+    # Chemin multitaille : un masque et une érosion par taille de noyau
+    noyaux = COURBE_NOYAUX(mag)
+    tailles = COURBE_NOYAUX.tailles()
+    masques = chronometrer(temps, "multitaille/masques", lambda: construire_masques(
+        image.shape, x, y, noyaux, tailles, ETOILES_RAYON), repetitions)
+    erodees = chronometrer(temps, "multitaille/erosion", lambda: {
+        k: cv.erode(image, np.ones((k, k), np.uint8)) for k in tailles}, repetitions)
+    flous = chronometrer(temps, "multitaille/flou", lambda: {
+        k: cv.GaussianBlur(m, (TAILLE_FLOU, TAILLE_FLOU), 0) / 255.0 for k, m in masques.items()}, repetitions)
+
+    def fusion():
+        image_finale = image.astype(np.float32)
+        for k in tailles:
+            image_finale = flous[k] * erodees[k].astype(np.float32) + (1 - flous[k]) * image_finale
+        return np.clip(image_finale, 0, 255).astype(np.uint8)
+
+    chronometrer(temps, "multitaille/fusion", fusion, repetitions)
+
+    # Empreintes : FWHM et pic de chaque étoile, masque de toutes les étoiles
+    # (remplace carrés et flou) et moteur par régions
+    image_soustraite = image_float - mediane
+    empreintes = chronometrer(temps, "empreintes/mesure", lambda: empreintes_etoiles(
+        sources, image_soustraite, std, FWHM_PSF), repetitions)
+    chronometrer(temps, "empreintes/masque", lambda: empreintes.masque(image.shape), repetitions)
+    chronometrer(temps, "empreintes/moteur", lambda: fusionner_empreintes(image, empreintes, noyaux), repetitions)
+
+    # API StarReducer de bout en bout (statistiques, détection, empreintes,
+    # érosions et fusion multitaille), comme erosion.py sans les écritures
+    def reducteur():
+        reducteur = StarReducer(image, image_float, fwhm=FWHM_PSF)
+        return reducteur.reduce(reducteur.mask(reducteur.detect(threshold_sigma))).en_uint8()
+
+    chronometrer(temps, "reducteur/total", reducteur, repetitions)
+    return temps, len(sources)
+
+
+def commit_courant():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RACINE,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparer(ancien, nouveau):
+    """Affiche le rapport des temps de deux résultats JSON, étape par étape."""
+    anciens = {(c["taille"], c["densite"]): c["etapes"] for c in ancien["cas"]}
+    print(f"Comparaison avec {ancien.get('commit')} ({ancien.get('date')})")
+    for cas in nouveau["cas"]:
+        avant = anciens.get((cas["taille"], cas["densite"]))
+        if avant is None:
+            continue
+        print(f"{cas['taille']}x{cas['taille']}, {cas['densite']:g} étoiles/Mpx")
+        for etape, duree in cas["etapes"].items():
+            if etape in avant and duree > 0:
+                print(f"  {etape:>22} {avant[etape]:>9.4f} s -> {duree:>9.4f} s ({avant[etape] / duree:>6.2f}x)")
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Temps des étapes de la réduction sur des images synthétiques.")
+    parser.add_argument("--tailles", type=int, nargs="+", default=[1024, 2048, 4096],
+                        help="côtés des images (de 1024 à 16384)")
+    parser.add_argument("--densites", type=float, nargs="+", default=[200],
+                        help="étoiles par mégapixel")
+    parser.add_argument("--mag-min", type=float, default=-12.0, help="magnitude de l'étoile la plus brillante")
+    parser.add_argument("--mag-max", type=float, default=-4.0, help="magnitude de l'étoile la plus faible")
+    parser.add_argument("--pente", type=float, default=0.3,
+                        help="pente de la distribution des magnitudes (0 : uniforme)")
+    parser.add_argument("--fond", type=float, default=1000.0, help="niveau du fond de ciel")
+    parser.add_argument("--bruit", type=float, default=10.0, help="écart-type du bruit du fond")
+    parser.add_argument("--fwhm-etoiles", type=float, default=3.0, help="largeur des étoiles générées")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--seuil", type=float, default=THRESHOLD_SIGMA,
+                        help="seuil de détection en sigma (0.7 comme erosion.py ; plus haut, le bruit "
+                             "n'est plus détecté et la densité d'étoiles compte vraiment)")
+    parser.add_argument("-r", "--repetitions", type=int, default=1, help="essais par étape (meilleur temps)")
+    parser.add_argument("--dossier", default=os.path.join(tempfile.gettempdir(), "star-reduction-bench"),
+                        help="dossier des images générées")
+    parser.add_argument("-o", "--sortie", help="fichier JSON des résultats (défaut : results/bench/)")
+    parser.add_argument("--comparer", help="résultats JSON d'une autre version à comparer")
+    args = parser.parse_args(arguments)
+
+    os.makedirs(args.dossier, exist_ok=True)
+    resultats = {
+        "commit": commit_courant(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"systeme": platform.platform(), "processeur": platform.processor(),
+                    "coeurs": os.cpu_count(), "python": platform.python_version(),
+                    "numpy": np.__version__, "opencv": cv.__version__},
+        "parametres": {"mag_min": args.mag_min, "mag_max": args.mag_max, "pente": args.pente,
+                       "fond": args.fond, "bruit": args.bruit, "fwhm_etoiles": args.fwhm_etoiles,
+                       "graine": args.graine, "seuil": args.seuil, "repetitions": args.repetitions},
+        "cas": [],
+    }
+
+    for taille in args.tailles:
+        for densite in args.densites:
+            chemin = fichier_synthetique(args.dossier, taille, densite, args)
+            etapes, nb_etoiles = mesurer(chemin, args.repetitions, args.seuil)
+            resultats["cas"].append({"taille": taille, "densite": densite,
+                                     "etoiles_detectees": nb_etoiles, "etapes": etapes})
+            print(f"{taille}x{taille}, {densite:g} étoiles/Mpx : {nb_etoiles} étoiles détectées")
+            for etape, duree in etapes.items():
+                print(f"  {etape:>22} {duree:>9.4f} s")
+
+    sortie = args.sortie or os.path.join(
+        RACINE, "results", "bench", f"bench_etapes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(sortie)), exist_ok=True)
+    with open(sortie, "w", encoding="utf-8") as f:
+        json.dump(resultats, f, indent=2, ensure_ascii=False)
+    print(f"Résultats : {sortie}")
+
+    if args.comparer:
+        with open(args.comparer, encoding="utf-8") as f:
+            comparer(json.load(f), resultats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Estimation du fond : temps et précision de sigma_clipped_stats sur toute
+l'image, des statistiques sur un sous-échantillon et de la carte du fond
+(reduction.fond), puis étoiles détectées avec chaque fond.
+
+Les images sont générées : fond de ciel avec un gradient et une
+« nébuleuse » (quelques grandes taches gaussiennes), bruit gaussien et
+étoiles de profil gaussien à des positions connues.
+
+Exemples :
+    python benchmarks/bench_fond.py
+    python benchmarks/bench_fond.py --tailles 1024 4096 8192 --nebuleuse 0
+    python benchmarks/bench_fond.py --sans-detection --tailles 16384
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import cv2 as cv
+import numpy as np
+from astropy.stats import sigma_clipped_stats
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+from reduction.detection import CacheDetection
+from reduction.fond import carte_fond, maillage_fond, statistiques_sous_echantillon
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+# Réglages de la détection (ceux d'erosion.py)
+FWHM_PSF = 2.0
+SEUILS_FOND = {"global": 0.7, "carte": 5.0}
+
+# Lignes générées à la fois (limite la mémoire des grandes images)
+LIGNES_PAR_BANDE = 1024
+
+
+def generer_image(taille, densite, fond, bruit, gradient, nebuleuse, rng):
+    """
+    Image float32, fond de ciel vrai (float32) et positions (x, y) des
+    étoiles. gradient : écart du fond d'un bord à l'autre ; nebuleuse :
+    hauteur des taches, en nombre de fois le bruit.
+    """
+    lignes = np.arange(taille, dtype=np.float32)
+    vrai_fond = np.empty((taille, taille), dtype=np.float32)
+    image = np.empty((taille, taille), dtype=np.float32)
+    taches = [(rng.uniform(0, taille), rng.uniform(0, taille), rng.uniform(0.05, 0.2) * taille) for _ in range(5)]
+    for y0 in range(0, taille, LIGNES_PAR_BANDE):
+        y1 = min(y0 + LIGNES_PAR_BANDE, taille)
+        yy, xx = lignes[y0:y1, None], lignes[None, :]
+        bande = fond + gradient * (xx + yy) / (2 * taille)
+        for cx, cy, rayon in taches:
+            bande = bande + nebuleuse * bruit * np.exp(-((xx - cx) ** 2 + (yy - cy) ** 2) / (2 * rayon ** 2))
+        vrai_fond[y0:y1] = bande
+        image[y0:y1] = bande + rng.normal(0, bruit, (y1 - y0, taille))
+
+    sigma = 2.2 / (2 * np.sqrt(2 * np.log(2)))
+    rayon = int(np.ceil(4 * sigma))
+    dy, dx = np.mgrid[-rayon:rayon + 1, -rayon:rayon + 1]
+    profil = np.exp(-(dx ** 2 + dy ** 2) / (2 * sigma ** 2)).astype(np.float32)
+    nombre = int(round(densite * taille * taille / 1e6))
+    x = rng.integers(rayon, taille - rayon, nombre)
+    y = rng.integers(rayon, taille - rayon, nombre)
+    # Pics de 3 à 100 fois le bruit, beaucoup d'étoiles faibles
+    pics = bruit * 10 ** rng.uniform(np.log10(3), 2, nombre)
+    np.add.at(image, (y[:, None, None] + dy, x[:, None, None] + dx), pics[:, None, None].astype(np.float32) * profil)
+    return image, vrai_fond, x, y
+
+
+def chronometrer(fonction):
+    debut = time.perf_counter()
+    resultat = fonction()
+    return time.perf_counter() - debut, resultat
+
+
+def qualite_detection(sources, x, y, taille):
+    """(étoiles retrouvées, fausses détections) : une détection à moins d'un pixel d'une étoile la retrouve."""
+    if sources is None:
+        return 0, 0
+    grille = np.zeros((taille, taille), np.int32)
+    grille[y, x] = np.arange(1, len(x) + 1)
+    grille = cv.dilate(grille.astype(np.float32), np.ones((3, 3), np.uint8)).astype(np.int32)
+    cx = np.clip(np.rint(np.asarray(sources["xcentroid"])).astype(np.intp), 0, taille - 1)
+    cy = np.clip(np.rint(np.asarray(sources["ycentroid"])).astype(np.intp), 0, taille - 1)
+    etoiles = grille[cy, cx]
+    return len(np.unique(etoiles[etoiles > 0])), int(np.count_nonzero(etoiles == 0))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Temps et précision de l'estimation du fond.")
+    parser.add_argument("--tailles", type=int, nargs="+", default=[1024, 4096])
+    parser.add_argument("--densite", type=float, default=200, help="étoiles par mégapixel")
+    parser.add_argument("--fond", type=float, default=1000.0)
+    parser.add_argument("--bruit", type=float, default=10.0)
+    parser.add_argument("--gradient", type=float, default=200.0, help="écart du fond d'un bord à l'autre")
+    parser.add_argument("--nebuleuse", type=float, default=30.0, help="hauteur des taches (en nombre de fois le bruit)")
+    parser.add_argument("--sans-detection", action="store_true", help="seulement le temps et la précision du fond")
+    parser.add_argument("--graine", type=int, default=0)
+    args = parser.parse_args(arguments)
+
+    for taille in args.tailles:
+        rng = np.random.default_rng(args.graine)
+        image, vrai_fond, x, y = generer_image(taille, args.densite, args.fond, args.bruit, args.gradient,
+                                               args.nebuleuse, rng)
+        print(f"\n{taille}x{taille}, {len(x)} étoiles, bruit {args.bruit:g}")
+
+        temps_complet, complet = chronometrer(lambda: sigma_clipped_stats(image, sigma=3.0))
+        temps_echantillon, echantillon = chronometrer(lambda: statistiques_sous_echantillon(image))
+        temps_carte, (grille, cote) = chronometrer(lambda: maillage_fond(image))
+        temps_interpolation, carte = chronometrer(lambda: carte_fond(grille, cote, image.shape))
+        temps_bruit, residu = chronometrer(lambda: statistiques_sous_echantillon(image - carte))
+
+        print(f"{'estimation':<22} {'temps (s)':>10} {'médiane':>10} {'std':>9} {'écart médiane/std':>18}")
+        print(f"{'image entière':<22} {temps_complet:>10.3f} {complet[1]:>10.2f} {complet[2]:>9.3f} {'-':>18}")
+        for nom, temps, (_, mediane, std) in [("sous-échantillon", temps_echantillon, echantillon)]:
+            print(f"{nom:<22} {temps:>10.3f} {mediane:>10.2f} {std:>9.3f} "
+                  f"{abs(mediane - complet[1]) / complet[2]:>18.4f}")
+        print(f"{'carte (boîtes)':<22} {temps_carte + temps_interpolation + temps_bruit:>10.3f} "
+              f"{np.median(grille):>10.2f} {residu[2]:>9.3f} {'-':>18}")
+        # Précision de la carte : écart au vrai fond, en nombre de fois le bruit
+        ecart = np.abs(carte - vrai_fond) / args.bruit
+        print(f"carte - vrai fond : médiane {np.median(ecart):.3f}, 99 % {np.percentile(ecart, 99):.3f} bruit ; "
+              f"médiane seule : médiane {np.median(np.abs(complet[1] - vrai_fond)) / args.bruit:.3f} bruit")
+
+        if args.sans_detection:
+            continue
+        print(f"{'fond':<8} {'seuil':>6} {'détections':>11} {'retrouvées':>11} {'fausses':>8} {'temps (s)':>10}")
+        for fond, seuil in SEUILS_FOND.items():
+            temps, sources = chronometrer(lambda: CacheDetection(image, fond=fond).detecter(seuil, FWHM_PSF))
+            retrouvees, fausses = qualite_detection(sources, x, y, taille)
+            nombre = 0 if sources is None else len(sources)
+            print(f"{fond:<8} {seuil:>6.1f} {nombre:>11} {retrouvees:>11} {fausses:>8} {temps:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
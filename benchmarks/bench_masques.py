@@ -0,0 +1,136 @@
+"""
+Comparaison du dessin des masques d'étoiles : boucle cv.rectangle sur
+les lignes du catalogue (ancienne méthode) contre construire_masques
+(un construire_masque par taille de noyau).
+
+Utilisation : python benchmarks/bench_masques.py
+"""
+import os
+import sys
+import time
+
+import cv2 as cv
+import numpy as np
+from astropy.table import Table
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reduction.masques import positions_etoiles
+
+TAILLE_IMAGE = 4096
+ETOILES_RAYON = 6
+NOMBRES_ETOILES = [1_000, 10_000, 100_000]
+
+# En dessous d'une étoile pour ce nombre de pixels, dessiner les carrés un
+# par un coûte moins cher qu'une dilatation de toute l'image
+PIXELS_PAR_ETOILE_DILATATION = 4096
+
+
+def construire_masque(forme, x, y, rayon, valeur=255, dtype=np.uint8):
+    """
+    Masque contenant un carré plein de côté 2 * rayon + 1 centré sur
+    chaque étoile, identique à un cv.rectangle(..., -1) par étoile.
+
+    Les centres sont posés d'un coup dans une image vide, puis une seule
+    dilatation par un noyau carré les transforme en carrés. rayon peut
+    être un tableau (un rayon par étoile) : on fait alors une dilatation
+    par valeur de rayon distincte. Pour un champ peu dense, les carrés
+    sont dessinés directement à partir des tableaux de coordonnées.
+    """
+    hauteur, largeur = forme[:2]
+    masque = np.zeros((hauteur, largeur), dtype=dtype)
+
+    x = np.asarray(x, dtype=np.intp)
+    y = np.asarray(y, dtype=np.intp)
+    rayons = np.broadcast_to(np.asarray(rayon, dtype=np.intp), x.shape)
+    if x.size == 0:
+        return masque
+
+    for r in np.unique(rayons):
+        choix = rayons == r
+        if r < 0:
+            continue
+
+        if np.count_nonzero(choix) * PIXELS_PAR_ETOILE_DILATATION < hauteur * largeur:
+            for xi, yi in zip(x[choix].tolist(), y[choix].tolist()):
+                cv.rectangle(masque, (xi - r, yi - r), (xi + r, yi + r), valeur, -1)
+            continue
+
+        # Marge de r pixels : un centre juste hors de l'image dessine encore
+        # une partie de son carré, un centre plus loin ne dessine rien
+        xs = x[choix] + r
+        ys = y[choix] + r
+        dedans = (xs >= 0) & (xs < largeur + 2 * r) & (ys >= 0) & (ys < hauteur + 2 * r)
+        if not np.any(dedans):
+            continue
+
+        centres = np.zeros((hauteur + 2 * r, largeur + 2 * r), dtype=dtype)
+        centres[ys[dedans], xs[dedans]] = valeur
+
+        if r > 0:
+            noyau = np.ones((2 * r + 1, 2 * r + 1), np.uint8)
+            centres = cv.dilate(centres, noyau)
+
+        np.maximum(masque, centres[r:r + hauteur, r:r + largeur], out=masque)
+
+    return masque
+
+
+
+def construire_masques(forme, x, y, classes, liste_classes, rayon, valeur=255, dtype=np.uint8):
+    """
+    Un masque par classe de liste_classes (par exemple par taille de noyau
+    d'érosion) : renvoie {classe: masque des étoiles de cette classe}.
+    """
+    classes = np.asarray(classes)
+    rayons = np.broadcast_to(np.asarray(rayon), classes.shape)
+    return {
+        c: construire_masque(forme, x[classes == c], y[classes == c], rayons[classes == c], valeur, dtype)
+        for c in liste_classes
+    }
+
+
+def catalogue_aleatoire(n, rng):
+    # Mêmes colonnes que celles lues dans la sortie de DAOStarFinder
+    return Table({
+        "xcentroid": rng.uniform(0, TAILLE_IMAGE, n),
+        "ycentroid": rng.uniform(0, TAILLE_IMAGE, n),
+        "mag": rng.normal(-3, 2, n),
+    })
+
+
+def masques_boucle(sources):
+    masques = {k: np.zeros((TAILLE_IMAGE, TAILLE_IMAGE), dtype=np.uint8) for k in [3, 15]}
+    for star in sources:
+        x = int(star["xcentroid"])
+        y = int(star["ycentroid"])
+        k = 15 if star["mag"] < -5 else 3
+        cv.rectangle(masques[k], (x - ETOILES_RAYON, y - ETOILES_RAYON),
+                     (x + ETOILES_RAYON, y + ETOILES_RAYON), 255, -1)
+    return masques
+
+
+def masques_vectorises(sources):
+    x, y, mag = positions_etoiles(sources)
+    noyaux = np.where(mag < -5, 15, 3)
+    return construire_masques((TAILLE_IMAGE, TAILLE_IMAGE), x, y, noyaux, [3, 15], ETOILES_RAYON)
+
+
+def chronometrer(fonction, sources, repetitions=3):
+    meilleur = float("inf")
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction(sources)
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur, resultat
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(0)
+    print(f"Image {TAILLE_IMAGE}x{TAILLE_IMAGE}, rayon {ETOILES_RAYON}")
+    print(f"{'étoiles':>10} {'boucle (s)':>12} {'vectorisé (s)':>14} {'gain':>8}")
+    for n in NOMBRES_ETOILES:
+        sources = catalogue_aleatoire(n, rng)
+        t_boucle, ref = chronometrer(masques_boucle, sources)
+        t_vect, res = chronometrer(masques_vectorises, sources)
+        assert all(np.array_equal(ref[k], res[k]) for k in ref), "masques différents"
+        print(f"{n:>10} {t_boucle:>12.4f} {t_vect:>14.4f} {t_boucle / t_vect:>7.1f}x")
@@ -0,0 +1,120 @@
+"""
+Mémoire maximale de chaque étape de la réduction de l'interface (chemin
+simple), avec l'ancienne chaîne (image 8 bits, détection en float64,
+fusion par expressions NumPy) et la chaîne float32 actuelle (un tampon
+de travail, fusion sur place, 8 bits seulement pour l'affichage).
+
+La mémoire est mesurée avec tracemalloc : tableaux NumPy et résultats
+d'OpenCV, sans les tampons internes d'OpenCV.
+
+Utilisation : python benchmarks/bench_memoire.py [fichier.fits]
+"""
+import os
+import sys
+import tracemalloc
+import warnings
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_masques import construire_masque
+from reduction.apercu import NiveauApercu
+from reduction.detection import CacheDetection
+from reduction.fusion import en_uint8, regions_etoiles
+from reduction.masques import positions_etoiles
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+FITS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples", "HorseHead.fits")
+ETOILES_RAYON = 6
+FWHM_PSF = 2.0
+THRESHOLD_SIGMA = 0.7
+NOYAU = 5
+
+
+class Mesure:
+    """Mémoire allouée en plus au plus fort de chaque étape (en Mo)."""
+
+    def __init__(self):
+        self.etapes = []
+
+    def etape(self, nom, fonction):
+        tracemalloc.reset_peak()
+        avant, _ = tracemalloc.get_traced_memory()
+        resultat = fonction()
+        _, pic = tracemalloc.get_traced_memory()
+        self.etapes.append((nom, (pic - avant) / 1e6))
+        return resultat
+
+
+def chaine_ancienne(data, mesure):
+    # Comme l'interface avant la chaîne float32
+    image = mesure.etape("normalisation", lambda: (
+        (data - np.min(data)) / (np.max(data) - np.min(data)) * 255).astype(np.uint8))
+    detection = mesure.etape("statistiques", lambda: CacheDetection(image.astype(np.float64)))
+    sources = mesure.etape("détection", lambda: detection.detecter(THRESHOLD_SIGMA, FWHM_PSF))
+    x, y, _ = positions_etoiles(sources)
+    masque_flou = mesure.etape("masque et flou", lambda: cv.GaussianBlur(
+        construire_masque(image.shape, x, y, ETOILES_RAYON, 1.0, np.float32), (21, 21), 0))
+    image_eroded = mesure.etape("érosion", lambda: cv.erode(image, np.ones((NOYAU, NOYAU), np.uint8)))
+    image_finale = mesure.etape("fusion", lambda: (
+        masque_flou * image_eroded + (1 - masque_flou) * image.astype(np.float32)))
+    return mesure.etape("affichage", lambda: np.clip(image_finale, 0, 255).astype(np.uint8))
+
+
+def chaine_float32(data, mesure):
+    def normaliser():
+        donnees = data.astype(np.float32)
+        minimum, maximum = donnees.min(), donnees.max()
+        donnees -= minimum
+        donnees *= 255 / (maximum - minimum)
+        return donnees
+
+    donnees = mesure.etape("normalisation", normaliser)
+    niveau = mesure.etape("statistiques", lambda: NiveauApercu(donnees, 1.0))
+    sources = mesure.etape("détection", lambda: niveau.cache_detection.detecter(THRESHOLD_SIGMA, FWHM_PSF))
+    x, y, _ = positions_etoiles(sources)
+
+    def masque_et_flou():
+        masque_total = construire_masque(donnees.shape, x, y, ETOILES_RAYON, 1.0, np.float32)
+        return cv.GaussianBlur(masque_total, (21, 21), 0), regions_etoiles([masque_total], 10)
+
+    masque_flou, regions = mesure.etape("masque et flou", masque_et_flou)
+    image_eroded = mesure.etape("érosion", lambda: niveau.erosions.erodee(NOYAU))
+    travail, tampon = mesure.etape("tampons", niveau.tampons)
+
+    def fusion():
+        np.copyto(travail, donnees)
+        for region in regions:
+            resultat = travail[region]
+            np.subtract(image_eroded[region], donnees[region], out=resultat)
+            np.multiply(resultat, masque_flou[region], out=resultat)
+            np.add(resultat, donnees[region], out=resultat)
+
+    mesure.etape("fusion", fusion)
+    return mesure.etape("affichage", lambda: en_uint8(travail, tampon))
+
+
+if __name__ == "__main__":
+    chemin = sys.argv[1] if len(sys.argv) > 1 else FITS_FILE
+    data = np.nan_to_num(fits.getdata(chemin))
+    if data.ndim > 2:
+        data = np.mean(data, axis=0)
+    print(f"{chemin} : {data.shape[1]}x{data.shape[0]} ({data.dtype})")
+
+    tracemalloc.start()
+    resultats = {}
+    for nom, chaine in (("ancienne", chaine_ancienne), ("float32", chaine_float32)):
+        mesure = Mesure()
+        chaine(data, mesure)
+        resultats[nom] = dict(mesure.etapes)
+    tracemalloc.stop()
+
+    print(f"{'étape':>16} {'ancienne (Mo)':>14} {'float32 (Mo)':>13}")
+    for etape in resultats["float32"]:
+        ancienne = resultats["ancienne"].get(etape)
+        colonne = "-" if ancienne is None else f"{ancienne:.1f}"
+        print(f"{etape:>16} {colonne:>14} {resultats['float32'][etape]:>13.1f}")
@@ -0,0 +1,67 @@
+"""
+Passage à l'échelle de la réduction par tuiles en parallèle :
+1, 2, 4, 8 processus puis tous les cœurs, comparés au traitement de
+l'image entière en un seul processus (résultat identique bit à bit).
+
+Utilisation : python benchmarks/bench_parallele.py [taille_image]
+"""
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reduction.fond import statistiques_sous_echantillon
+from reduction.parallele import reduire_image_parallele
+from reduction.tuiles import noyau_magnitude_defaut, traiter_tuile
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+
+def champ_etoiles(taille, nb_etoiles, rng):
+    # Fond bruité et étoiles gaussiennes de brillances variées
+    image = rng.normal(1000, 20, (taille, taille))
+    yy, xx = np.mgrid[-7:8, -7:8]
+    for x, y, flux in zip(rng.integers(7, taille - 7, nb_etoiles),
+                          rng.integers(7, taille - 7, nb_etoiles),
+                          rng.lognormal(7, 1, nb_etoiles)):
+        image[y - 7:y + 8, x - 7:x + 8] += flux * np.exp(-(xx ** 2 + yy ** 2) / 4.0)
+    return image.astype(np.int16)
+
+
+def reduire_un_processus(data):
+    # Image entière, sans tuiles, avec les statistiques de fond de erosion.py
+    # (reduction.fond, même sous-échantillon) : même image finale que erosion.py
+    statistiques = statistiques_sous_echantillon(data)
+    toute = (slice(0, data.shape[0]), slice(0, data.shape[1]))
+    image, etoiles = traiter_tuile(data, float(data.min()), float(data.max()), statistiques, toute,
+                                   2.0, 0.7, noyau_magnitude_defaut)
+    return image, etoiles
+
+
+if __name__ == "__main__":
+    taille = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    data = champ_etoiles(taille, taille * taille // 4000, np.random.default_rng(0))
+
+    debut = time.perf_counter()
+    reference, etoiles_ref = reduire_un_processus(data)
+    t_ref = time.perf_counter() - debut
+    print(f"Image {taille}x{taille}, {len(etoiles_ref[0])} étoiles, {os.cpu_count()} cœurs")
+    print(f"{'processus':>10} {'temps (s)':>10} {'accélération':>13} {'identique':>10}")
+    print(f"{'(entière)':>10} {t_ref:>10.2f} {1.0:>12.2f}x {'-':>10}")
+
+    nombres = sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    for n in nombres:
+        debut = time.perf_counter()
+        image, (x, y, mag) = reduire_image_parallele(data, nb_processus=n)
+        duree = time.perf_counter() - debut
+
+        # Mêmes pixels et même catalogue, sans doublon sur les coutures
+        identique = np.array_equal(image, reference) and np.array_equal(
+            sorted(zip(x.tolist(), y.tolist())),
+            sorted(zip(etoiles_ref[0].tolist(), etoiles_ref[1].tolist()))
+        )
+        print(f"{n:>10} {duree:>10.2f} {t_ref / duree:>12.2f}x {str(identique):>10}")
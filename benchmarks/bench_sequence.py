@@ -0,0 +1,143 @@
+"""
+Mode séquence : temps par image d'une suite de poses du même champ,
+réduites une par une à froid (StarReducer : statistiques, DAOStarFinder,
+empreintes à chaque image) puis avec SequenceReducer (détection sur la
+première image seulement), et écart des positions suivies aux vraies
+positions des étoiles.
+
+Les poses sont générées : un même champ d'étoiles (positions sous-pixel),
+décalé d'une pose à l'autre (dérive et agitation) avec un nouveau bruit.
+
+Exemples :
+    python benchmarks/bench_sequence.py
+    python benchmarks/bench_sequence.py --taille 4096 --densite 500 --poses 8 --suivi decalage
+    python benchmarks/bench_sequence.py --seuil 3
+"""
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+from reduction.reducteur import StarReducer
+from reduction.sequence import SUIVIS, SequenceReducer
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+# Réglages de la réduction (ceux d'erosion.py)
+FWHM_PSF = 2.0
+THRESHOLD_SIGMA = 0.7
+
+# Étoiles dessinées à la fois
+ETOILES_PAR_LOT = 20_000
+
+
+def generer_champ(taille, densite, rng):
+    """Positions (x, y) sous-pixel et flux des étoiles du champ."""
+    nombre = int(round(densite * taille * taille / 1e6))
+    x = rng.uniform(0, taille, nombre)
+    y = rng.uniform(0, taille, nombre)
+    # Beaucoup d'étoiles faibles, peu de brillantes
+    flux = 10 ** rng.uniform(2.5, 5.0, nombre) * rng.uniform(0, 1, nombre) ** 2 + 200
+    return x, y, flux
+
+
+def generer_pose(taille, x, y, flux, fond, bruit, fwhm, rng):
+    """Image float32 : fond gaussien et étoiles de profil gaussien centrées en (x, y)."""
+    image = rng.normal(fond, bruit, (taille, taille)).astype(np.float32)
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    rayon = int(np.ceil(4 * sigma))
+    d = np.arange(-rayon, rayon + 1)
+    dedans = np.flatnonzero((x >= rayon) & (x < taille - rayon - 1) & (y >= rayon) & (y < taille - rayon - 1))
+    for debut in range(0, len(dedans), ETOILES_PAR_LOT):
+        lot = dedans[debut:debut + ETOILES_PAR_LOT]
+        cx, cy = np.rint(x[lot]).astype(np.intp), np.rint(y[lot]).astype(np.intp)
+        gx = np.exp(-((cx[:, None] + d) - x[lot, None]) ** 2 / (2 * sigma ** 2))
+        gy = np.exp(-((cy[:, None] + d) - y[lot, None]) ** 2 / (2 * sigma ** 2))
+        profils = (flux[lot, None, None] / (2 * np.pi * sigma ** 2)) * gy[:, :, None] * gx[:, None, :]
+        np.add.at(image, ((cy[:, None] + d)[:, :, None], (cx[:, None] + d)[:, None, :]), profils.astype(np.float32))
+    return image
+
+
+def en_image(pose):
+    """Image réduite (0 à 255, float32) et image de détection, comme l'interface."""
+    minimum, maximum = pose.min(), pose.max()
+    return (pose - minimum) * np.float32(255 / (maximum - minimum)), pose
+
+
+def etoiles_vraies(empreintes, x, y, taille):
+    """Étoiles du catalogue à moins d'un pixel d'une vraie étoile (les autres sont du bruit)."""
+    import cv2 as cv
+
+    grille = np.zeros((taille, taille), np.uint8)
+    dedans = (x >= 0) & (x < taille - 0.5) & (y >= 0) & (y < taille - 0.5)
+    grille[np.rint(y[dedans]).astype(np.intp), np.rint(x[dedans]).astype(np.intp)] = 1
+    grille = cv.dilate(grille, np.ones((3, 3), np.uint8))
+    cx = np.clip(np.rint(empreintes.x).astype(np.intp), 0, taille - 1)
+    cy = np.clip(np.rint(empreintes.y).astype(np.intp), 0, taille - 1)
+    return np.flatnonzero(grille[cy, cx])
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Temps par image du mode séquence.")
+    parser.add_argument("--taille", type=int, default=2048, help="côté des poses (en pixels)")
+    parser.add_argument("--densite", type=float, default=300, help="étoiles par mégapixel")
+    parser.add_argument("--poses", type=int, default=6, help="nombre de poses")
+    parser.add_argument("--derive", type=float, default=1.7, help="dérive entre deux poses (en pixels)")
+    parser.add_argument("--suivi", choices=SUIVIS, default="centroides")
+    parser.add_argument("--seuil", type=float, default=THRESHOLD_SIGMA, help="seuil de détection (en sigma)")
+    parser.add_argument("--fond", type=float, default=1000.0)
+    parser.add_argument("--bruit", type=float, default=10.0)
+    parser.add_argument("--graine", type=int, default=0)
+    args = parser.parse_args(arguments)
+
+    rng = np.random.default_rng(args.graine)
+    x, y, flux = generer_champ(args.taille, args.densite, rng)
+    decalages = [(i * args.derive + rng.uniform(-0.5, 0.5), -0.6 * i * args.derive + rng.uniform(-0.5, 0.5))
+                 for i in range(args.poses)]
+    poses = [en_image(generer_pose(args.taille, x + dx, y + dy, flux, args.fond, args.bruit, 2.2, rng))
+             for dx, dy in decalages]
+    print(f"{args.poses} poses de {args.taille}x{args.taille}, {len(x)} étoiles, suivi {args.suivi}")
+
+    sequence = SequenceReducer(args.seuil, FWHM_PSF, suivi=args.suivi)
+    print(f"{'pose':>5} {'froid (s)':>10} {'séquence (s)':>13} {'gain':>6} {'écart suivi (px)':>17}")
+    gains = []
+    for i, ((image, detection), (dx, dy)) in enumerate(zip(poses, decalages)):
+        debut = time.perf_counter()
+        reducteur = StarReducer(image, detection, fwhm=FWHM_PSF)
+        reducteur.reduce(reducteur.mask(reducteur.detect(args.seuil))).en_uint8()
+        temps_froid = time.perf_counter() - debut
+
+        debut = time.perf_counter()
+        sequence.reduce(image, detection).en_uint8()
+        temps_sequence = time.perf_counter() - debut
+
+        empreintes = sequence.masques.empreintes
+        if i == 0:
+            # Étoiles de la référence posées sur une vraie étoile, et leurs positions
+            vraies = etoiles_vraies(empreintes, x + dx, y + dy, args.taille)
+            reference = (empreintes.x[vraies], empreintes.y[vraies], dx, dy)
+            ecart = 0.0
+        else:
+            gains.append(temps_froid / temps_sequence)
+            # Écart médian à la position de référence déplacée du vrai décalage,
+            # pour les vraies étoiles encore dans le champ
+            rx, ry, dx0, dy0 = reference
+            suivies = np.flatnonzero(np.isin(sequence.etoiles_reference, vraies))
+            rang = np.searchsorted(vraies, sequence.etoiles_reference[suivies])
+            ecart = float(np.median(np.hypot(empreintes.x[suivies] - (rx[rang] + dx - dx0),
+                                             empreintes.y[suivies] - (ry[rang] + dy - dy0))))
+        print(f"{i:>5} {temps_froid:>10.3f} {temps_sequence:>13.3f} {temps_froid / temps_sequence:>5.1f}x "
+              f"{ecart:>17.3f}")
+
+    if gains:
+        print(f"Gain médian après la référence : {np.median(gains):.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Réduction par tuiles (reduction.tuiles) d'une image FITS rangée de
+plusieurs façons : float32, uint16 des caméras (BZERO = 32768) et int16
+mis à l'échelle (BSCALE, BZERO) avec des pixels BLANK. Temps comparé à
+erosion.py et image finale identique pixel à pixel ; avec BLANK,
+erosion.py n'est pas comparé, on vérifie que les pixels BLANK finissent
+à 0 sans NaN converti en 8 bits.
+
+Utilisation : python benchmarks/bench_tuiles.py [taille_image] [taille_tuile]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.bench_parallele import champ_etoiles
+from erosion import reduire_fits
+from reduction.tuiles import reduire_fits_par_tuiles
+
+from photutils.utils import NoDetectionsWarning
+warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+# Rectangle de pixels BLANK (part de la hauteur et de la largeur)
+ZONE_BLANK = (slice(0.1, 0.3), slice(0.2, 0.5))
+VALEUR_BLANK = -32768
+
+
+def ecrire_formats(data, dossier):
+    """Écrit data (int16) dans chaque format ; renvoie {nom: (chemin, zone BLANK ou None)}."""
+    chemins = {}
+    chemin = os.path.join(dossier, "float32.fits")
+    fits.PrimaryHDU(data.astype(np.float32)).writeto(chemin)
+    chemins["float32"] = (chemin, None)
+
+    chemin = os.path.join(dossier, "uint16.fits")
+    fits.PrimaryHDU(data.astype(np.uint16)).writeto(chemin)
+    chemins["uint16 (BZERO)"] = (chemin, None)
+
+    hauteur, largeur = data.shape
+    zone = tuple(slice(int(p.start * n), int(p.stop * n)) for p, n in zip(ZONE_BLANK, (hauteur, largeur)))
+    brutes = data.copy()
+    brutes[zone] = VALEUR_BLANK
+    hdu = fits.PrimaryHDU(brutes)
+    hdu.header["BSCALE"] = 0.5
+    hdu.header["BZERO"] = 1000.0
+    hdu.header["BLANK"] = VALEUR_BLANK
+    chemin = os.path.join(dossier, "int16_blank.fits")
+    hdu.writeto(chemin)
+    chemins["int16 (BSCALE, BLANK)"] = (chemin, zone)
+    return chemins
+
+
+if __name__ == "__main__":
+    taille = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    taille_tuile = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+    data = champ_etoiles(taille, taille * taille // 4000, np.random.default_rng(0))
+
+    dossier = tempfile.mkdtemp(prefix="bench_tuiles_")
+    try:
+        print(f"Image {taille}x{taille}, tuiles de {taille_tuile}")
+        print(f"{'format':<22} {'erosion.py (s)':>15} {'tuiles (s)':>11} {'étoiles':>8} {'identique':>10}")
+        for nom, (chemin, zone) in ecrire_formats(data, dossier).items():
+            sortie = os.path.join(dossier, os.path.splitext(os.path.basename(chemin))[0])
+            os.makedirs(sortie)
+            duree_entiere = None
+            if zone is None:
+                debut = time.perf_counter()
+                reduire_fits(chemin, sortie, afficher_infos=False)
+                duree_entiere = time.perf_counter() - debut
+
+            # Un NaN converti en 8 bits est une erreur (RuntimeWarning de NumPy)
+            with warnings.catch_warnings():
+                warnings.simplefilter("error", RuntimeWarning)
+                debut = time.perf_counter()
+                nombre = reduire_fits_par_tuiles(chemin, os.path.join(sortie, "tuiles.png"), taille_tuile)
+                duree = time.perf_counter() - debut
+            image = cv.imread(os.path.join(sortie, "tuiles.png"), cv.IMREAD_UNCHANGED)
+
+            if zone is None:
+                identique = np.array_equal(image, cv.imread(os.path.join(sortie, "image_finale.png"),
+                                                            cv.IMREAD_UNCHANGED))
+                colonne = f"{duree_entiere:>15.2f}"
+            else:
+                # Pixels BLANK ramenés au minimum de l'image, donc à 0 en 8 bits
+                identique = not image[zone].any()
+                colonne = f"{'-':>15}"
+            print(f"{nom:<22} {colonne} {duree:>11.2f} {nombre:>8} {str(identique):>10}")
+    finally:
+        shutil.rmtree(dossier, ignore_errors=True)
@@ -1,174 +1,238 @@
-from astropy.io import fits
-from astropy.stats import sigma_clipped_stats
-from photutils.detection import DAOStarFinder
-import matplotlib.pyplot as plt
+import os
 
-import matplotlib.pyplot as plt
-import cv2 as cv
 import numpy as np
-import os
 
-# Open and read the FITS file
-fits_file = './examples/HorseHead.fits'
-output_dir = './results'
-os.makedirs(output_dir, exist_ok=True)
+from reduction.noyaux import COURBE_NOYAUX
+from reduction.profilage import FICHIER_TRACE, PROFILEUR
+from reduction.reducteur import StarReducer
+from reduction.sortie import EcrivainFichiers, ReglagesSortie, entete_sortie
+
+# Fichier FITS et dossier de sortie par défaut (python erosion.py)
+FITS_FILE = './examples/HorseHead.fits'
+OUTPUT_DIR = './results'
 
 # Taille du noyau pour l'érosion
 EROSION_KERNEL = 5
 
-# Calculer le rayon autour des étoiles
-ETOILES_RAYON = 6 
-
-# PSF taille moyenne des étoiles
-FWHM_PSF = 2.0  
+# PSF taille moyenne des étoiles (FWHM des étoiles trop faibles pour être mesurée)
+FWHM_PSF = 2.0
 
 # Comme le nom de la fonction de DAOStarFinder
-THRESHOLD_SIGMA = 0.7  
-
-
-def kernel_magnitude(mag):
-    """     
-    Plus l'étoile est brillante (mag faible),
-    plus le noyau d'érosion est grand
-    """
-    if mag < -5:
-        return 15
-    else:
-        return 3
-
-hdul = fits.open(fits_file)
-
-# Display information about the file
-hdul.info()
-
-# Access the data from the primary HDU
-data = hdul[0].data
-
-# Access header information
-header = hdul[0].header
-
-
-# Handle both monochrome and color images
-if data.ndim == 3:
-    # Color image - need to transpose to (height, width, channels)
-    if data.shape[0] == 3:  # If channels are first: (3, height, width)
-        data = np.transpose(data, (1, 2, 0))
-    # If already (height, width, 3), no change needed
-
-    # Normalize the entire image to [0, 1] for matplotlib
-    data_normalized = (data - data.min()) / (data.max() - data.min())
-    
-    # Save the data as a png image (no cmap for color images)
-    plt.imsave('./results/original.png', data_normalized)
-
-    # Normalize each channel separately to [0, 255] for OpenCV
-    image = np.zeros_like(data, dtype='uint8')
-    for i in range(data.shape[2]):
-        channel = data[:, :, i]
-        image[:, :, i] = ((channel - channel.min()) / (channel.max() - channel.min()) * 255).astype('uint8')
-
-    # Pour DAOStarFinder → passage en niveaux de gris
-    image_gray = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-    image_float = image_gray.astype(np.float64)
-
-else:
-    # Monochrome image
-    plt.imsave('./results/original.png', data, cmap='gray')
-    
-    # Convert to uint8 for OpenCV
-    image = ((data - data.min()) / (data.max() - data.min()) * 255).astype('uint8')
+THRESHOLD_SIGMA = 0.7
 
-    image_float = data.astype(np.float64)
+# Estimation du fond (voir reduction.fond) et seuil de chacune : avec la
+# carte du fond, sigma est le vrai bruit du ciel, bien plus petit que
+# l'écart-type d'une image avec une nébuleuse
+FOND = "global"
+SEUILS_FOND = {"global": THRESHOLD_SIGMA, "carte": 5.0}
 
 
-# Calcul des statistiques de fond de ciel
-# moyenne : moyenne du fond
-# mediane : valeur du fond de ciel
-# std : écart-type du bruit
-moyenne, mediane, std = sigma_clipped_stats(image_float, sigma=3.0)
-
-# Initialisation de l’algorithme de détection d’étoiles
-daofind = DAOStarFinder(
-    fwhm = FWHM_PSF,
-    threshold = THRESHOLD_SIGMA * std
-)
-
-# Détection des étoiles sur l’image après soustraction du fond (médiane)
-# sources contient les positions et caractéristiques des étoiles détectées
-sources = daofind(image_float - mediane)
-
-if sources is None:
-    print("Nombre d'étoiles détectées : 0")
-else:
-    print(f"Nombre d'étoiles détectées : {len(sources)}")
-
-
-# Masques par taille de noyau
-kernel_sizes = [3, 15]
-
-masque = {
-    k: np.zeros(image.shape[:2], dtype=np.uint8)
-    for k in kernel_sizes
-}
-# Vérification qu’au moins une étoile a été détectée
-if sources is not None:
-    for star in sources:
-        # Coordonnées du centre de l’étoile détectée
-        x = int(star['xcentroid'])
-        y = int(star['ycentroid'])
-        mag = star["mag"]
-
-        k = kernel_magnitude(mag)
-        if k not in masque:
-            continue
-
-        # Dessin d’un carré blanc centré sur chaque étoile
-        cv.rectangle(masque[k], (x - ETOILES_RAYON, y - ETOILES_RAYON), (x + ETOILES_RAYON, y + ETOILES_RAYON), 255,-1)
+def lire_fits(fits_file, output_dir, afficher_infos=True, ecrivain=None, sortie=None):
+    """
+    Lit une image FITS. Renvoie (image, image_float, entete, bornes) :
+    l'image à réduire (8 bits, ou float32 entre 0 et 255 quand l'image
+    finale est écrite en FITS), l'image sur laquelle les étoiles sont
+    détectées, l'en-tête d'origine et (minimum, etendue) de chaque canal,
+    pour revenir aux unités de l'image. original.png est écrit par
+    ecrivain (tout de suite si None) quand sortie.png est vrai.
+    """
+    # astropy et matplotlib ne sont chargés qu'au premier fichier
+    import matplotlib.pyplot as plt
+    from astropy.io import fits
+    from reduction.couleur import bornes_canaux, cube_hwc, luminance, normaliser_canaux
+
+    ecrivain = EcrivainFichiers(asynchrone=False) if ecrivain is None else ecrivain
+    sortie = ReglagesSortie() if sortie is None else sortie
+    os.makedirs(output_dir, exist_ok=True)
+    with fits.open(fits_file) as hdul, PROFILEUR.etape("chargement"):
+        # Display information about the file
+        if afficher_infos:
+            hdul.info()
+
+        # Access the data from the primary HDU
+        data = hdul[0].data
+        entete = hdul[0].header
+
+        # Handle both monochrome and color images : a color image becomes
+        # (height, width, channels) contiguous, channels interleaved ; a cube
+        # that is not RGB becomes one monochrome plane
+        data = cube_hwc(data)
+        if data.ndim == 3:
+            if sortie.png:
+                # Normalize the entire image to [0, 1] for matplotlib
+                data_normalized = (data - data.min()) / (data.max() - data.min())
+
+                # Save the data as a png image (no cmap for color images)
+                ecrivain.soumettre(output_dir, plt.imsave, os.path.join(output_dir, 'original.png'),
+                                   data_normalized)
+
+            # Chaque canal ramené entre 0 et 255 (tous les canaux d'un coup)
+            donnees = normaliser_canaux(data)
+            bornes = bornes_canaux(np.nan_to_num(data))
+            image = donnees if sortie.fits else donnees.astype(np.uint8)
+
+            # Détection une seule fois, sur la luminance (float32, gardée telle
+            # quelle par CacheDetection) : le masque des étoiles est le même
+            # pour les trois canaux
+            image_float = luminance(donnees)
+
+        else:
+            # Monochrome image
+            if sortie.png:
+                ecrivain.soumettre(output_dir, plt.imsave, os.path.join(output_dir, 'original.png'), data,
+                                   cmap='gray')
+
+            # Convert to uint8 for OpenCV (float32 entre 0 et 255 pour un FITS en sortie)
+            minimum = data.min()
+            bornes = (minimum, data.max() - minimum)
+            image = ((data - minimum) / bornes[1] * 255).astype(np.float32 if sortie.fits else 'uint8')
+
+            image_float = data.astype(np.float64)
+    return image, image_float, entete, bornes
+
+
+def ecrire_resultats(reducteur, masques, output_dir, ecrivain=None, sortie=None, fits_info=None):
+    """
+    Écrit les masques par taille de noyau, eroded.png et image_finale.png
+    (si sortie.png) et image_finale.fits (si sortie.fits) de l'image du
+    réducteur, réduite à travers masques. fits_info : (entete, bornes)
+    de lire_fits et mots-clés du traitement ({nom: (valeur, commentaire)}).
+    Les fichiers sont écrits par ecrivain (tout de suite si None) pendant
+    que le calcul continue.
+    """
+    from reduction.fusion import en_uint8
+
+    ecrivain = EcrivainFichiers(asynchrone=False) if ecrivain is None else ecrivain
+    sortie = ReglagesSortie() if sortie is None else sortie
+
+    if sortie.png:
+        # Masques par taille de noyau (toutes les tailles de la courbe)
+        with PROFILEUR.etape("masques"):
+            masque = {k: masques.masque_noyau(k) for k in COURBE_NOYAUX.tailles()}
+
+        for k, m in masque.items():
+            ecrivain.png(output_dir, os.path.join(output_dir, f'masque_noyau_{k}.png'), m)
+
+        # Perform erosion (gardée par le réducteur : le noyau 15 de la fusion
+        # part de l'érosion EROSION_KERNEL déjà faite). Le tableau sert encore
+        # au calcul (et à l'image suivante d'une séquence) : l'écriture a sa copie
+        eroded_image = reducteur.erosions.erodee(EROSION_KERNEL)
+        eroded_image = eroded_image.copy() if eroded_image.dtype == np.uint8 else en_uint8(eroded_image)
+
+        # Save the eroded image
+        ecrivain.png(output_dir, os.path.join(output_dir, 'eroded.png'), eroded_image)
+
+    # Pour chaque taille de noyau, dans l'ordre croissant : érosion de l'image
+    # et fusion avec l'image courante à travers les empreintes, seulement
+    # autour des étoiles de cette taille
+    with PROFILEUR.etape("multitaille"):
+        reduction = reducteur.reduce(masques)
+
+    # Sauvegarde de l’image finale traitée
+    if sortie.png:
+        ecrivain.png(output_dir, os.path.join(output_dir, 'image_finale.png'), reduction.en_uint8())
+    if sortie.fits:
+        # Image finale en float32, dans les unités de l'image d'origine
+        (entete, (minimum, etendue)), mots_cles = fits_info
+        with PROFILEUR.etape("unités d'origine"):
+            image_finale = reduction.image * (np.asarray(etendue, dtype=np.float32) / np.float32(255))
+            image_finale += np.asarray(minimum, dtype=np.float32)
+        ecrivain.fits(output_dir, os.path.join(output_dir, 'image_finale.fits'), image_finale,
+                      entete_sortie(entete, mots_cles), sortie)
+
+
+def mots_cles_traitement(threshold_sigma, fond, nombre_etoiles):
+    """Mots-clés FITS du traitement (voir reduction.sortie.entete_sortie)."""
+    return {
+        "REDSEUIL": (threshold_sigma, "seuil de detection (sigma)"),
+        "REDFOND": (fond, "fond soustrait avant la detection"),
+        "REDFWHM": (FWHM_PSF, "FWHM de la PSF (pixels)"),
+        "REDNETOI": (nombre_etoiles, "etoiles reduites"),
+        "REDNOYAU": (" ".join(str(k) for k in COURBE_NOYAUX.tailles()), "tailles des noyaux d'erosion"),
+    }
+
+
+def reduire_fits(fits_file, output_dir, afficher_infos=True, cache_disque=None, fond=FOND, sortie=None):
+    """
+    Réduction des étoiles d'une image FITS. Écrit original.png, les
+    masques, eroded.png et image_finale.png dans output_dir (et/ou
+    image_finale.fits, voir reduction.sortie.ReglagesSortie) et renvoie
+    le nombre d'étoiles détectées. Avec un cache_disque, une image déjà
+    traitée n'est pas analysée à nouveau. fond="carte" soustrait un fond
+    variable avant la détection (nébuleuse, gradient).
+    Avec le chronométrage actif (voir reduction.profilage), le temps de
+    chaque étape est affiché à la fin.
+    """
+    PROFILEUR.nouvelle_mise_a_jour()
+    # Les fichiers sont écrits pendant la suite du calcul
+    with EcrivainFichiers() as ecrivain:
+        image, image_float, entete, bornes = lire_fits(fits_file, output_dir, afficher_infos, ecrivain, sortie)
 
+        # Calcul des statistiques de fond de ciel (moyenne, mediane, std)
+        # puis détection des étoiles sur l’image après soustraction du fond (médiane).
+        # Une image couleur reste en (hauteur, largeur, 3) : chaque érosion et
+        # chaque mélange traitent les trois canaux ensemble, avec le même masque
+        reducteur = StarReducer(image, image_float, fwhm=FWHM_PSF, courbe_noyaux=COURBE_NOYAUX,
+                                cache_disque=cache_disque, fond=fond)
+        detection = reducteur.detect(SEUILS_FOND[fond])
+        nombre_etoiles = len(detection)
 
-for k, m in masque.items():
-    cv.imwrite(f'./results/masque_noyau_{k}.png', m)
+        if afficher_infos:
+            print(f"Nombre d'étoiles détectées : {nombre_etoiles}")
 
+        # Empreinte de chaque étoile : centrée sur son centroïde sous-pixel,
+        # de la taille de l'étoile (FWHM et pic mesurés sur l'image),
+        # et taille de son noyau d'après sa magnitude
+        ecrire_resultats(reducteur, reducteur.mask(detection), output_dir, ecrivain, sortie,
+                         ((entete, bornes), mots_cles_traitement(SEUILS_FOND[fond], fond, nombre_etoiles)))
 
-# Define a kernel for erosion
-kernel = np.ones((EROSION_KERNEL, EROSION_KERNEL), np.uint8)
+    if afficher_infos and PROFILEUR.actif:
+        print(PROFILEUR.texte_resume())
 
-# Perform erosion
-eroded_image = cv.erode(image, kernel, iterations=1)
+    return nombre_etoiles
 
-# Save the eroded image 
-cv.imwrite('./results/eroded.png', eroded_image)
 
+def reduire_fits_sequence(sequence, fits_file, output_dir, afficher_infos=True, ecrivain=None, sortie=None):
+    """
+    Réduction de l'image FITS suivante d'une séquence de poses alignées
+    (sequence : reduction.sequence.SequenceReducer, à qui les fichiers sont
+    donnés dans l'ordre). Mêmes fichiers écrits que reduire_fits ; les
+    étoiles ne sont détectées que sur les images de référence, puis suivies.
+    Avec un ecrivain, les fichiers de cette image sont encore en cours
+    d'écriture au retour (ecrivain.attendre(output_dir) pour les attendre),
+    pendant que l'image suivante est calculée. Renvoie le nombre d'étoiles
+    réduites.
+    """
+    PROFILEUR.nouvelle_mise_a_jour()
+    image, image_float, entete, bornes = lire_fits(fits_file, output_dir, afficher_infos, ecrivain, sortie)
+    masques = sequence.suivre(image, image_float)
 
-# Conversion de l'image originale en float pour éviter les pertes de précision lors des calculs
-image_finale = image.astype(np.float32)
+    if afficher_infos:
+        if sequence.decalage is None:
+            print(f"Nombre d'étoiles détectées : {len(masques)} (référence)")
+        else:
+            print(f"Nombre d'étoiles suivies : {len(masques)}, décalage ({sequence.decalage[0]:.2f}, "
+                  f"{sequence.decalage[1]:.2f})")
 
-# Parcours de chaque masque associé à une taille de noyau d’érosion
-# kernel_size : taille du noyau
-# masque : masque binaire correspondant aux étoiles de cette taille
-for kernel_size, masque in masque.items():
-    
-    # Si le masque est vide, on passe à la taille suivante
-    if np.count_nonzero(masque) == 0:
-        continue
+    mots_cles = mots_cles_traitement(sequence.threshold_sigma, sequence.fond, len(masques))
+    if sequence.decalage is not None:
+        mots_cles["REDDX"] = (round(sequence.decalage[0], 3), "decalage suivi en x (pixels)")
+        mots_cles["REDDY"] = (round(sequence.decalage[1], 3), "decalage suivi en y (pixels)")
+    ecrire_resultats(sequence.reducteur, masques, output_dir, ecrivain, sortie, ((entete, bornes), mots_cles))
 
-    # Création du noyau d’érosion carré de taille kernel_size
-    kernel = np.ones((kernel_size, kernel_size), np.uint8)
-    
-    # Application de l’érosion sur toute l’image
-    image_eroded = cv.erode(image, kernel, iterations=1).astype(np.float32)
+    if afficher_infos and PROFILEUR.actif:
+        print(PROFILEUR.texte_resume())
 
-    # Floutage du masque pour adoucir les transitions et éviter les artefacts visuels
-    masque_flou = cv.GaussianBlur(masque, (21, 21), 0) / 255.0
+    return len(masques)
 
-    # Si l’image est en couleur, on adapte le masque
-    if image.ndim == 3:
-        masque_flou = masque_flou[..., None]
 
-    # Fusion entre l’image érodée et l’image courante
-    image_finale = (masque_flou * image_eroded +(1 - masque_flou) * image_finale)
+if __name__ == "__main__":
+    from reduction.cache_disque import CacheDisque
 
+    reduire_fits(FITS_FILE, OUTPUT_DIR, cache_disque=CacheDisque())
 
-image_finale = np.clip(image_finale, 0, 255).astype(np.uint8)
-# Sauvegarde de l’image finale traitée
-cv.imwrite(f'./results/image_finale.png', image_finale)
\ No newline at end of file
+    # STAR_REDUCTION_PROFIL=trace.json python erosion.py : trace à ouvrir
+    # dans chrome://tracing ou https://ui.perfetto.dev
+    if FICHIER_TRACE:
+        PROFILEUR.exporter_trace(FICHIER_TRACE)
+        print(f"Trace : {FICHIER_TRACE}")
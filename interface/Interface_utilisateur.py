@@ -1,21 +1,34 @@
+import os
 import sys
-import cv2 as cv
 import numpy as np
-from astropy.io import fits
-from astropy.stats import sigma_clipped_stats
-from photutils.detection import DAOStarFinder
+
+# Permet d'importer le module reduction depuis la racine du projet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reduction.apercu import PyramideApercu
+from reduction.cache_disque import CacheDisque
+from reduction.couleur import cube_hwc, normaliser_canaux
+from reduction.profilage import FICHIER_TRACE, PROFILEUR
+from reduction.reducteur import ignorer_avertissements_detection
+from interface.visionneuse import VueCommune, Visionneuse, qimage
 
 from PySide6.QtWidgets import (
     QApplication, QWidget, QPushButton, QLabel,
-    QVBoxLayout, QHBoxLayout, QSlider, QFileDialog
+    QVBoxLayout, QHBoxLayout, QSlider, QFileDialog, QProgressBar
 )
-from PySide6.QtGui import QPixmap, QImage
-from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QPixmap, QPainter, QPen, QColor
+from PySide6.QtCore import Qt, QTimer, QObject, QRunnable, QThreadPool, QRect, Signal
+
+# Délai pendant lequel les mouvements des curseurs sont regroupés (en ms)
+DELAI_MISE_A_JOUR_MS = 30
+
+# En dessous de cette part de l'image visible (zoom), la zone visible est
+# calculée et affichée avant le reste de l'image
+PART_MAX_ZONE_VISIBLE = 0.25
 
-# 3 lignes qui permettent de ne pas afficher les warnings dans la console.
-import warnings
-from photutils.utils import NoDetectionsWarning
-warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+# Plage et valeur de départ du curseur du seuil (en dixièmes de sigma) pour
+# chaque estimation du fond : avec la carte du fond, sigma est le vrai bruit
+# du ciel (et non plus l'écart-type de toute l'image, nébuleuse comprise)
+CURSEUR_SEUIL = {"global": (1, 20, 7), "carte": (10, 100, 50)}
 
 # Interface 1 : Mettre l'image fits que l'on veut dans le logiciel
 class InterfaceChoix(QWidget):
@@ -51,54 +64,154 @@ class InterfaceChoix(QWidget):
         if not path:
             return
 
-        # Lecture de l'image choisie
-        data = fits.getdata(path)
-        if data.ndim > 2:
-            data = np.mean(data, axis=0)
+        # Lecture de l'image choisie (astropy n'est chargé qu'ici)
+        from astropy.io import fits
 
-        data = np.nan_to_num(data)
-        #Pour convertir l'image en formats 8 bits au lieu de le laisser par défaut
-        image = ((data - np.min(data)) / (np.max(data) - np.min(data)) * 255).astype(np.uint8)
+        # Image couleur en (hauteur, largeur, 3) : les canaux restent entrelacés,
+        # l'aperçu et le comparateur l'affichent en RGB
+        data = cube_hwc(fits.getdata(path))
+
+        # Données ramenées entre 0 et 255 en float32 (canal par canal), sans passer
+        # par 8 bits : la détection et la réduction gardent toute la dynamique de l'image
+        donnees = normaliser_canaux(data)
+        #Pour convertir l'image en formats 8 bits (affichage et comparaison)
+        image = donnees.astype(np.uint8)
 
         # Ouvre l'interface de personnalisation
-        self.interface_param = InterfacePersonnalisation(image)
+        self.interface_param = InterfacePersonnalisation(image, donnees)
         self.interface_param.showMaximized()
         self.hide()
 
 
+# Signaux émis par le thread de traitement vers l'interface
+class SignauxTraitement(QObject):
+    progression = Signal(int)
+    partiel = Signal(int, object, object)
+    termine = Signal(int, int, object)
+
+
+class TraitementAnnule(Exception):
+    pass
+
+
+# Calcul de l'aperçu dans un thread, hors de la boucle d'événements Qt
+class TraitementImage(QRunnable):
+    def __init__(self, interface, generation, niveau, noyau, threshold_sigma, multitaille, zone=None,
+                 fond="global"):
+        super().__init__()
+        self.signaux = SignauxTraitement()
+        self.interface = interface
+        self.generation = generation
+        self.niveau = niveau
+        self.noyau = noyau
+        self.threshold_sigma = threshold_sigma
+        self.multitaille = multitaille
+        # Zone visible (y0, y1, x0, x1) à calculer et envoyer avant le reste
+        self.zone = zone
+        self.fond = fond
+
+    def etape(self, pourcentage):
+        # Abandon dès qu'une demande plus récente existe
+        if self.generation != self.interface.generation:
+            raise TraitementAnnule()
+        self.signaux.progression.emit(pourcentage)
+
+    def run(self):
+        try:
+            self.etape(0)
+            PROFILEUR.nouvelle_mise_a_jour()
+            with PROFILEUR.etape("mise à jour"):
+                niveau = self.interface.pyramide.niveau(self.niveau)
+                # Changé ici, dans le seul thread qui utilise les niveaux
+                niveau.changer_fond(self.fond)
+                etape = self.etape
+                if self.zone is not None:
+                    # D'abord la zone visible, puis toute l'image
+                    image_zone = self.interface.calculer_image(
+                        niveau, self.noyau, self.threshold_sigma, self.multitaille,
+                        lambda pourcentage: self.etape(pourcentage // 2), self.zone
+                    )
+                    self.signaux.partiel.emit(self.generation, self.zone, image_zone)
+                    etape = lambda pourcentage: self.etape(50 + pourcentage // 2)
+                image = self.interface.calculer_image(niveau, self.noyau, self.threshold_sigma, self.multitaille, etape)
+        except TraitementAnnule:
+            return
+        self.signaux.termine.emit(self.generation, self.niveau, image)
+
+
 # Interface 2 : Personnalisation de l'interface
 class InterfacePersonnalisation(QWidget):
-    def __init__(self, image):
+    def __init__(self, image, donnees=None):
         super().__init__()
         self.setWindowTitle("Personnaliser l'image")
         self.resize(1000, 700)
 
         self.image_originale = image.copy()
-        self.image_float = image.astype(np.float64)
         self.image_traitée = image.copy()
+        # Image de calcul en float32 (entre 0 et 255) ; seul l'affichage est en 8 bits
+        self.donnees = image.astype(np.float32) if donnees is None else donnees
+
+        # Pyramide d'aperçu : pendant qu'on déplace un curseur, le calcul se fait
+        # sur le niveau réduit qui correspond à la taille d'affichage.
+        # Chaque niveau calcule ses statistiques de fond une fois et garde ses
+        # catalogues en cache. Détection unique au seuil minimal du curseur
+        # (0.1 sigma), les autres seuils sont obtenus par filtrage de ce catalogue.
+        # Le cache disque évite de refaire la détection si l'image a déjà été ouverte
+        self.pyramide = PyramideApercu(self.donnees, sigma=3.0, seuil_min=0.1,
+                                       cache_disque=CacheDisque())
+        # Réglages (noyau, seuil, multitaille) de image_traitée en pleine résolution
+        self.parametres_traites = None
+
+        # FWHM de la PSF et taille du noyau selon la magnitude : ceux de
+        # StarReducer, comme dans erosion.py. DAOStarFinder sans étoile ne
+        # prévient plus dans la console
+        ignorer_avertissements_detection()
 
-        # PSF taille moyenne des étoiles (comme dans erosion.py)
-        self.FWHM_PSF = 2.0
-
-        # Calculer le rayon autour des étoiles (comme dans erosion.py)
-        self.ETOILES_RAYON = 6
-        
         self.multitaille_active = False
+        # Estimation du fond (voir reduction.fond) et dernier seuil choisi avec chacune
+        self.fond = "global"
+        self.seuils = {fond: defaut for fond, (_, _, defaut) in CURSEUR_SEUIL.items()}
+
+        # Un seul thread de traitement : les calculs ne se chevauchent jamais
+        # et le cache de détection n'est utilisé que par un thread à la fois
+        self.pool_traitement = QThreadPool()
+        self.pool_traitement.setMaxThreadCount(1)
+        self.generation = 0
+
+        self.timer_mise_a_jour = QTimer()
+        self.timer_mise_a_jour.setSingleShot(True)
+        self.timer_mise_a_jour.setInterval(DELAI_MISE_A_JOUR_MS)
+        self.timer_mise_a_jour.timeout.connect(self.lancer_traitement)
 
         # Widgets
-        self.label_image = QLabel("Image FITS chargée")
-        self.label_image.setAlignment(Qt.AlignCenter)
-        self.label_image.setMinimumSize(800, 500)
+        # Image avec zoom (molette) et déplacement (glisser), double clic : image entière
+        self.visionneuse = Visionneuse()
+        self.visionneuse.setMinimumSize(800, 500)
+
+        # Temps de chaque étape de la dernière mise à jour, affiché par-dessus l'image
+        self.label_chrono = QLabel(self.visionneuse)
+        self.label_chrono.setStyleSheet(
+            "background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 6px;"
+        )
+        self.label_chrono.move(10, 10)
+        self.label_chrono.setVisible(PROFILEUR.actif)
 
         self.kernel_slider = QSlider(Qt.Horizontal)
         self.kernel_slider.setRange(3, 15)
         self.kernel_slider.setValue(5)
         self.kernel_slider.valueChanged.connect(self.mettre_a_jour_image)
+        self.kernel_slider.sliderReleased.connect(self.mettre_a_jour_image)
 
         self.threshold_slider = QSlider(Qt.Horizontal)
-        self.threshold_slider.setRange(1, 20)
-        self.threshold_slider.setValue(7)
+        minimum, maximum, defaut = CURSEUR_SEUIL[self.fond]
+        self.threshold_slider.setRange(minimum, maximum)
+        self.threshold_slider.setValue(defaut)
         self.threshold_slider.valueChanged.connect(self.mettre_a_jour_image)
+        self.threshold_slider.sliderReleased.connect(self.mettre_a_jour_image)
+
+        self.barre_progression = QProgressBar()
+        self.barre_progression.setRange(0, 100)
+        self.barre_progression.setValue(100)
 
         self.bouton_enregistrer = QPushButton("Enregistrer et Comparer")
         self.bouton_enregistrer.clicked.connect(self.enregistrer_et_comparer)
@@ -117,17 +230,36 @@ class InterfacePersonnalisation(QWidget):
         )
         self.bouton_multitaille.clicked.connect(self.toggle_multitaille)
 
+        self.bouton_fond = QPushButton("Fond variable : OFF")
+        self.bouton_fond.setFixedSize(220, 50)
+        self.bouton_fond.setStyleSheet("background-color: darkred; color: white; font-size: 16px;")
+        self.bouton_fond.clicked.connect(self.toggle_fond)
+
+        self.bouton_chrono = QPushButton()
+        self.bouton_chrono.setFixedSize(220, 50)
+        self.bouton_chrono.clicked.connect(self.toggle_chronometrage)
+        self.afficher_etat_chronometrage()
+
+        self.bouton_trace = QPushButton("Exporter la trace")
+        self.bouton_trace.setFixedSize(180, 50)
+        self.bouton_trace.setStyleSheet("background-color: gray; color: white; font-size: 16px;")
+        self.bouton_trace.clicked.connect(self.exporter_trace)
+
         # Layout
         layout = QVBoxLayout()
         layout.addWidget(QLabel("Taille du noyau d'érosion :"))
         layout.addWidget(self.kernel_slider)
         layout.addWidget(QLabel("Seuil de détection des étoiles : "))
         layout.addWidget(self.threshold_slider)
-        layout.addWidget(self.label_image)
+        layout.addWidget(self.barre_progression)
+        layout.addWidget(self.visionneuse)
 
         layout_boutons = QHBoxLayout()
         layout_boutons.addWidget(self.bouton_retour)
         layout_boutons.addWidget(self.bouton_multitaille)
+        layout_boutons.addWidget(self.bouton_fond)
+        layout_boutons.addWidget(self.bouton_chrono)
+        layout_boutons.addWidget(self.bouton_trace)
         layout_boutons.addWidget(self.bouton_enregistrer)
         layout.addLayout(layout_boutons)
 
@@ -139,138 +271,116 @@ class InterfacePersonnalisation(QWidget):
         self.interface_choix = InterfaceChoix()
         self.interface_choix.showMaximized()
 
-    def noyau_magnitude(self, mag):
-        return 15 if mag < -5 else self.kernel_slider.value() | 1
-
     def mettre_a_jour_image(self):
-        if self.multitaille_active:
-            self.mettre_a_jour_image_multitaille()
+        # Les événements rapprochés des curseurs sont regroupés : seul le
+        # dernier réglage est envoyé au thread de traitement
+        self.timer_mise_a_jour.start()
+
+    def parametres(self):
+        return (self.kernel_slider.value(), self.threshold_slider.value(), self.multitaille_active, self.fond)
+
+    def lancer_traitement(self, pleine_resolution=False):
+        # Curseur tenu : aperçu sur le niveau réduit, sinon pleine résolution
+        glissement = self.kernel_slider.isSliderDown() or self.threshold_slider.isSliderDown()
+        zone = None
+        if glissement and not pleine_resolution:
+            niveau = self.pyramide.niveau_pour_echelle(self.visionneuse.zoom())
         else:
-            self.mettre_a_jour_image_simple()
-
-    def mettre_a_jour_image_simple(self):
-        THRESHOLD_SIGMA = self.threshold_slider.value() / 10.0
-        
-        # Calcul des statistiques de fond de ciel
-        # moyenne : moyenne du fond
-        # mediane : valeur du fond de ciel
-        # std : écart-type du bruit
-        moyenne, mediane, std = sigma_clipped_stats(self.image_float, sigma=3.0)
-        
-        # Initialisation de l’algorithme de détection d’étoile
-        daofind = DAOStarFinder(fwhm=self.FWHM_PSF, threshold=THRESHOLD_SIGMA * std)
-
-        # Détection des étoiles sur l’image après soustraction du fond (médiane)
-        # sources contient les positions et caractéristiques des étoiles détectées
-        sources = daofind(self.image_float - mediane)
-
-        # Image finale
-        image_finale = self.image_originale.astype(np.float32)
-
-        
-        # Vérification qu’au moins une étoile a été détectée
-        if sources is not None:
-            # Masque global
-            masque_total = np.zeros_like(self.image_originale, dtype=np.float32)
-            for star in sources:
-                # Coordonnées du centre de l’étoile détectée
-                x = int(star["xcentroid"])
-                y = int(star["ycentroid"])
-                kernel_size = self.noyau_magnitude(star["mag"])
-                cv.rectangle(masque_total,
-                             (x - self.ETOILES_RAYON, y - self.ETOILES_RAYON),
-                             (x + self.ETOILES_RAYON, y + self.ETOILES_RAYON),
-                             1.0, -1)
-            # Flou et érosion
-            masque_flou = cv.GaussianBlur(masque_total, (21, 21), 0)
-            kernel = np.ones((kernel_size, kernel_size), np.uint8)
-            image_eroded = cv.erode(self.image_originale, kernel, iterations=1)
-            image_finale = masque_flou * image_eroded + (1 - masque_flou) * image_finale
-
-        self.image_traitée = np.clip(image_finale, 0, 255).astype(np.uint8)
-        self.afficher_image(self.image_traitée)
-
-    def mettre_a_jour_image_multitaille(self):
-        THRESHOLD_SIGMA = self.threshold_slider.value() / 10.0
-
-        # Calcul des statistiques de fond de ciel
-        # moyenne : moyenne du fond
-        # mediane : valeur du fond de ciel
-        # std : écart-type du bruit
-        moyenne, mediane, std = sigma_clipped_stats(self.image_float, sigma=3.0)
-
-        # Initialisation de l’algorithme de détection d’étoile
-        daofind = DAOStarFinder(fwhm=self.FWHM_PSF, threshold=THRESHOLD_SIGMA * std)
-
-        # Détection des étoiles sur l’image après soustraction du fond (médiane)
-        # sources contient les positions et caractéristiques des étoiles détectées  
-        sources = daofind(self.image_float - mediane)
-
-        image_finale = self.image_originale.astype(np.float32)
-
-        # Vérification qu’au moins une étoile a été détectée
-        if sources is None:
-            self.image_traitée = self.image_originale
-            self.afficher_image(self.image_traitée)
-            return
-
-        # Masques par taille de noyau
-        kernel_sizes = [3, 15]
-        masques = {
-            k: np.zeros_like(self.image_originale, dtype=np.uint8)
-            for k in kernel_sizes
-            }
-
-        
-        for star in sources:
-            # Coordonnées du centre de l’étoile détectée
-            x = int(star["xcentroid"])
-            y = int(star["ycentroid"])
-            mag = star["mag"]
-
-            k = 15 if mag < -5 else 3
-            if k not in masques:
-                continue
-
-            # Dessin d’un carré blanc centré sur chaque étoile
-            cv.rectangle(masques[k],
-                         (x - self.ETOILES_RAYON, y - self.ETOILES_RAYON),
-                         (x + self.ETOILES_RAYON, y + self.ETOILES_RAYON),
-                         255, -1
-            )
-
-        for kernel_size, masque in masques.items():
-            # On vérifie si c'est pas nul sinon on passe au suivant
-            if np.count_nonzero(masque) == 0:
-                continue
-
-            
-            kernel = np.ones((kernel_size, kernel_size), np.uint8)
-            image_eroded = cv.erode(self.image_originale, kernel, iterations=1).astype(np.float32)
-
-            #On met en flou comme sur erosion.py 
-            masque_flou = cv.GaussianBlur(masque, (21, 21), 0) / 255.0
-
-            # On fusionne l'image eroder et la version flou (comme demander en phase 2)
-            image_finale = (
-                masque_flou * image_eroded +
-                (1 - masque_flou) * image_finale
-            )
-
-        self.image_traitée = np.clip(image_finale, 0, 255).astype(np.uint8)
-        self.afficher_image(self.image_traitée)
-
-    def afficher_image(self, image):
-        h, w = image.shape
-        qimg = QImage(image.data, w, h, w, QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(qimg).scaled(
-            self.label_image.width(),
-            self.label_image.height(),
-            Qt.KeepAspectRatio
+            niveau = 0
+        if niveau == 0 and not pleine_resolution:
+            # Image agrandie : la partie visible arrive avant le reste
+            visible = self.visionneuse.zone_visible()
+            hauteur, largeur = self.donnees.shape[:2]
+            if visible is not None:
+                # (un aperçu réduit peut arrondir la taille de l'image d'un pixel)
+                y0, y1, x0, x1 = visible
+                y1, x1 = min(y1, hauteur), min(x1, largeur)
+                if y0 < y1 and x0 < x1 and (y1 - y0) * (x1 - x0) < PART_MAX_ZONE_VISIBLE * hauteur * largeur:
+                    zone = (y0, y1, x0, x1)
+
+        # Chaque demande a un numéro, les résultats plus anciens seront ignorés
+        self.generation += 1
+        self.parametres_demandes = self.parametres()
+        traitement = TraitementImage(
+            self,
+            self.generation,
+            niveau,
+            self.kernel_slider.value(),
+            self.threshold_slider.value() / 10.0,
+            self.multitaille_active,
+            zone,
+            self.fond
         )
-        self.label_image.setPixmap(pixmap)
+        traitement.signaux.progression.connect(self.barre_progression.setValue)
+        traitement.signaux.partiel.connect(self.traitement_partiel)
+        traitement.signaux.termine.connect(self.traitement_termine)
+        self.barre_progression.setValue(0)
+        self.pool_traitement.start(traitement)
+
+    def traitement_partiel(self, generation, zone, image_zone):
+        # Zone visible déjà calculée, posée sur l'image affichée en attendant le reste
+        if generation == self.generation:
+            self.visionneuse.afficher_zone(zone, image_zone)
+
+    def traitement_termine(self, generation, niveau, image):
+        # Résultat périmé : un réglage plus récent a été demandé entre temps
+        if generation != self.generation:
+            return
+        # Seul le résultat en pleine résolution est gardé pour la comparaison
+        if niveau == 0:
+            self.image_traitée = image
+            self.parametres_traites = self.parametres_demandes
+        self.afficher_image(image, 0.5 ** niveau)
+
+    def attendre_fin_traitement(self):
+        # Calcule en pleine résolution le dernier réglage s'il ne l'a pas encore été
+        # (demande en attente, aperçu réduit ou calcul en cours)
+        self.timer_mise_a_jour.stop()
+        self.pool_traitement.waitForDone()
+        QApplication.processEvents()
+        if self.parametres_traites != self.parametres():
+            self.lancer_traitement(pleine_resolution=True)
+            self.pool_traitement.waitForDone()
+            QApplication.processEvents()
+
+    def calculer_image(self, niveau, noyau, threshold_sigma, multitaille, etape=None, zone=None):
+        # niveau : StarReducer du niveau de la pyramide (voir NiveauApercu)
+        # zone (y0, y1, x0, x1) : seule cette partie de l'image est calculée et renvoyée
+        if etape is None:
+            etape = lambda pourcentage: None
+
+        # Détection des étoiles (statistiques de fond et catalogues en cache,
+        # un changement du noyau seul ne relance pas DAOStarFinder)
+        detection = niveau.detect(threshold_sigma)
+        etape(40)
+
+        # Empreinte et noyau de chaque étoile, gardés tant que les sources ne changent pas
+        masques = niveau.mask(detection)
+        etape(55)
+
+        # Multitaille : le noyau de chaque étoile dépend de sa magnitude ;
+        # sinon le curseur donne le noyau de toutes les étoiles
+        reduction = niveau.reduce(masques, None if multitaille else noyau, zone)
+        etape(100)
+
+        # Conversion en 8 bits seulement pour l'affichage
+        with PROFILEUR.etape("conversion 8 bits"):
+            return reduction.en_uint8()
+
+    def afficher_image(self, image, echelle=1.0):
+        # echelle : taille de l'image par rapport à la pleine résolution (aperçu réduit)
+        self.visionneuse.definir_image(image, echelle)
+
+        if PROFILEUR.actif:
+            # Dessin tout de suite, pour que son temps fasse partie du résumé
+            self.visionneuse.repaint()
+            self.label_chrono.setText(PROFILEUR.texte_resume())
+            self.label_chrono.adjustSize()
+            self.label_chrono.raise_()
 
     def enregistrer_et_comparer(self):
+        # On compare avec le résultat du dernier réglage
+        self.attendre_fin_traitement()
         self.interface_comp = ComparateurApplication(self.image_originale, self.image_traitée, self)
         self.interface_comp.showMaximized()
         self.hide()
@@ -291,6 +401,47 @@ class InterfacePersonnalisation(QWidget):
 
         self.mettre_a_jour_image()
 
+    def toggle_fond(self):
+        # Fond variable : une carte du fond (nébuleuse, gradient) est soustraite
+        # avant la détection ; chaque mode garde son propre seuil
+        self.seuils[self.fond] = self.threshold_slider.value()
+        self.fond = "global" if self.fond == "carte" else "carte"
+        minimum, maximum, _ = CURSEUR_SEUIL[self.fond]
+        self.threshold_slider.blockSignals(True)
+        self.threshold_slider.setRange(minimum, maximum)
+        self.threshold_slider.setValue(self.seuils[self.fond])
+        self.threshold_slider.blockSignals(False)
+
+        if self.fond == "carte":
+            self.bouton_fond.setText("Fond variable : ON")
+            self.bouton_fond.setStyleSheet("background-color: darkgreen; color: white; font-size: 14px;")
+        else:
+            self.bouton_fond.setText("Fond variable : OFF")
+            self.bouton_fond.setStyleSheet("background-color: darkred; color: white; font-size: 14px;")
+
+        self.mettre_a_jour_image()
+
+    def toggle_chronometrage(self):
+        PROFILEUR.actif = not PROFILEUR.actif
+        self.afficher_etat_chronometrage()
+        self.mettre_a_jour_image()
+
+    def afficher_etat_chronometrage(self):
+        # Le bouton et l'encart des temps suivent l'état du profileur partagé
+        self.label_chrono.setVisible(PROFILEUR.actif)
+        if PROFILEUR.actif:
+            self.bouton_chrono.setText("Chronométrage : ON")
+            self.bouton_chrono.setStyleSheet("background-color: darkgreen; color: white; font-size: 14px;")
+        else:
+            self.bouton_chrono.setText("Chronométrage : OFF")
+            self.bouton_chrono.setStyleSheet("background-color: darkred; color: white; font-size: 14px;")
+
+    def exporter_trace(self):
+        # Trace de toute la session, à ouvrir dans chrome://tracing ou https://ui.perfetto.dev
+        chemin, _ = QFileDialog.getSaveFileName(self, "Exporter la trace", "trace.json", "*.json")
+        if chemin:
+            PROFILEUR.exporter_trace(chemin)
+
 
 
 
@@ -306,12 +457,22 @@ class ComparateurApplication(QWidget):
 
         self.image_originale = image_originale
         self.image_finale = image_finale
-        self.hauteur, self.largeur = self.image_originale.shape
+        self.hauteur, self.largeur = self.image_originale.shape[:2]
 
         self.timer_clignotement = QTimer()
         self.timer_clignotement.timeout.connect(self.clignotement)
         self.affiche_originale = True
 
+        # Images avant / après mises une seule fois à la taille d'affichage
+        # (refaites seulement quand la taille du label change) ; le curseur et
+        # le clignotement ne font que les recopier ou les découper
+        self.pixmap_avant = None
+        self.pixmap_apres = None
+        self.pixmap_mixte = None
+        self.taille_pixmaps = None
+        # Position du curseur de comparaison, None tant qu'il n'a pas bougé
+        self.position = None
+
         self.label_image = QLabel()
         self.label_image.setAlignment(Qt.AlignCenter)
         self.label_image.setMinimumSize(1000, 600)
@@ -326,6 +487,11 @@ class ComparateurApplication(QWidget):
         self.bouton_stop.setStyleSheet("background-color: red; color: white;")
         self.bouton_stop.setFixedSize(380, 50)
 
+        self.bouton_inspecter = QPushButton("Inspecter (zoom)")
+        self.bouton_inspecter.clicked.connect(self.inspecter)
+        self.bouton_inspecter.setStyleSheet("background-color: gray; color: white;")
+        self.bouton_inspecter.setFixedSize(200, 50)
+
         self.slider_comparaison = QSlider(Qt.Horizontal)
         self.slider_comparaison.setRange(0, self.largeur)
         self.slider_comparaison.setValue(self.largeur // 2)
@@ -350,6 +516,7 @@ class ComparateurApplication(QWidget):
         layout_boutons.addWidget(self.bouton_retour)
         layout_boutons.addWidget(self.bouton_start)
         layout_boutons.addWidget(self.bouton_stop)
+        layout_boutons.addWidget(self.bouton_inspecter)
 
         layout = QVBoxLayout()
         layout.addWidget(self.label_image)
@@ -366,6 +533,7 @@ class ComparateurApplication(QWidget):
 
     def arreter_clignotement(self):
         self.timer_clignotement.stop()
+        self.position = None
         self.afficher(self.image_finale)
 
     def clignotement(self):
@@ -373,42 +541,126 @@ class ComparateurApplication(QWidget):
         self.affiche_originale = not self.affiche_originale
 
     def comparaison_curseur(self, position):
-        image_mixte = self.image_originale.copy()
-        image_mixte[:, position:] = self.image_finale[:, position:]
-        
-        image_mixte = cv.cvtColor(image_mixte, cv.COLOR_GRAY2BGR)
-        cv.line(
-            image_mixte,
-            (position, 0),
-            (position, self.hauteur),
-            (0, 0, 255),
-            2
-        )
+        self.position = position
+        self.preparer_pixmaps()
+
+        # Avant à gauche du curseur, après à droite, trait rouge à la séparation :
+        # deux copies découpées dans les images déjà à la taille d'affichage
+        largeur_affichee = self.pixmap_avant.width()
+        hauteur_affichee = self.pixmap_avant.height()
+        x = round(position * largeur_affichee / self.largeur)
+
+        with PROFILEUR.etape("affichage"):
+            painter = QPainter(self.pixmap_mixte)
+            painter.setClipRect(QRect(0, 0, x, hauteur_affichee))
+            painter.drawPixmap(0, 0, self.pixmap_avant)
+            painter.setClipRect(QRect(x, 0, largeur_affichee - x, hauteur_affichee))
+            painter.drawPixmap(0, 0, self.pixmap_apres)
+            painter.setClipping(False)
+            painter.setPen(QPen(QColor(255, 0, 0), 2))
+            painter.drawLine(x, 0, x, hauteur_affichee)
+            painter.end()
+            self.label_image.setPixmap(self.pixmap_mixte)
+
+    def preparer_pixmaps(self):
+        # Mise à l'échelle des deux images, seulement si la taille du label a changé
+        taille = (self.label_image.width(), self.label_image.height())
+        if self.pixmap_avant is not None and self.taille_pixmaps == taille:
+            return
+        with PROFILEUR.etape("mise à l'échelle"):
+            self.pixmap_avant = self.pixmap_affichage(self.image_originale, taille)
+            self.pixmap_apres = self.pixmap_affichage(self.image_finale, taille)
+            self.pixmap_mixte = QPixmap(self.pixmap_avant.size())
+        self.taille_pixmaps = taille
 
-        self.afficher(image_mixte)
+    def pixmap_affichage(self, image, taille):
+        return QPixmap.fromImage(qimage(image)).scaled(taille[0], taille[1], Qt.KeepAspectRatio)
 
     def afficher(self, image):
-        if len(image.shape) == 3:
-                image = cv.cvtColor(image, cv.COLOR_BGR2GRAY)
-
-        h, w = image.shape
-        qimg = QImage(image.data, w, h, w, QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(qimg).scaled(
-            self.label_image.width(),
-            self.label_image.height(),
-            Qt.KeepAspectRatio
-        )
-        self.label_image.setPixmap(pixmap)
+        # image : image_originale ou image_finale, affichée depuis sa version à l'échelle
+        self.preparer_pixmaps()
+        self.label_image.setPixmap(self.pixmap_avant if image is self.image_originale else self.pixmap_apres)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # Nouvelle taille du label : les images à l'échelle sont refaites au prochain affichage
+        if self.pixmap_avant is None:
+            return
+        if self.timer_clignotement.isActive():
+            self.afficher(self.image_finale if self.affiche_originale else self.image_originale)
+        elif self.position is not None:
+            self.comparaison_curseur(self.position)
+        else:
+            self.afficher(self.image_finale)
     
+    def inspecter(self):
+        self.arreter_clignotement()
+        self.interface_inspection = InspecteurAvantApres(self.image_originale, self.image_finale, self)
+        self.interface_inspection.showMaximized()
+        self.hide()
+
     def retour_interface_personnalisation(self):
         self.close()
         self.interface_personnalisation.showMaximized()
 
 
+# Interface 4 : Avant / Après côte à côte, avec zoom et déplacement communs
+class InspecteurAvantApres(QWidget):
+    def __init__(self, image_originale, image_finale, comparateur):
+        super().__init__()
+        self.comparateur = comparateur
+        self.setWindowTitle("Inspection Avant / Après")
+        self.resize(1200, 900)
+
+        # Une seule vue pour les deux images : zoomer ou déplacer l'une fait de même avec l'autre
+        self.vue = VueCommune()
+        self.visionneuse_avant = Visionneuse(self.vue)
+        self.visionneuse_apres = Visionneuse(self.vue)
+        self.visionneuse_avant.setMinimumSize(500, 500)
+        self.visionneuse_apres.setMinimumSize(500, 500)
+        self.visionneuse_avant.definir_image(image_originale)
+        self.visionneuse_apres.definir_image(image_finale)
+
+        self.bouton_ajuster = QPushButton("Image entière")
+        self.bouton_ajuster.setFixedSize(200, 50)
+        self.bouton_ajuster.setStyleSheet("background-color: gray; color: white; font-size: 16px;")
+        self.bouton_ajuster.clicked.connect(self.vue.ajuster)
+
+        self.bouton_retour = QPushButton("Retour")
+        self.bouton_retour.setFixedSize(120, 50)
+        self.bouton_retour.setStyleSheet("background-color: orange; color: white; font-size: 16px;")
+        self.bouton_retour.clicked.connect(self.retour_comparateur)
+
+        layout_images = QHBoxLayout()
+        for titre, visionneuse in (("Avant", self.visionneuse_avant), ("Après", self.visionneuse_apres)):
+            colonne = QVBoxLayout()
+            colonne.addWidget(QLabel(titre))
+            colonne.addWidget(visionneuse)
+            layout_images.addLayout(colonne)
+
+        layout_boutons = QHBoxLayout()
+        layout_boutons.addWidget(self.bouton_retour)
+        layout_boutons.addWidget(self.bouton_ajuster)
+
+        layout = QVBoxLayout()
+        layout.addLayout(layout_images)
+        layout.addWidget(QLabel("Molette : zoom, glisser : déplacement, double clic : image entière."))
+        layout.addLayout(layout_boutons)
+        self.setLayout(layout)
+
+    def retour_comparateur(self):
+        self.close()
+        self.comparateur.showMaximized()
+
+
 
 # Lancement de l'application
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     fenetre = InterfaceChoix()
     fenetre.showMaximized()
-    sys.exit(app.exec())
\ No newline at end of file
+    code = app.exec()
+    # STAR_REDUCTION_PROFIL=trace.json : trace de la session écrite à la fermeture
+    if FICHIER_TRACE:
+        PROFILEUR.exporter_trace(FICHIER_TRACE)
+    sys.exit(code)
\ No newline at end of file
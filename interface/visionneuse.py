@@ -0,0 +1,261 @@
+import math
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+from PySide6.QtWidgets import QWidget
+from PySide6.QtGui import QPainter, QPixmap, QImage, QColor
+from PySide6.QtCore import Qt, QObject, QRect, Signal
+
+from reduction.profilage import PROFILEUR
+
+# Côté des tuiles de la pyramide d'affichage (en pixels)
+TAILLE_TUILE = 256
+
+# Nombre de tuiles (QPixmap) gardées en mémoire par image
+NOMBRE_MAX_TUILES = 512
+
+# Zoom maximal (pixels d'écran par pixel de l'image) et facteur d'un cran de molette
+ZOOM_MAX = 16.0
+FACTEUR_MOLETTE = 1.25
+
+
+def qimage(image):
+    """
+    QImage qui lit directement les pixels d'une image uint8 monochrome
+    (hauteur, largeur) ou RGB (hauteur, largeur, 3) à lignes contiguës
+    (le tableau doit vivre aussi longtemps que la QImage).
+    """
+    hauteur, largeur = image.shape[:2]
+    format_image = QImage.Format_RGB888 if image.ndim == 3 else QImage.Format_Grayscale8
+    return QImage(image.data, largeur, hauteur, image.strides[0], format_image)
+
+
+class PyramideTuiles:
+    """
+    Image 8 bits (monochrome ou RGB) découpée en tuiles à plusieurs résolutions,
+    construites à la demande. Au niveau n, l'image est réduite 2^n fois ;
+    une tuile du niveau n est calculée directement depuis les pixels de
+    l'image qu'elle recouvre (cv.resize INTER_AREA).
+
+    Seules les tuiles affichées sont calculées ; leurs QPixmap sont gardés
+    dans un cache LRU de nombre_max tuiles.
+    """
+
+    def __init__(self, image, taille_tuile=TAILLE_TUILE, nombre_max=NOMBRE_MAX_TUILES):
+        self.image = image
+        self.taille_tuile = taille_tuile
+        self.nombre_max = nombre_max
+        self.hauteur, self.largeur = image.shape[:2]
+        # Dernier niveau : toute l'image tient dans une tuile
+        self.niveau_max = max(int(math.ceil(math.log2(max(self.hauteur, self.largeur) / taille_tuile))), 0)
+        self._tuiles = OrderedDict()
+
+    def dimensions(self, niveau):
+        """(hauteur, largeur) de l'image au niveau donné."""
+        f = 2 ** niveau
+        return -(-self.hauteur // f), -(-self.largeur // f)
+
+    def niveau_pour_zoom(self, zoom):
+        """Niveau le plus réduit encore au moins aussi détaillé que l'écran."""
+        if zoom >= 1:
+            return 0
+        return min(int(math.floor(math.log2(1 / zoom))), self.niveau_max)
+
+    def tuile(self, niveau, ty, tx):
+        """QPixmap de la tuile (ty, tx) du niveau donné."""
+        cle = (niveau, ty, tx)
+        if cle in self._tuiles:
+            self._tuiles.move_to_end(cle)
+            return self._tuiles[cle]
+
+        t, f = self.taille_tuile, 2 ** niveau
+        hauteur, largeur = self.dimensions(niveau)
+        h, w = min(t, hauteur - ty * t), min(t, largeur - tx * t)
+        source = self.image[ty * t * f:(ty * t + h) * f, tx * t * f:(tx * t + w) * f]
+        if niveau > 0:
+            source = cv.resize(source, (w, h), interpolation=cv.INTER_AREA)
+        source = np.ascontiguousarray(source)
+        # QPixmap.fromImage copie les pixels : le tableau peut disparaître ensuite
+        pixmap = QPixmap.fromImage(qimage(source))
+
+        self._tuiles[cle] = pixmap
+        if len(self._tuiles) > self.nombre_max:
+            self._tuiles.popitem(last=False)
+        return pixmap
+
+
+class VueCommune(QObject):
+    """
+    Centre (en pixels de l'image en pleine résolution) et zoom (pixels
+    d'écran par pixel de l'image), partagés par plusieurs visionneuses :
+    déplacer ou zoomer dans l'une déplace toutes les autres.
+    zoom None : image entière ajustée à la visionneuse.
+    """
+
+    changee = Signal()
+
+    def __init__(self):
+        super().__init__()
+        self.centre = None
+        self.zoom = None
+
+    def definir(self, centre, zoom):
+        self.centre = centre
+        self.zoom = zoom
+        self.changee.emit()
+
+    def ajuster(self):
+        self.definir(None, None)
+
+
+class Visionneuse(QWidget):
+    """
+    Affichage d'une image 8 bits (monochrome ou RGB) avec zoom (molette, autour du curseur),
+    déplacement (glisser) et retour à l'image entière (double clic).
+    Seules les tuiles visibles sont dessinées, au niveau de la pyramide
+    qui correspond au zoom.
+
+    L'image affichée peut être réduite (aperçu) : echelle est sa taille
+    par rapport à l'image en pleine résolution, dont les coordonnées
+    servent à la vue. Une zone déjà recalculée en pleine résolution peut
+    être posée par-dessus (afficher_zone) en attendant l'image complète.
+    """
+
+    def __init__(self, vue=None, parent=None):
+        super().__init__(parent)
+        self.vue = vue if vue is not None else VueCommune()
+        self.vue.changee.connect(self.update)
+        self.pyramide = None
+        self.echelle = 1.0
+        # (ligne, colonne) du coin de la zone posée par-dessus, et sa pyramide
+        self.origine_zone = None
+        self.pyramide_zone = None
+        self._glissement = None
+
+    def definir_image(self, image, echelle=1.0):
+        self.pyramide = PyramideTuiles(image)
+        self.echelle = echelle
+        self.origine_zone = None
+        self.pyramide_zone = None
+        self.update()
+
+    def afficher_zone(self, zone, image_zone):
+        """
+        Pose image_zone (pixels en pleine résolution) sur la zone
+        (y0, y1, x0, x1) jusqu'au prochain definir_image.
+        """
+        self.origine_zone = (zone[0], zone[2])
+        self.pyramide_zone = PyramideTuiles(image_zone)
+        self.update()
+
+    def taille_originale(self):
+        """(hauteur, largeur) de l'image en pleine résolution."""
+        return (round(self.pyramide.hauteur / self.echelle), round(self.pyramide.largeur / self.echelle))
+
+    def zoom(self):
+        if self.vue.zoom is not None:
+            return self.vue.zoom
+        hauteur, largeur = self.taille_originale()
+        return min(self.width() / largeur, self.height() / hauteur)
+
+    def centre(self):
+        if self.vue.centre is not None:
+            return self.vue.centre
+        hauteur, largeur = self.taille_originale()
+        return (largeur / 2, hauteur / 2)
+
+    def zone_visible(self):
+        """Rectangle (y0, y1, x0, x1) de l'image en pleine résolution visible à l'écran."""
+        hauteur, largeur = self.taille_originale()
+        zoom = self.zoom()
+        cx, cy = self.centre()
+        x0 = max(int(math.floor(cx - self.width() / (2 * zoom))), 0)
+        x1 = min(int(math.ceil(cx + self.width() / (2 * zoom))), largeur)
+        y0 = max(int(math.floor(cy - self.height() / (2 * zoom))), 0)
+        y1 = min(int(math.ceil(cy + self.height() / (2 * zoom))), hauteur)
+        return (y0, y1, x0, x1) if x0 < x1 and y0 < y1 else None
+
+    def vers_ecran(self, x, y):
+        zoom = self.zoom()
+        cx, cy = self.centre()
+        return (self.width() / 2 + (x - cx) * zoom, self.height() / 2 + (y - cy) * zoom)
+
+    def vers_image(self, x, y):
+        zoom = self.zoom()
+        cx, cy = self.centre()
+        return (cx + (x - self.width() / 2) / zoom, cy + (y - self.height() / 2) / zoom)
+
+    def paintEvent(self, event):
+        with PROFILEUR.etape("affichage"):
+            painter = QPainter(self)
+            painter.fillRect(self.rect(), QColor(40, 40, 40))
+            if self.pyramide is not None:
+                self.dessiner(painter, self.pyramide, self.echelle, (0, 0))
+                if self.pyramide_zone is not None:
+                    self.dessiner(painter, self.pyramide_zone, 1.0, self.origine_zone)
+            painter.end()
+
+    def dessiner(self, painter, pyramide, echelle, origine):
+        # origine : coin de l'image de la pyramide, en pixels de pleine résolution
+        zoom = self.zoom()
+        niveau = pyramide.niveau_pour_zoom(zoom / echelle)
+        # Taille d'un pixel du niveau en pixels de pleine résolution
+        pas = 2 ** niveau / echelle
+        t = pyramide.taille_tuile
+        hauteur, largeur = pyramide.dimensions(niveau)
+        oy, ox = origine
+
+        # Tuiles qui recouvrent l'écran
+        x0, y0 = self.vers_image(0, 0)
+        x1, y1 = self.vers_image(self.width(), self.height())
+        tx0, tx1 = max(int((x0 - ox) / pas) // t, 0), min(int((x1 - ox) / pas) // t, (largeur - 1) // t)
+        ty0, ty1 = max(int((y0 - oy) / pas) // t, 0), min(int((y1 - oy) / pas) // t, (hauteur - 1) // t)
+
+        # Réduction lissée, agrandissement au plus proche voisin (pixels visibles tels quels)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, zoom * pas < 1)
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                pixmap = pyramide.tuile(niveau, ty, tx)
+                # Bords arrondis de la même façon pour deux tuiles voisines : pas de
+                # joint ni de tuile plus large d'un pixel (round arrondit au pair)
+                gauche, haut = self.vers_ecran(ox + tx * t * pas, oy + ty * t * pas)
+                droite, bas = self.vers_ecran(ox + (tx * t + pixmap.width()) * pas,
+                                              oy + (ty * t + pixmap.height()) * pas)
+                gauche, haut = math.floor(gauche + 0.5), math.floor(haut + 0.5)
+                droite, bas = math.floor(droite + 0.5), math.floor(bas + 0.5)
+                cible = QRect(gauche, haut, droite - gauche, bas - haut)
+                painter.drawPixmap(cible, pixmap)
+
+    def wheelEvent(self, event):
+        if self.pyramide is None:
+            return
+        # Zoom autour du point sous le curseur, qui reste en place
+        position = event.position()
+        x, y = self.vers_image(position.x(), position.y())
+        ajuste = min(self.width() / self.taille_originale()[1], self.height() / self.taille_originale()[0])
+        zoom = self.zoom() * FACTEUR_MOLETTE ** (event.angleDelta().y() / 120)
+        zoom = min(max(zoom, ajuste / 4), ZOOM_MAX)
+        centre = (x - (position.x() - self.width() / 2) / zoom, y - (position.y() - self.height() / 2) / zoom)
+        self.vue.definir(centre, zoom)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self._glissement = event.position()
+
+    def mouseMoveEvent(self, event):
+        if self._glissement is None or self.pyramide is None:
+            return
+        position = event.position()
+        zoom = self.zoom()
+        cx, cy = self.centre()
+        centre = (cx - (position.x() - self._glissement.x()) / zoom, cy - (position.y() - self._glissement.y()) / zoom)
+        self._glissement = position
+        self.vue.definir(centre, zoom)
+
+    def mouseReleaseEvent(self, event):
+        self._glissement = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.vue.ajuster()
@@ -0,0 +1,255 @@
+"""
+Réduction des étoiles sur des lots de fichiers FITS.
+
+Exemples :
+    python main.py examples/
+    python main.py "nuit_*/**/*.fits" -o results/lot -j 4
+    python main.py grandes_images/ --tuiles
+    python main.py "nuit_1/m42_*.fits" --sequence
+    python main.py examples/ --fits --sans-png
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+from erosion import reduire_fits, reduire_fits_sequence
+from reduction.cache_disque import CacheDisque
+from reduction.reducteur import ignorer_avertissements_detection
+from reduction.fond import FONDS
+from reduction.sequence import SUIVIS
+from reduction.sortie import COMPRESSION, COMPRESSIONS, ReglagesSortie
+
+EXTENSIONS_FITS = (".fits", ".fit", ".fts")
+
+
+def lister_fichiers(entrees):
+    """Fichiers FITS désignés par des motifs glob ou des dossiers (parcourus récursivement)."""
+    fichiers = set()
+    for entree in entrees:
+        if os.path.isdir(entree):
+            for racine, _, noms in os.walk(entree):
+                fichiers.update(os.path.join(racine, nom) for nom in noms if nom.lower().endswith(EXTENSIONS_FITS))
+        else:
+            fichiers.update(f for f in glob.glob(entree, recursive=True) if os.path.isfile(f))
+    return sorted(os.path.abspath(f) for f in fichiers)
+
+
+def dossiers_sortie(fichiers, sortie):
+    """
+    Un dossier de sortie par fichier, qui reprend son chemin relatif au
+    dossier commun des entrées (deux fichiers de même nom ne se mélangent pas).
+    """
+    if not fichiers:
+        return {}
+    commun = os.path.commonpath([os.path.dirname(f) for f in fichiers])
+    return {f: os.path.join(sortie, os.path.splitext(os.path.relpath(f, commun))[0]) for f in fichiers}
+
+
+def resultat_attendu(dossier, fits):
+    return os.path.join(dossier, "image_finale.fits" if fits else "image_finale.png")
+
+
+def est_a_jour(fichier, dossier, fits):
+    resultat = resultat_attendu(dossier, fits)
+    return os.path.exists(resultat) and os.path.getmtime(resultat) >= os.path.getmtime(fichier)
+
+
+def traiter_fichier(fichier, dossier, tuiles, utiliser_cache, fond, sortie=None):
+    """Réduit un fichier dans un processus de travail et renvoie sa ligne du manifeste."""
+    ignorer_avertissements_detection()
+    sortie = ReglagesSortie() if sortie is None else sortie
+    debut = time.perf_counter()
+    ligne = {"entree": fichier, "sortie": dossier}
+    try:
+        if tuiles:
+            from reduction.tuiles import reduire_fits_par_tuiles
+
+            os.makedirs(dossier, exist_ok=True)
+            ligne["nb_etoiles"] = reduire_fits_par_tuiles(fichier, resultat_attendu(dossier, sortie.fits))
+        else:
+            cache_disque = CacheDisque() if utiliser_cache else None
+            ligne["nb_etoiles"] = reduire_fits(fichier, dossier, afficher_infos=False, cache_disque=cache_disque,
+                                               fond=fond, sortie=sortie)
+        ligne["statut"] = "traite"
+    except Exception as erreur:
+        ligne["statut"] = "erreur"
+        ligne["erreur"] = f"{type(erreur).__name__}: {erreur}"
+    ligne["duree_s"] = round(time.perf_counter() - debut, 3)
+    return ligne
+
+
+def traiter_sequence(fichiers, dossiers, suivi, utiliser_cache, fond, sortie=None):
+    """
+    Réduit les fichiers d'une séquence de poses alignées, un par un et dans
+    l'ordre (les étoiles d'une pose sont suivies depuis la référence), et
+    renvoie leurs lignes du manifeste au fur et à mesure. Les fichiers d'une
+    pose sont écrits par un thread d'entrées/sorties pendant le calcul de la
+    suivante : sa ligne n'est renvoyée qu'une fois ses fichiers écrits.
+    duree_s est le calcul de la pose seule, attente_ecriture_s le temps
+    passé ensuite à attendre ses écritures.
+    """
+    from erosion import COURBE_NOYAUX, FWHM_PSF, SEUILS_FOND
+    from reduction.sequence import SequenceReducer
+    from reduction.sortie import EcrivainFichiers
+
+    ignorer_avertissements_detection()
+    cache_disque = CacheDisque() if utiliser_cache else None
+    sequence = SequenceReducer(SEUILS_FOND[fond], FWHM_PSF, COURBE_NOYAUX, suivi=suivi, cache_disque=cache_disque,
+                               fond=fond)
+
+    def terminer(ligne):
+        # Fin des écritures de la pose (une erreur d'écriture est celle de son fichier)
+        debut = time.perf_counter()
+        try:
+            ecrivain.attendre(ligne["sortie"])
+        except Exception as erreur:
+            if ligne["statut"] == "traite":
+                ligne["statut"] = "erreur"
+                ligne["erreur"] = f"{type(erreur).__name__}: {erreur}"
+        ligne["attente_ecriture_s"] = round(time.perf_counter() - debut, 3)
+        return ligne
+
+    with EcrivainFichiers() as ecrivain:
+        en_cours = None
+        for fichier in fichiers:
+            debut = time.perf_counter()
+            ligne = {"entree": fichier, "sortie": dossiers[fichier]}
+            try:
+                ligne["nb_etoiles"] = reduire_fits_sequence(sequence, fichier, dossiers[fichier],
+                                                            afficher_infos=False, ecrivain=ecrivain, sortie=sortie)
+                if sequence.decalage is not None:
+                    ligne["decalage"] = [round(d, 3) for d in sequence.decalage]
+                ligne["statut"] = "traite"
+            except Exception as erreur:
+                ligne["statut"] = "erreur"
+                ligne["erreur"] = f"{type(erreur).__name__}: {erreur}"
+            # Calcul de cette pose seulement (pas celui de la suivante, fait avant terminer)
+            ligne["duree_s"] = round(time.perf_counter() - debut, 3)
+            if en_cours is not None:
+                yield terminer(en_cours)
+            en_cours = ligne
+        if en_cours is not None:
+            yield terminer(en_cours)
+
+
+def afficher_ligne(i, nombre, ligne):
+    detail = ligne.get("erreur") or f"{ligne['nb_etoiles']} étoiles"
+    print(f"[{i}/{nombre}] {ligne['entree']} : {ligne['statut']} en {ligne['duree_s']} s ({detail})")
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Réduction des étoiles sur des lots de fichiers FITS.")
+    parser.add_argument("entrees", nargs="+", help="fichiers, motifs glob (entre guillemets) ou dossiers")
+    parser.add_argument("-o", "--sortie", default="./results", help="dossier de sortie (défaut : ./results)")
+    parser.add_argument("-j", "--processus", type=int, default=os.cpu_count() or 1,
+                        help="nombre de fichiers traités en même temps (défaut : nombre de cœurs)")
+    parser.add_argument("-f", "--force", action="store_true", help="retraiter même les sorties à jour")
+    parser.add_argument("--tuiles", action="store_true",
+                        help="traitement par tuiles pour les images trop grandes pour la mémoire "
+                             "(écrit seulement image_finale.png)")
+    parser.add_argument("--sans-cache", action="store_true",
+                        help="ne pas lire ni écrire le cache disque des détections")
+    parser.add_argument("--fond", choices=FONDS, default="global",
+                        help="fond soustrait avant la détection : médiane de l'image ou carte du fond "
+                             "variable (nébuleuse, gradient) (défaut : global)")
+    parser.add_argument("--sequence", action="store_true",
+                        help="poses alignées du même champ : étoiles détectées sur la première "
+                             "puis suivies sur les autres (fichiers traités dans l'ordre, un seul processus)")
+    parser.add_argument("--suivi", choices=SUIVIS, default="centroides",
+                        help="avec --sequence : centroïde local de chaque étoile ou décalage global "
+                             "(défaut : centroides)")
+    parser.add_argument("--fits", action="store_true",
+                        help="écrire aussi image_finale.fits : image finale en float32 dans les unités de "
+                             "l'image d'origine, avec son en-tête, compressée par tuiles")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+                        help=f"avec --fits : compression des tuiles (défaut : {COMPRESSION}, sans perte)")
+    parser.add_argument("--quantification", type=float,
+                        help="avec --fits : niveau de quantification des float32 (avec perte, "
+                             "obligatoire pour RICE_1)")
+    parser.add_argument("--sans-png", action="store_true",
+                        help="avec --fits : ne pas écrire les PNG (original, masques, image érodée et finale)")
+    parser.add_argument("--manifeste", help="chemin du manifeste JSON (défaut : dans le dossier de sortie)")
+    args = parser.parse_args(arguments)
+
+    if args.sequence and args.tuiles:
+        parser.error("--sequence et --tuiles ne vont pas ensemble")
+    if args.tuiles and args.fond != "global":
+        parser.error("--tuiles n'utilise que le fond global")
+    if args.tuiles and (args.fits or args.compression or args.quantification is not None or args.sans_png):
+        parser.error("--tuiles écrit seulement image_finale.png (sans --fits, --compression, "
+                     "--quantification ni --sans-png)")
+    if args.sans_png and not args.fits:
+        parser.error("--sans-png demande --fits (sinon aucune image n'est écrite)")
+    try:
+        sortie = ReglagesSortie(png=not args.sans_png, fits=args.fits, compression=args.compression or COMPRESSION,
+                                quantification=args.quantification)
+    except ValueError as erreur:
+        parser.error(str(erreur))
+
+    fichiers = lister_fichiers(args.entrees)
+    if not fichiers:
+        print("Aucun fichier FITS trouvé.")
+        return 1
+
+    dossiers = dossiers_sortie(fichiers, args.sortie)
+    debut_lot = datetime.now()
+    debut = time.perf_counter()
+    lignes = []
+
+    a_traiter = []
+    for fichier in fichiers:
+        if not args.force and est_a_jour(fichier, dossiers[fichier], sortie.fits):
+            lignes.append({"entree": fichier, "sortie": dossiers[fichier], "statut": "a_jour"})
+        else:
+            a_traiter.append(fichier)
+    print(f"{len(fichiers)} fichier(s), {len(a_traiter)} à traiter, {len(fichiers) - len(a_traiter)} à jour")
+
+    # Une séquence est traitée dans l'ordre, dans ce processus
+    processus = 1 if args.sequence else max(args.processus, 1)
+    if args.sequence:
+        resultats = traiter_sequence(a_traiter, dossiers, args.suivi, not args.sans_cache, args.fond, sortie)
+        for i, ligne in enumerate(resultats, 1):
+            lignes.append(ligne)
+            afficher_ligne(i, len(a_traiter), ligne)
+    else:
+        # Chaque processus ne charge qu'un fichier à la fois : la mémoire utilisée
+        # dépend du nombre de processus, pas de la taille du lot
+        with ProcessPoolExecutor(max_workers=processus) as pool:
+            taches = [pool.submit(traiter_fichier, f, dossiers[f], args.tuiles, not args.sans_cache, args.fond,
+                                  sortie)
+                      for f in a_traiter]
+            for i, tache in enumerate(as_completed(taches), 1):
+                ligne = tache.result()
+                lignes.append(ligne)
+                afficher_ligne(i, len(a_traiter), ligne)
+
+    lignes.sort(key=lambda ligne: ligne["entree"])
+    manifeste = {
+        "debut": debut_lot.isoformat(timespec="seconds"),
+        "duree_s": round(time.perf_counter() - debut, 3),
+        "processus": processus,
+        "tuiles": args.tuiles,
+        "fond": args.fond,
+        "sequence": args.suivi if args.sequence else None,
+        "sortie": {"png": sortie.png, "fits": sortie.fits, "compression": sortie.compression if sortie.fits else None,
+                   "quantification": sortie.quantification if sortie.fits else None},
+        "fichiers": lignes,
+    }
+    chemin_manifeste = args.manifeste or os.path.join(
+        args.sortie, f"manifeste_{debut_lot.strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(chemin_manifeste)), exist_ok=True)
+    with open(chemin_manifeste, "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, indent=2, ensure_ascii=False)
+    print(f"Manifeste : {chemin_manifeste}")
+
+    return 1 if any(ligne["statut"] == "erreur" for ligne in lignes) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+Cœur réutilisable de la réduction d'étoiles, partagé par erosion.py
+et par l'interface utilisateur (voir StarReducer).
+
+Les classes sont importées à la première utilisation : importer le
+paquet ne charge ni photutils, ni astropy, ni OpenCV.
+"""
+import importlib
+
+_MODULES = {
+    "StarReducer": "reduction.reducteur",
+    "Detection": "reduction.reducteur",
+    "Masques": "reduction.reducteur",
+    "Reduction": "reduction.reducteur",
+    "SequenceReducer": "reduction.sequence",
+    "CacheDetection": "reduction.detection",
+    "PyramideApercu": "reduction.apercu",
+    "CacheDisque": "reduction.cache_disque",
+    "CourbeNoyaux": "reduction.noyaux",
+    "EmpreintesEtoiles": "reduction.empreintes",
+}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(nom):
+    if nom not in _MODULES:
+        raise AttributeError(f"module 'reduction' has no attribute '{nom}'")
+    return getattr(importlib.import_module(_MODULES[nom]), nom)
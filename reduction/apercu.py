@@ -0,0 +1,73 @@
+import math
+
+import cv2 as cv
+
+from reduction.reducteur import StarReducer
+
+
+class NiveauApercu(StarReducer):
+    """
+    Un niveau de la pyramide : StarReducer sur l'image réduite d'un facteur
+    echelle, avec son propre cache de détection, ses images érodées, les
+    empreintes et le masque de ses dernières étoiles et ses tampons de
+    calcul (réutilisés d'une mise à jour à l'autre).
+
+    Les paramètres exprimés en pixels de l'image d'origine (FWHM, noyau)
+    sont ramenés à l'échelle du niveau.
+    """
+
+    def __init__(self, image, echelle, sigma=3.0, seuil_min=None, cache_disque=None, fond="global"):
+        # Une image couleur (hauteur, largeur, 3) est détectée sur sa luminance
+        super().__init__(image, echelle=echelle, sigma=sigma, seuil_min=seuil_min, cache_disque=cache_disque,
+                         tampons=True, fond=fond)
+
+
+class PyramideApercu:
+    """
+    Pyramide d'images réduites de moitié à chaque niveau (cv.pyrDown),
+    construite à la demande. Le niveau 0 est l'image en pleine résolution.
+    L'image peut être en float32 (données FITS normalisées sans passer
+    par 8 bits) : détection, érosion et fusion se font alors en float32.
+    Elle peut être en couleur (hauteur, largeur, 3) : chaque niveau garde
+    les canaux entrelacés, détecte sur la luminance et traite les canaux
+    ensemble. fond : estimation du fond des nouveaux niveaux (voir
+    StarReducer ; chaque niveau peut en changer avec changer_fond).
+    """
+
+    def __init__(self, image, sigma=3.0, seuil_min=None, cache_disque=None, fond="global"):
+        self.sigma = sigma
+        self.fond = fond
+        self.seuil_min = seuil_min
+        self.cache_disque = cache_disque
+        self._images = [image]
+        self._niveaux = {}
+
+    def niveau(self, n):
+        """Renvoie le niveau n (construit avec les niveaux intermédiaires si besoin)."""
+        while len(self._images) <= n:
+            self._images.append(cv.pyrDown(self._images[-1]))
+        if n not in self._niveaux:
+            self._niveaux[n] = NiveauApercu(self._images[n], 0.5 ** n, self.sigma, self.seuil_min,
+                                            self.cache_disque, self.fond)
+        return self._niveaux[n]
+
+    def niveau_pour_affichage(self, largeur, hauteur):
+        """
+        Numéro du plus petit niveau encore au moins aussi grand que la
+        zone d'affichage (l'image y est réduite en gardant ses proportions).
+        """
+        h, w = self._images[0].shape[:2]
+        return self.niveau_pour_echelle(min(largeur / w, hauteur / h))
+
+    def niveau_pour_echelle(self, echelle):
+        """
+        Numéro du plus petit niveau encore au moins aussi détaillé que
+        l'affichage, pour une image affichée à echelle pixels d'écran par
+        pixel (zoom de la visionneuse).
+        """
+        if echelle >= 1:
+            return 0
+        h, w = self._images[0].shape[:2]
+        n = int(math.floor(math.log2(1 / echelle)))
+        # cv.pyrDown ne descend pas sous 1 pixel
+        return min(n, int(math.log2(min(h, w))))
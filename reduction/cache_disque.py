@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+# Dossier du cache (modifiable avec la variable d'environnement STAR_REDUCTION_CACHE)
+DOSSIER_CACHE = os.environ.get(
+    "STAR_REDUCTION_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "star-reduction")
+)
+
+# Taille maximale du cache sur le disque, en octets
+TAILLE_MAX_CACHE = 512 * 1024 * 1024
+
+# Version des entrées, dans la clé de chacune : à augmenter quand
+# l'estimation du fond ou le contenu des entrées change (les anciennes
+# entrées ne sont alors plus jamais lues). 2 : fond estimé sur un
+# sous-échantillon ou par boîtes (reduction.fond)
+VERSION_CACHE = 2
+
+
+def empreinte_image(image):
+    """Empreinte du contenu de l'image (pixels, forme et type)."""
+    image = np.ascontiguousarray(image)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(f"{image.shape}{image.dtype.str}".encode())
+    h.update(memoryview(image).cast("B"))
+    return h.hexdigest()
+
+
+class CacheDisque:
+    """
+    Cache persistant des statistiques de fond et des catalogues d'étoiles.
+
+    Chaque entrée est un fichier .npz nommé d'après l'empreinte des pixels
+    et les paramètres de détection : une image déjà vue (même contenu,
+    mêmes paramètres) n'est plus jamais analysée. Quand le dossier dépasse
+    taille_max, les fichiers les moins récemment utilisés sont supprimés.
+    """
+
+    def __init__(self, dossier=DOSSIER_CACHE, taille_max=TAILLE_MAX_CACHE):
+        self.dossier = dossier
+        self.taille_max = taille_max
+        os.makedirs(dossier, exist_ok=True)
+
+    def chemin(self, empreinte, **parametres):
+        description = ";".join(f"{nom}={float(valeur)!r}" for nom, valeur in sorted(parametres.items()))
+        cle = hashlib.blake2b(f"{empreinte};version={VERSION_CACHE};{description}".encode(),
+                              digest_size=20).hexdigest()
+        return os.path.join(self.dossier, f"{cle}.npz")
+
+    def lire_statistiques(self, empreinte, sigma):
+        """Renvoie (moyenne, mediane, std) ou None si absentes du cache."""
+        return self._lire(self.chemin(empreinte, sigma=sigma),
+                          lambda contenu: tuple(float(v) for v in contenu["statistiques"]))
+
+    def ecrire_statistiques(self, empreinte, sigma, statistiques):
+        self._ecrire(self.chemin(empreinte, sigma=sigma), {"statistiques": np.asarray(statistiques, dtype=np.float64)})
+
+    def lire_maillage(self, empreinte, sigma, boite):
+        """Renvoie (fond, cote, bruit) du fond par boîtes (voir reduction.fond) ou None."""
+        return self._lire(self.chemin(empreinte, sigma=sigma, boite=boite),
+                          lambda contenu: (contenu["fond"], tuple(int(c) for c in contenu["cote"]),
+                                           float(contenu["bruit"])))
+
+    def ecrire_maillage(self, empreinte, sigma, boite, maillage):
+        fond, cote, bruit = maillage
+        self._ecrire(self.chemin(empreinte, sigma=sigma, boite=boite),
+                     {"fond": fond, "cote": np.array(cote), "bruit": np.array(bruit)})
+
+    def chemin_catalogue(self, empreinte, sigma, threshold_sigma, fwhm, boite):
+        # boite : taille des boîtes du fond quand une carte du fond a été soustraite
+        parametres = {"sigma": sigma, "threshold": threshold_sigma, "fwhm": fwhm}
+        if boite is not None:
+            parametres["boite"] = boite
+        return self.chemin(empreinte, **parametres)
+
+    def lire_catalogue(self, empreinte, sigma, threshold_sigma, fwhm, boite=None):
+        """
+        Renvoie (trouve, sources). sources vaut None quand la détection
+        n'avait trouvé aucune étoile, comme DAOStarFinder.
+        """
+        def catalogue(contenu):
+            if contenu["aucune"]:
+                return True, None
+            from astropy.table import Table
+
+            colonnes = [str(nom) for nom in contenu["colonnes"]]
+            return True, Table([contenu[f"col_{nom}"] for nom in colonnes], names=colonnes)
+
+        resultat = self._lire(self.chemin_catalogue(empreinte, sigma, threshold_sigma, fwhm, boite), catalogue)
+        return (False, None) if resultat is None else resultat
+
+    def ecrire_catalogue(self, empreinte, sigma, threshold_sigma, fwhm, sources, boite=None):
+        if sources is None:
+            tableaux = {"aucune": np.array(True)}
+        else:
+            tableaux = {"aucune": np.array(False), "colonnes": np.array(sources.colnames)}
+            for nom in sources.colnames:
+                tableaux[f"col_{nom}"] = np.asarray(sources[nom])
+        self._ecrire(self.chemin_catalogue(empreinte, sigma, threshold_sigma, fwhm, boite), tableaux)
+
+    def _lire(self, chemin, decoder):
+        """
+        decoder(npz) de l'entrée, ou None si elle est absente. Une entrée
+        abîmée (fichier tronqué, tableau manquant) est supprimée et compte
+        comme absente : elle est recalculée puis écrite à nouveau.
+        """
+        try:
+            with np.load(chemin) as npz:
+                resultat = decoder(npz)
+            # Date d'accès mise à jour pour l'éviction LRU
+            os.utime(chemin)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+            return None
+        return resultat
+
+    def _ecrire(self, chemin, tableaux):
+        # Écriture dans un fichier temporaire puis renommage : un autre
+        # processus ne lit jamais une entrée à moitié écrite
+        fd, temporaire = tempfile.mkstemp(suffix=".tmp", dir=self.dossier)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **tableaux)
+            os.replace(temporaire, chemin)
+        except BaseException:
+            # Disque plein, interruption : pas de fichier temporaire laissé dans le cache
+            if os.path.exists(temporaire):
+                os.remove(temporaire)
+            raise
+        self._evincer()
+
+    def _evincer(self):
+        entrees = []
+        for nom in os.listdir(self.dossier):
+            if not nom.endswith(".npz"):
+                continue
+            try:
+                infos = os.stat(os.path.join(self.dossier, nom))
+            except FileNotFoundError:
+                continue
+            entrees.append((infos.st_mtime, infos.st_size, nom))
+
+        total = sum(taille for _, taille, _ in entrees)
+        for _, taille, nom in sorted(entrees):
+            if total <= self.taille_max:
+                break
+            try:
+                os.remove(os.path.join(self.dossier, nom))
+            except FileNotFoundError:
+                pass
+            total -= taille
@@ -0,0 +1,62 @@
+import cv2 as cv
+import numpy as np
+
+
+def cube_hwc(data):
+    """
+    Image FITS en tableau (hauteur, largeur, 3) contigu, ou en image
+    monochrome (hauteur, largeur). Les FITS couleur rangent en général
+    les canaux en premier (3, hauteur, largeur) : une seule copie les
+    entrelace. Un cube d'un seul plan est ramené à ce plan ; un cube
+    d'un autre nombre de plans (filtres, poses empilées) est moyenné
+    sur ses plans, comme dans la version d'origine de l'interface.
+    """
+    if data.ndim > 2:
+        data = np.squeeze(data)
+    if data.ndim <= 2 or (data.ndim == 3 and data.shape[-1] == 3):
+        return data
+    if data.ndim == 3 and data.shape[0] == 3:
+        return np.ascontiguousarray(np.moveaxis(data, 0, -1))
+    return np.mean(data, axis=tuple(range(data.ndim - 2)))
+
+
+def bornes_canaux(image):
+    """(minimum, etendue) de chaque canal (tous les canaux d'un coup), ou de l'image monochrome."""
+    minimum = image.min(axis=(0, 1))
+    return minimum, image.max(axis=(0, 1)) - minimum
+
+
+def normaliser_canaux(image, dtype=np.float32):
+    """
+    Copie de l'image en dtype où chaque canal est ramené entre 0 et 255
+    (son minimum à 0, son maximum à 255). Minimums et maximums sont
+    calculés pour tous les canaux d'un coup, puis la copie est modifiée
+    sur place : pas de boucle ni de copie par canal.
+    """
+    donnees = np.array(np.nan_to_num(image), dtype=dtype)
+    minimum, etendue = bornes_canaux(donnees)
+    donnees -= minimum
+    donnees *= 255 / np.where(etendue > 0, etendue, 1)
+    return donnees
+
+
+def luminance(image):
+    """
+    Image en niveaux de gris (2 dimensions) pour la détection des étoiles :
+    luminance d'une image RGB (hauteur, largeur, 3), moyenne des canaux
+    pour un autre nombre de canaux, image monochrome inchangée.
+    """
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 3:
+        if image.dtype not in (np.uint8, np.float32):
+            image = image.astype(np.float32)
+        return cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+    return image.mean(axis=2, dtype=np.float32)
+
+
+def enregistrer_png(chemin, image):
+    """cv.imwrite d'une image monochrome ou RGB (OpenCV attend les canaux en BGR)."""
+    if image.ndim == 3 and image.shape[2] == 3:
+        image = cv.cvtColor(image, cv.COLOR_RGB2BGR)
+    return cv.imwrite(chemin, image)
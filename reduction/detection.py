@@ -0,0 +1,270 @@
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from reduction.cache_disque import empreinte_image
+from reduction.fond import FONDS, TAILLE_BOITE, carte_fond, maillage_fond, statistiques_sous_echantillon
+from reduction.profilage import PROFILEUR
+
+
+# Nombre de catalogues gardés en mémoire par image
+TAILLE_CACHE_DETECTION = 16
+
+
+class IndexSeuil:
+    """
+    Catalogue détecté une seule fois au seuil le plus bas, trié par
+    significativité du pic.
+
+    Les sources trouvées à un seuil plus haut sont un sous-ensemble de
+    celles trouvées au seuil bas : un pic local du produit de convolution
+    reste un pic local, seul le test « pic > seuil » change. Chaque
+    nouveau seuil se résout donc par une recherche dichotomique et une
+    tranche, sans relancer DAOStarFinder.
+    """
+
+    def __init__(self, catalogue, std, fwhm, seuil_min):
+        # catalogue : sortie de DAOStarFinder au seuil seuil_min
+        self.catalogue = catalogue
+        self.std = std
+        self.fwhm = fwhm
+        self.seuil_min = seuil_min
+
+        if self.catalogue is None:
+            self.significativite_triee = np.empty(0)
+            self.ordre = np.empty(0, dtype=np.intp)
+            return
+
+        # daofind_mag = -2.5 log10(pic convolué / seuil effectif), d'où la
+        # hauteur du pic convolué exprimée en nombre de sigma
+        significativite = seuil_min * 10 ** (-0.4 * np.asarray(self.catalogue["daofind_mag"]))
+
+        # Tri décroissant : les étoiles gardées à un seuil forment un préfixe
+        self.ordre = np.argsort(-significativite, kind="stable")
+        self.significativite_triee = significativite[self.ordre]
+
+    def filtrer(self, threshold_sigma):
+        """
+        Renvoie les sources au seuil demandé (en nombre de sigma),
+        dans le même ordre et avec les mêmes colonnes que DAOStarFinder.
+        """
+        if threshold_sigma < self.seuil_min:
+            raise ValueError(f"Seuil {threshold_sigma} inférieur au seuil de l'index ({self.seuil_min})")
+
+        # Nombre d'étoiles dont le pic dépasse strictement le seuil
+        n = np.searchsorted(-self.significativite_triee, -threshold_sigma, side="left")
+        if n == 0:
+            return None
+
+        # On remet les étoiles dans l'ordre de DAOStarFinder
+        indices = np.sort(self.ordre[:n])
+        sources = self.catalogue[indices]
+        sources["id"] = np.arange(1, n + 1)
+        sources["daofind_mag"] = sources["daofind_mag"] + 2.5 * np.log10(threshold_sigma / self.seuil_min)
+        return sources
+
+    def valider(self, image_soustraite, threshold_sigma):
+        """
+        Compare le catalogue filtré à une vraie détection DAOStarFinder.
+        Renvoie (identiques, sources_filtrees, sources_detectees).
+        """
+        from photutils.detection import DAOStarFinder
+
+        filtrees = self.filtrer(threshold_sigma)
+        daofind = DAOStarFinder(fwhm=self.fwhm, threshold=threshold_sigma * self.std)
+        detectees = daofind(image_soustraite)
+        return comparer_catalogues(filtrees, detectees), filtrees, detectees
+
+
+def comparer_catalogues(a, b):
+    """
+    Vrai si deux catalogues contiennent les mêmes étoiles avec les mêmes
+    mesures (daofind_mag comparé à la précision flottante près).
+    """
+    if a is None or b is None:
+        return a is None and b is None
+    if len(a) != len(b) or a.colnames != b.colnames:
+        return False
+
+    for nom in a.colnames:
+        col_a = np.asarray(a[nom])
+        col_b = np.asarray(b[nom])
+        if nom == "daofind_mag":
+            if not np.allclose(col_a, col_b, rtol=1e-9, atol=1e-9, equal_nan=True):
+                return False
+        elif not np.array_equal(col_a, col_b, equal_nan=np.issubdtype(col_a.dtype, np.floating)):
+            return False
+    return True
+
+
+class CacheDetection:
+    """
+    Détection d'étoiles avec cache pour une image chargée.
+
+    Les statistiques de fond de ciel sont calculées une seule fois,
+    puis chaque catalogue de sources est gardé en mémoire sous la clé
+    (seuil, FWHM). Les catalogues les moins récemment utilisés sont
+    supprimés quand le cache est plein (LRU).
+
+    Si seuil_min est donné, une seule détection est faite à ce seuil et
+    les seuils plus hauts sont obtenus par filtrage (voir IndexSeuil).
+    Avec validation=True, chaque catalogue filtré est comparé à une vraie
+    détection et c'est cette dernière qui est gardée en cas d'écart.
+
+    Le fond est estimé sur un sous-échantillon de l'image (voir
+    reduction.fond) : fond="global" soustrait sa médiane, fond="carte"
+    soustrait une carte du fond interpolée entre des boîtes de
+    taille_boite pixels (nébuleuse, gradient) et std est alors le bruit
+    de l'image après soustraction de la carte.
+
+    Avec un cache_disque (voir CacheDisque), statistiques et catalogues
+    sont aussi relus depuis le disque : rouvrir une image déjà analysée
+    ne relance ni l'estimation du fond ni DAOStarFinder.
+
+    statistiques : (moyenne, mediane, std) déjà estimées pour le fond
+    global, par exemple sur toute l'image quand image n'en est qu'une
+    tuile (voir reduction.tuiles) : elles ne sont pas recalculées.
+    """
+
+    def __init__(self, image, sigma=3.0, taille_max=TAILLE_CACHE_DETECTION,
+                 seuil_min=None, validation=False, cache_disque=None, fond="global", taille_boite=TAILLE_BOITE,
+                 statistiques=None):
+        # Une image float32 est gardée telle quelle (pas de copie en float64)
+        dtype = np.float32 if np.asarray(image).dtype == np.float32 else np.float64
+        self.image_float = np.asarray(image, dtype=dtype)
+        self.sigma = sigma
+        self.taille_max = taille_max
+        self.seuil_min = seuil_min
+        self.validation = validation
+        self.cache_disque = cache_disque
+        self.empreinte = None if cache_disque is None else empreinte_image(self.image_float)
+
+        # Calcul des statistiques de fond de ciel (une seule fois par image)
+        # moyenne : moyenne du fond
+        # mediane : valeur du fond de ciel
+        # std : écart-type du bruit
+        if fond == "carte":
+            self.boite = taille_boite
+            self.fond, self.std, self.image_soustraite = self.estimer_carte()
+            self.moyenne, self.mediane = float(self.fond.mean()), float(np.median(self.fond))
+        elif fond == "global":
+            self.boite = None
+            self.fond = None
+            if statistiques is None:
+                statistiques = self.estimer_statistiques()
+            self.moyenne, self.mediane, self.std = statistiques
+            # Image après soustraction du fond (même type que image_float),
+            # réutilisée par chaque détection
+            self.image_soustraite = np.subtract(self.image_float, self.mediane, dtype=self.image_float.dtype)
+        else:
+            raise ValueError(f"Fond inconnu : {fond} (possibles : {', '.join(FONDS)})")
+
+        self._catalogues = OrderedDict()
+        # Un index par FWHM, construit à la première demande
+        self._index = {}
+
+    def estimer_statistiques(self):
+        """(moyenne, mediane, std) du fond, relues depuis le cache disque si possible."""
+        statistiques = None
+        if self.cache_disque is not None:
+            statistiques = self.cache_disque.lire_statistiques(self.empreinte, self.sigma)
+        if statistiques is None:
+            with PROFILEUR.etape("statistiques"):
+                statistiques = statistiques_sous_echantillon(self.image_float, sigma=self.sigma)
+            if self.cache_disque is not None:
+                self.cache_disque.ecrire_statistiques(self.empreinte, self.sigma, statistiques)
+        return statistiques
+
+    def estimer_carte(self):
+        """
+        Renvoie (fond, bruit, image_soustraite) : grille du fond (une
+        valeur par boîte), écart-type du bruit et image après soustraction
+        de la carte du fond (réutilisée par chaque détection). La grille
+        et le bruit sont relus depuis le cache disque si possible.
+        """
+        maillage = None
+        if self.cache_disque is not None:
+            maillage = self.cache_disque.lire_maillage(self.empreinte, self.sigma, self.boite)
+        with PROFILEUR.etape("statistiques"):
+            if maillage is None:
+                fond, cote = maillage_fond(self.image_float, self.sigma, self.boite)
+            else:
+                fond, cote, bruit = maillage
+            carte = carte_fond(fond, cote, self.image_float.shape)
+            image_soustraite = np.subtract(self.image_float, carte, dtype=self.image_float.dtype)
+            if maillage is None:
+                # Bruit mesuré une fois le fond enlevé (le gradient dans une boîte n'y compte plus)
+                bruit = float(statistiques_sous_echantillon(image_soustraite, sigma=self.sigma)[2])
+                if self.cache_disque is not None:
+                    self.cache_disque.ecrire_maillage(self.empreinte, self.sigma, self.boite, (fond, cote, bruit))
+        return fond, bruit, image_soustraite
+
+    def executer_daofind(self, threshold_sigma, fwhm):
+        """Détection DAOStarFinder, relue depuis le cache disque si possible."""
+        if self.cache_disque is not None:
+            trouve, sources = self.cache_disque.lire_catalogue(self.empreinte, self.sigma, threshold_sigma, fwhm,
+                                                               self.boite)
+            if trouve:
+                return sources
+
+        # Initialisation de l’algorithme de détection d’étoiles
+        # (photutils n'est importé qu'à la première détection)
+        from photutils.detection import DAOStarFinder
+
+        daofind = DAOStarFinder(fwhm=fwhm, threshold=threshold_sigma * self.std)
+
+        # sources contient les positions et caractéristiques des étoiles détectées
+        with PROFILEUR.etape("détection"):
+            sources = daofind(self.image_soustraite)
+        PROFILEUR.compter("détections")
+
+        if self.cache_disque is not None:
+            self.cache_disque.ecrire_catalogue(self.empreinte, self.sigma, threshold_sigma, fwhm, sources,
+                                               self.boite)
+        return sources
+
+    def index_seuil(self, fwhm):
+        """Renvoie l'index des seuils pour cette FWHM (construit une seule fois)."""
+        fwhm = float(fwhm)
+        if fwhm not in self._index:
+            catalogue = self.executer_daofind(self.seuil_min, fwhm)
+            self._index[fwhm] = IndexSeuil(catalogue, self.std, fwhm, self.seuil_min)
+        return self._index[fwhm]
+
+    def detecter(self, threshold_sigma, fwhm):
+        """
+        Renvoie les sources détectées pour un seuil (en nombre de sigma)
+        et une FWHM donnés, ou None si aucune étoile n'est trouvée.
+        """
+        cle = (round(float(threshold_sigma), 6), float(fwhm))
+
+        if cle in self._catalogues:
+            PROFILEUR.compter("catalogues en cache")
+            self._catalogues.move_to_end(cle)
+            return self._catalogues[cle]
+
+        if self.seuil_min is not None and threshold_sigma >= self.seuil_min:
+            index = self.index_seuil(fwhm)
+            if self.validation:
+                identiques, sources, detectees = index.valider(self.image_soustraite, threshold_sigma)
+                if not identiques:
+                    warnings.warn(f"Catalogue filtré différent de DAOStarFinder au seuil {threshold_sigma}",
+                                  RuntimeWarning)
+                    sources = detectees
+            else:
+                with PROFILEUR.etape("filtrage seuil"):
+                    sources = index.filtrer(threshold_sigma)
+        else:
+            sources = self.executer_daofind(threshold_sigma, fwhm)
+
+        self._catalogues[cle] = sources
+        if len(self._catalogues) > self.taille_max:
+            self._catalogues.popitem(last=False)
+
+        return sources
+
+    def vider(self):
+        """Supprime tous les catalogues et index gardés en mémoire."""
+        self._catalogues.clear()
+        self._index.clear()
@@ -0,0 +1,281 @@
+import math
+
+import numpy as np
+
+
+# Positions sous-pixel distinctes par pixel (en x et en y) dans la table des empreintes
+PHASES_EMPREINTE = 4
+
+# Pas des rayons et des largeurs de bord de la table (en pixels)
+PAS_EMPREINTE = 0.25
+
+# Demi-côté de la fenêtre autour de chaque étoile pour mesurer sa FWHM
+DEMI_FENETRE_FWHM = 6
+
+# FWHM mesurée seulement pour un pic d'au moins ce nombre de sigma du bruit
+# (en dessous, le profil est trop bruité et la FWHM par défaut est gardée)
+SIGNAL_MIN_FWHM = 3.0
+
+# Limites de la FWHM mesurée et du rayon des empreintes (en pixels)
+FWHM_MIN = 1.0
+FWHM_MAX = 2.0 * DEMI_FENETRE_FWHM
+RAYON_MIN = 1.0
+RAYON_MAX = 24.0
+
+# L'empreinte couvre l'étoile jusqu'où son profil tombe à ce nombre de
+# sigma du bruit, plus une FWHM ; son bord a une largeur de LARGEUR_BORD FWHM
+NIVEAU_BORD = 1.0
+LARGEUR_BORD = 0.25
+
+# Valeur sous laquelle le bord d'une empreinte est coupé (1/512)
+COUPURE = math.log(511)
+
+# Étoiles traitées ensemble (taille des tableaux intermédiaires)
+LOT_ETOILES = 4096
+
+
+def demi_cote_empreinte(rayon, bord):
+    """Demi-côté du carré qui contient l'empreinte (valeurs >= 1/512)."""
+    return int(math.ceil(rayon + COUPURE * bord))
+
+
+# Plus grand demi-côté possible, pour les marges (tuiles, régions)
+DEMI_COTE_MAX = demi_cote_empreinte(RAYON_MAX, LARGEUR_BORD * FWHM_MAX)
+
+
+def mesurer_profils(image_soustraite, x, y, std, fwhm_defaut):
+    """
+    FWHM et pic de chaque étoile, mesurés sur le profil radial (moyenne
+    par anneau d'un pixel) de l'image sans fond autour de (x, y) :
+    la FWHM est le double du rayon où le profil passe sous la moitié du
+    pic. Les étoiles trop faibles gardent fwhm_defaut.
+    """
+    hauteur, largeur = image_soustraite.shape[:2]
+    n = len(x)
+    fwhm = np.full(n, float(fwhm_defaut))
+    pics = np.zeros(n)
+    if n == 0:
+        return fwhm, pics
+
+    demi = DEMI_FENETRE_FWHM
+    d = np.arange(-demi, demi + 1)
+    # Anneau de chaque pixel du disque de rayon demi, et moyenne par anneau
+    # en un produit matriciel
+    anneaux = np.rint(np.hypot(d[:, None], d[None, :])).astype(np.intp)
+    dy, dx = np.nonzero(anneaux <= demi)
+    anneaux = anneaux[dy, dx]
+    dy, dx = dy - demi, dx - demi
+    moyenne_anneaux = np.zeros((anneaux.size, demi + 1))
+    moyenne_anneaux[np.arange(anneaux.size), anneaux] = 1
+    moyenne_anneaux /= moyenne_anneaux.sum(axis=0)
+
+    plat = np.ascontiguousarray(image_soustraite).ravel()
+    ax = np.rint(np.asarray(x, dtype=np.float64)).astype(np.intp)
+    ay = np.rint(np.asarray(y, dtype=np.float64)).astype(np.intp)
+    # Étoiles dont le disque est entièrement dans l'image
+    dedans = (ay >= demi) & (ay < hauteur - demi) & (ax >= demi) & (ax < largeur - demi)
+    for debut in range(0, n, LOT_ETOILES):
+        lot = slice(debut, debut + LOT_ETOILES)
+        # Pixels du disque de chaque étoile : centre + décalages, ou bord de
+        # l'image répété pour les étoiles près du bord
+        indices = (ay[lot] * largeur + ax[lot])[:, None] + (dy * largeur + dx)
+        pres_du_bord = ~dedans[lot]
+        if pres_du_bord.any():
+            lignes = np.clip(ay[lot][pres_du_bord, None] + dy, 0, hauteur - 1)
+            colonnes = np.clip(ax[lot][pres_du_bord, None] + dx, 0, largeur - 1)
+            indices[pres_du_bord] = lignes * largeur + colonnes
+        fenetres = plat.take(indices)
+        profils = fenetres @ moyenne_anneaux
+        pic = profils[:, 0]
+
+        # Premier anneau sous la moitié du pic, interpolé avec le précédent
+        moitie = pic[:, None] / 2
+        sous = profils < moitie
+        r = np.argmax(sous, axis=1)
+        trouve = sous.any(axis=1) & (r > 0)
+        r = np.maximum(r, 1)
+        avant = profils[np.arange(len(r)), r - 1]
+        apres = profils[np.arange(len(r)), r]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rayon_moitie = r - 1 + (avant - moitie[:, 0]) / (avant - apres)
+        mesure = np.where(trouve, 2 * rayon_moitie, FWHM_MAX)
+
+        fiable = pic >= SIGNAL_MIN_FWHM * std
+        fwhm[lot] = np.where(fiable, np.clip(mesure, FWHM_MIN, FWHM_MAX), fwhm_defaut)
+        pics[lot] = pic
+    return fwhm, pics
+
+
+class TableEmpreintes:
+    """
+    Empreintes précalculées, indexées par (rayon, largeur du bord, phase
+    en x, phase en y) : rayon et bord arrondis à PAS_EMPREINTE, position
+    du centre arrondie à 1/PHASES_EMPREINTE de pixel. Une empreinte vaut
+    1 au centre et descend en douceur (logistique) autour de son rayon ;
+    elle remplace le carré et le flou gaussien du masque.
+
+    Chaque empreinte est calculée à sa première utilisation puis gardée :
+    composer un masque ne coûte ensuite que des copies.
+    """
+
+    def __init__(self, pas=PAS_EMPREINTE, phases=PHASES_EMPREINTE):
+        self.pas = pas
+        self.phases = phases
+        self._empreintes = {}
+        self._pixels = {}
+
+    def empreinte(self, i_rayon, i_bord, phase_x, phase_y):
+        cle = (i_rayon, i_bord, phase_x, phase_y)
+        if cle not in self._empreintes:
+            rayon = i_rayon * self.pas
+            bord = max(i_bord, 1) * self.pas
+            demi = demi_cote_empreinte(rayon, bord)
+            d = np.arange(-demi, demi + 1)
+            distance = np.hypot(d[:, None] - phase_y / self.phases, d[None, :] - phase_x / self.phases)
+            t = np.minimum((distance - rayon) / bord, 50)
+            valeurs = 1 / (1 + np.exp(t))
+            valeurs[t > COUPURE] = 0
+            self._empreintes[cle] = valeurs.astype(np.float32)
+        return self._empreintes[cle]
+
+    def pixels(self, i_rayon, i_bord, phase_x, phase_y):
+        """
+        (lignes, colonnes, valeurs) des pixels non nuls de l'empreinte par
+        rapport à son centre, et demi-côté du carré qui les contient.
+        """
+        cle = (i_rayon, i_bord, phase_x, phase_y)
+        if cle not in self._pixels:
+            empreinte = self.empreinte(*cle)
+            demi = empreinte.shape[0] // 2
+            dy, dx = np.nonzero(empreinte)
+            self._pixels[cle] = (dy - demi, dx - demi, empreinte[dy, dx], demi)
+        return self._pixels[cle]
+
+    def composer(self, forme, x, y, rayons, bords, origine=(0, 0)):
+        """
+        Masque float32 (valeurs entre 0 et 1) de forme (hauteur, largeur) :
+        maximum des empreintes des étoiles (x, y sous-pixel, rayons et
+        bords en pixels). origine : position entière (ligne, colonne) du
+        coin du masque dans l'image des coordonnées x, y.
+        """
+        hauteur, largeur = forme[:2]
+        masque = np.zeros((hauteur, largeur), dtype=np.float32)
+        if len(x) == 0:
+            return masque
+
+        # Ancre entière et phase sous-pixel de chaque centre, arrondies dans
+        # l'image entière : un morceau de l'image donne les mêmes valeurs
+        qx = np.rint(np.asarray(x, dtype=np.float64) * self.phases).astype(np.intp) - int(origine[1]) * self.phases
+        qy = np.rint(np.asarray(y, dtype=np.float64) * self.phases).astype(np.intp) - int(origine[0]) * self.phases
+        ax, phase_x = np.divmod(qx, self.phases)
+        ay, phase_y = np.divmod(qy, self.phases)
+        i_rayon = np.rint(np.asarray(rayons) / self.pas).astype(np.intp)
+        i_bord = np.rint(np.asarray(bords) / self.pas).astype(np.intp)
+
+        # Étoiles qui partagent la même empreinte (même clé entière), posées ensemble
+        nombre_bords = int(i_bord.max()) + 1
+        cles = ((i_rayon * nombre_bords + i_bord) * self.phases + phase_x) * self.phases + phase_y
+        ordre = np.argsort(cles, kind="stable")
+        cles_triees = cles[ordre]
+        debuts = np.flatnonzero(np.diff(cles_triees, prepend=-1)).tolist() + [len(cles)]
+
+        plat = masque.ravel()
+        for debut_groupe, fin_groupe in zip(debuts[:-1], debuts[1:]):
+            cle = int(cles_triees[debut_groupe])
+            cle, py = divmod(cle, self.phases)
+            cle, px = divmod(cle, self.phases)
+            r, b = divmod(cle, nombre_bords)
+            dy, dx, valeurs, demi = self.pixels(r, b, px, py)
+            for debut in range(debut_groupe, fin_groupe, LOT_ETOILES):
+                etoiles = ordre[debut:min(debut + LOT_ETOILES, fin_groupe)]
+                ey, ex = ay[etoiles], ax[etoiles]
+                # Empreintes entièrement dans le masque : indices = centre + décalages
+                # (np.maximum.at : des empreintes du lot peuvent se chevaucher)
+                dedans = (ey >= demi) & (ey < hauteur - demi) & (ex >= demi) & (ex < largeur - demi)
+                coupees = not dedans.all()
+                if coupees:
+                    ey_bord, ex_bord = ey[~dedans], ex[~dedans]
+                    ey, ex = ey[dedans], ex[dedans]
+                indices = ((ey * largeur + ex)[:, None] + (dy * largeur + dx)).ravel()
+                np.maximum.at(plat, indices, np.tile(valeurs, len(ey)))
+
+                # Empreintes coupées par le bord : pixels hors du masque retirés
+                if coupees:
+                    lignes = ey_bord[:, None] + dy
+                    colonnes = ex_bord[:, None] + dx
+                    garde = (lignes >= 0) & (lignes < hauteur) & (colonnes >= 0) & (colonnes < largeur)
+                    np.maximum.at(plat, (lignes * largeur + colonnes)[garde],
+                                  np.broadcast_to(valeurs, garde.shape)[garde])
+        return masque
+
+
+# Table partagée : les empreintes déjà calculées servent à toutes les images
+TABLE_EMPREINTES = TableEmpreintes()
+
+
+class EmpreintesEtoiles:
+    """
+    Empreinte de chaque étoile d'un catalogue : centre sous-pixel (x, y),
+    rayon et largeur du bord, tirés de la FWHM et du pic mesurés (voir
+    empreintes_etoiles). origine : coin (ligne, colonne) du morceau de
+    l'image où ces empreintes sont posées (voir extraire).
+    """
+
+    def __init__(self, x, y, rayons, bords, table=TABLE_EMPREINTES, origine=(0, 0)):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.rayons = np.asarray(rayons, dtype=np.float64)
+        self.bords = np.asarray(bords, dtype=np.float64)
+        self.table = table
+        self.origine = origine
+
+    def __len__(self):
+        return len(self.x)
+
+    def positions(self):
+        """Centres arrondis au pixel (entiers, dans le morceau), pour regrouper les étoiles en régions."""
+        return (np.rint(self.x).astype(np.intp) - self.origine[1],
+                np.rint(self.y).astype(np.intp) - self.origine[0])
+
+    def demi_cote(self):
+        """Plus grand demi-côté des empreintes autour de positions() (marge autour des centres)."""
+        if len(self) == 0:
+            return 0
+        # + 1 : l'ancre d'une empreinte peut être à un pixel du centre arrondi
+        return demi_cote_empreinte(self.rayons.max(), self.bords.max()) + 1
+
+    def extraire(self, choix, origine=(0, 0)):
+        """Empreintes des étoiles choisies, dans le morceau de l'image qui commence à origine."""
+        return EmpreintesEtoiles(self.x[choix], self.y[choix], self.rayons[choix], self.bords[choix],
+                                 self.table, (self.origine[0] + origine[0], self.origine[1] + origine[1]))
+
+    def masque(self, forme, choix=None, origine=(0, 0)):
+        """
+        Masque float32 (0 à 1) des étoiles choisies (toutes par défaut),
+        pour le rectangle de forme donnée qui commence à origine.
+        """
+        if choix is None:
+            choix = slice(None)
+        return self.table.composer(forme, self.x[choix], self.y[choix], self.rayons[choix], self.bords[choix],
+                                   (self.origine[0] + origine[0], self.origine[1] + origine[1]))
+
+
+def empreintes_etoiles(sources, image_soustraite, std, fwhm_defaut):
+    """
+    Empreintes d'un catalogue DAOStarFinder, mesurées sur l'image sans
+    fond qui a servi à la détection (bruit std). La FWHM de chaque étoile
+    vient de son profil radial ; son rayon couvre l'étoile jusqu'au
+    niveau NIVEAU_BORD sigma, plus une FWHM.
+    """
+    if sources is None:
+        vide = np.empty(0)
+        return EmpreintesEtoiles(vide, vide, vide, vide)
+
+    x = np.asarray(sources["xcentroid"], dtype=np.float64)
+    y = np.asarray(sources["ycentroid"], dtype=np.float64)
+    fwhm, pics = mesurer_profils(image_soustraite, x, y, std, fwhm_defaut)
+
+    sigma = fwhm / (2 * math.sqrt(2 * math.log(2)))
+    contraste = np.maximum(pics / (NIVEAU_BORD * std), 1.0)
+    rayons = np.clip(sigma * np.sqrt(2 * np.log(contraste)) + fwhm, RAYON_MIN, RAYON_MAX)
+    return EmpreintesEtoiles(x, y, rayons, LARGEUR_BORD * fwhm)
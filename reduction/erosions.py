@@ -0,0 +1,143 @@
+from collections import OrderedDict
+
+import cv2 as cv
+import numpy as np
+
+from reduction.profilage import PROFILEUR
+
+
+# Plus grande taille de noyau gardée par la pyramide (curseur de l'interface)
+TAILLE_MAX_EROSION = 15
+
+# Nombre d'images érodées gardées en mémoire (une image complète chacune)
+NOMBRE_MAX_EROSIONS = 4
+
+
+def zone_masque(masque):
+    """
+    Rectangle (y0, y1, x0, x1) qui contient tous les pixels non nuls du
+    masque (2 dimensions), ou None si le masque est vide.
+    """
+    x, y, largeur, hauteur = cv.boundingRect((masque != 0).view(np.uint8))
+    if largeur == 0 or hauteur == 0:
+        return None
+    return (y, y + hauteur, x, x + largeur)
+
+
+class PyramideErosion:
+    """
+    Images érodées par des noyaux carrés impairs de 3 à taille_max, pour
+    une image qui ne change pas.
+
+    Une érosion k×k suivie d'une érosion j×j est une érosion (k+j-1)×(k+j-1)
+    (OpenCV fait chaque érosion rectangulaire en une passe par lignes puis
+    une passe par colonnes) : une taille est calculée à partir de la plus
+    grande taille inférieure déjà connue, et les tailles calculées sont
+    gardées d'une mise à jour à l'autre.
+
+    Le calcul est limité à une zone (le rectangle des étoiles) : hors de
+    cette zone, les images gardent les pixels de l'image d'origine.
+    Au plus nombre_max tailles sont gardées (les moins récemment utilisées
+    sont oubliées). Une image rendue par erodee reste valable tant que
+    l'image ne change pas, même oubliée par la pyramide : seul
+    changer_image réutilise les tableaux des images érodées, pour
+    l'image suivante d'une séquence.
+    """
+
+    def __init__(self, image, taille_max=TAILLE_MAX_EROSION, nombre_max=NOMBRE_MAX_EROSIONS):
+        self.image = image
+        self.taille_max = taille_max
+        self.nombre_max = nombre_max
+        # Rectangle où les images gardées sont exactes, et ce rectangle agrandi
+        # d'un demi-noyau maximal (pixels lus par les érosions)
+        self._zone = None
+        self._cadre = None
+        self._erodees = OrderedDict()
+        # Tableaux de la forme de l'image, libres pour les prochaines érosions
+        self._libres = []
+
+    def erodee(self, taille, zone=None):
+        """
+        Image érodée par un noyau taille×taille, exacte au moins dans le
+        rectangle zone (y0, y1, x0, x1) ; zone None : toute l'image.
+        Son tableau est réutilisé après changer_image : copier une image
+        érodée qui doit servir au-delà de l'image courante.
+        """
+        if taille <= 1:
+            return self.image
+        if taille % 2 == 0 or taille > self.taille_max:
+            # Taille hors de la pyramide : érosion directe
+            with PROFILEUR.etape("érosion"):
+                return cv.erode(self.image, np.ones((taille, taille), np.uint8))
+
+        hauteur, largeur = self.image.shape[:2]
+        if zone is None:
+            zone = (0, hauteur, 0, largeur)
+        if not self._contient(zone):
+            self._agrandir(zone)
+
+        if taille not in self._erodees:
+            # Le bord du cadre (qui n'est pas le bord de l'image) fausse un
+            # demi-noyau de pixels, toujours moins que la marge autour de la zone
+            precedente = max((t for t in self._erodees if t < taille), default=1)
+            source = self.image if precedente == 1 else self._erodees[precedente]
+            cote = taille - precedente + 1
+            noyau = np.ones((cote, cote), np.uint8)
+            erodee = self._libres.pop() if self._libres else np.empty_like(self.image)
+            with PROFILEUR.etape("érosion"):
+                if self._cadre == (slice(0, hauteur), slice(0, largeur)):
+                    cv.erode(source, noyau, dst=erodee)
+                else:
+                    np.copyto(erodee, self.image)
+                    cv.erode(source[self._cadre], noyau, dst=erodee[self._cadre])
+            PROFILEUR.compter("érosions calculées")
+            self._erodees[taille] = erodee
+            if len(self._erodees) > self.nombre_max:
+                # L'appelant peut encore s'en servir : le tableau n'est pas réutilisé
+                self._erodees.popitem(last=False)
+
+        self._erodees.move_to_end(taille)
+        return self._erodees[taille]
+
+    def vider(self):
+        self._zone = None
+        self._cadre = None
+        self._erodees.clear()
+
+    def changer_image(self, image):
+        """
+        Remplace l'image (image suivante d'une séquence) : les images
+        érodées sont oubliées, et leurs tableaux servent aux prochaines
+        érosions si la forme et le type n'ont pas changé.
+        """
+        if image.shape == self.image.shape and image.dtype == self.image.dtype:
+            self._libres.extend(self._erodees.values())
+        else:
+            self._libres.clear()
+        self.vider()
+        self.image = image
+
+    def _contient(self, zone):
+        if self._zone is None:
+            return False
+        y0, y1, x0, x1 = zone
+        zy0, zy1, zx0, zx1 = self._zone
+        return zy0 <= y0 and y1 <= zy1 and zx0 <= x0 and x1 <= zx1
+
+    def _agrandir(self, zone):
+        # La zone ne fait que grandir (union des rectangles demandés) ;
+        # les tailles déjà calculées sur l'ancienne zone sont refaites
+        if self._zone is not None:
+            y0, y1, x0, x1 = zone
+            zy0, zy1, zx0, zx1 = self._zone
+            zone = (min(y0, zy0), max(y1, zy1), min(x0, zx0), max(x1, zx1))
+
+        hauteur, largeur = self.image.shape[:2]
+        marge = self.taille_max // 2
+        y0, y1, x0, x1 = zone
+        self._zone = zone
+        self._cadre = (
+            slice(max(y0 - marge, 0), min(y1 + marge, hauteur)),
+            slice(max(x0 - marge, 0), min(x1 + marge, largeur)),
+        )
+        self._erodees.clear()
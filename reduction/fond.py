@@ -0,0 +1,162 @@
+"""
+Estimation du fond de ciel sans parcourir toute l'image :
+  - "global" : moyenne, médiane et écart-type après sigma-clipping d'une
+    grille régulière de pixels (sigma_clipped_stats sur un sous-échantillon) ;
+  - "carte" : fond variable (nébuleuse, gradient) estimé boîte par boîte
+    sur un maillage, puis interpolé sur toute l'image.
+"""
+import math
+
+import numpy as np
+
+FONDS = ("global", "carte")
+
+# Nombre maximal de pixels lus pour estimer le fond : une image plus petite
+# est lue en entier (mêmes statistiques que sur l'image entière)
+PIXELS_ECHANTILLON = 1_000_000
+
+# Côté des boîtes du maillage (en pixels de l'image d'origine), taille du
+# filtre médian appliqué aux boîtes et nombre minimal de pixels lus par côté
+TAILLE_BOITE = 64
+FILTRE_BOITES = 3
+COTE_MIN_BOITE = 4
+
+# Comme sigma_clipped_stats (astropy) : itérations de la coupure au plus
+ITERATIONS_MAX = 5
+
+# Une boîte dont il reste moins de cette part de pixels après la coupure
+# (grosse étoile, bord de l'image) prend la valeur des boîtes voisines
+PART_MIN_VALIDES = 0.5
+
+
+def pas_echantillon(hauteur, largeur, pixels_max=PIXELS_ECHANTILLON):
+    """Pas de la grille de pixels lus pour qu'il y en ait au plus pixels_max."""
+    return max(int(math.ceil(math.sqrt(hauteur * largeur / pixels_max))), 1)
+
+
+def statistiques_sous_echantillon(data, sigma=3.0, pixels_max=PIXELS_ECHANTILLON):
+    """
+    Statistiques de fond (moyenne, mediane, std) sur une grille régulière
+    d'au plus pixels_max pixels. Pour une image plus petite, c'est le
+    même calcul que sur l'image entière.
+    """
+    from astropy.stats import sigma_clipped_stats
+
+    hauteur, largeur = data.shape
+    pas = pas_echantillon(hauteur, largeur, pixels_max)
+    echantillon = np.array(data[::pas, ::pas], dtype=np.float64)
+    return sigma_clipped_stats(echantillon, sigma=sigma)
+
+
+def statistiques_lignes(valeurs, sigma=3.0, iterations=ITERATIONS_MAX):
+    """
+    sigma_clipped_stats de chaque ligne de valeurs (NaN ignorés), toutes
+    les lignes à la fois. Chaque ligne n'est triée qu'une fois : les
+    valeurs gardées par la coupure y forment une tranche [debut, fin),
+    dont la médiane se lit directement et dont la moyenne et l'écart-type
+    viennent de sommes cumulées. Renvoie (moyenne, mediane, std, nombre).
+    """
+    triees = np.sort(valeurs, axis=1)
+    lignes = np.arange(len(triees))
+    debut = np.zeros(len(triees), dtype=np.intp)
+    fin = np.count_nonzero(~np.isnan(triees), axis=1)
+
+    def mediane_tranche(debut, fin):
+        n = np.maximum(fin - debut, 1)
+        bas = np.minimum(debut + (n - 1) // 2, triees.shape[1] - 1)
+        haut = np.minimum(debut + n // 2, triees.shape[1] - 1)
+        return (triees[lignes, bas].astype(np.float64) + triees[lignes, haut]) / 2
+
+    # Sommes cumulées autour de la médiane de départ (moins d'erreur d'arrondi)
+    centre = mediane_tranche(debut, fin)
+    ecarts = np.nan_to_num(triees - centre[:, None])
+    sommes = np.zeros((len(triees), triees.shape[1] + 1))
+    carres = np.zeros_like(sommes)
+    np.cumsum(ecarts, axis=1, out=sommes[:, 1:])
+    np.cumsum(ecarts.astype(np.float64) ** 2, axis=1, out=carres[:, 1:])
+
+    def statistiques(debut, fin):
+        n = np.maximum(fin - debut, 1)
+        moyenne = (sommes[lignes, fin] - sommes[lignes, debut]) / n
+        variance = (carres[lignes, fin] - carres[lignes, debut]) / n - moyenne ** 2
+        return moyenne + centre, mediane_tranche(debut, fin), np.sqrt(np.maximum(variance, 0))
+
+    moyenne, mediane, std = statistiques(debut, fin)
+    for _ in range(iterations):
+        # Valeurs gardées : mediane - sigma * std <= v <= mediane + sigma * std
+        bas = (mediane - sigma * std)[:, None]
+        haut = (mediane + sigma * std)[:, None]
+        nouveau_debut = np.maximum(np.count_nonzero(triees < bas, axis=1), debut)
+        nouvelle_fin = np.minimum(np.count_nonzero(triees <= haut, axis=1), fin)
+        if np.array_equal(nouveau_debut, debut) and np.array_equal(nouvelle_fin, fin):
+            break
+        debut, fin = nouveau_debut, nouvelle_fin
+        moyenne, mediane, std = statistiques(debut, fin)
+    return moyenne, mediane, std, fin - debut
+
+
+def maillage_fond(image, sigma=3.0, taille_boite=TAILLE_BOITE, pixels_max=PIXELS_ECHANTILLON):
+    """
+    Fond de chaque boîte d'environ taille_boite pixels de côté (médiane
+    après sigma-clipping), estimé sur une grille d'au plus pixels_max
+    pixels de l'image, puis lissé par un filtre médian sur les boîtes.
+    Les boîtes pavent l'image lue (les dernières lignes et colonnes qui
+    ne remplissent pas une boîte ne sont pas lues). Renvoie (fond, cote) :
+    grille float32 (une valeur par boîte) et (hauteur, largeur) d'une
+    boîte en pixels de l'image.
+    """
+    import cv2 as cv
+
+    hauteur, largeur = image.shape[:2]
+    pas = pas_echantillon(hauteur, largeur, pixels_max)
+    echantillon = image[::pas, ::pas]
+    h, w = echantillon.shape
+    cote = max(taille_boite // pas, COTE_MIN_BOITE)
+    ny, nx = max(h // cote, 1), max(w // cote, 1)
+    bh, bw = max(h // ny, 1), max(w // nx, 1)
+
+    # Une boîte par ligne
+    boites = np.array(echantillon[:ny * bh, :nx * bw], dtype=np.float32)
+    boites = boites.reshape(ny, bh, nx, bw).swapaxes(1, 2).reshape(ny * nx, bh * bw)
+    _, mediane, _, nombre = statistiques_lignes(boites, sigma)
+    fond = mediane.astype(np.float32).reshape(ny, nx)
+    valides = (nombre >= PART_MIN_VALIDES * bh * bw).reshape(ny, nx)
+
+    # Boîtes sans assez de pixels gardés : moyenne de leurs voisines valides,
+    # de proche en proche
+    if not valides.any():
+        # Aucune boîte valide (image vide ou presque toute en NaN) : fond uniforme
+        fond[:] = np.nanmedian(mediane) if np.isfinite(mediane).any() else 0
+        valides[:] = True
+    voisins = np.ones((3, 3), np.float32)
+    while not valides.all():
+        somme = cv.filter2D(np.where(valides, fond, 0).astype(np.float32), -1, voisins,
+                            borderType=cv.BORDER_CONSTANT)
+        nombre_voisins = cv.filter2D(valides.astype(np.float32), -1, voisins, borderType=cv.BORDER_CONSTANT)
+        remplies = ~valides & (nombre_voisins > 0)
+        fond[remplies] = somme[remplies] / nombre_voisins[remplies]
+        valides = valides | remplies
+
+    # Le filtre médian enlève les boîtes faussées par une étoile ou une trace
+    if min(ny, nx) >= FILTRE_BOITES:
+        fond = cv.medianBlur(fond, FILTRE_BOITES)
+    return fond, (bh * pas, bw * pas)
+
+
+def carte_fond(fond, cote, forme):
+    """
+    Carte de fond float32 de forme (hauteur, largeur) : grille des boîtes
+    (maillage_fond) interpolée entre les centres des boîtes, prolongée
+    telle quelle au-delà de la dernière boîte.
+    """
+    import cv2 as cv
+
+    hauteur, largeur = forme[:2]
+    ny, nx = fond.shape
+    bh, bw = cote
+    carte = cv.resize(fond, (nx * bw, ny * bh), interpolation=cv.INTER_CUBIC)
+    carte = carte[:hauteur, :largeur]
+    if carte.shape != (hauteur, largeur):
+        carte = cv.copyMakeBorder(carte, 0, hauteur - carte.shape[0], 0, largeur - carte.shape[1],
+                                  cv.BORDER_REPLICATE)
+    return carte
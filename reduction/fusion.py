@@ -0,0 +1,245 @@
+import cv2 as cv
+import numpy as np
+
+from reduction.erosions import zone_masque
+from reduction.profilage import PROFILEUR
+
+
+# Côté des blocs qui servent à regrouper les étoiles proches en régions
+TAILLE_BLOC_REGIONS = 32
+
+# Côté maximal d'une région construite à partir des étoiles
+TAILLE_TUILE_REGIONS = 256
+
+# Au-delà de cette part de l'image couverte par les régions des étoiles,
+# traiter toute l'image d'un coup coûte moins cher que région par région
+PART_MAX_REGIONS = 0.5
+
+
+def regions_etoiles(masques, marge):
+    """
+    Rectangles (tranches lignes, colonnes) qui contiennent tous les pixels
+    à moins de marge pixels d'un pixel non nul d'un des masques. Seuls ces
+    pixels peuvent changer lors de la fusion.
+
+    Les blocs qui contiennent des étoiles sont regroupés par composantes
+    connexes sur une grille grossière, puis chaque groupe est resserré au
+    rectangle de ses pixels non nuls agrandi de marge.
+    """
+    union = None
+    for masque in masques:
+        union = masque if union is None else np.maximum(union, masque)
+    if union is None or not union.any():
+        return []
+
+    hauteur, largeur = union.shape
+    bloc = TAILLE_BLOC_REGIONS
+    # Maximum de chaque bloc : dilatation ancrée en haut à gauche, lue tous les bloc pixels
+    blocs = cv.dilate(union, np.ones((bloc, bloc), np.uint8), anchor=(0, 0))[::bloc, ::bloc]
+    _, _, stats, _ = cv.connectedComponentsWithStats((blocs != 0).view(np.uint8), connectivity=8)
+
+    regions = []
+    for bx, by, bw, bh, _ in stats[1:]:
+        y0, x0 = by * bloc, bx * bloc
+        zone = zone_masque(union[y0:(by + bh) * bloc, x0:(bx + bw) * bloc])
+        if zone is None:
+            continue
+        zy0, zy1, zx0, zx1 = zone
+        regions.append((
+            slice(max(y0 + zy0 - marge, 0), min(y0 + zy1 + marge, hauteur)),
+            slice(max(x0 + zx0 - marge, 0), min(x0 + zx1 + marge, largeur)),
+        ))
+    return regions
+
+
+def agrandir_region(region, marge, hauteur, largeur):
+    """
+    Région agrandie de marge pixels (limitée à l'image) et position de la
+    région d'origine à l'intérieur.
+    """
+    lignes, colonnes = region
+    y0, x0 = max(lignes.start - marge, 0), max(colonnes.start - marge, 0)
+    y1, x1 = min(lignes.stop + marge, hauteur), min(colonnes.stop + marge, largeur)
+    return (
+        (slice(y0, y1), slice(x0, x1)),
+        (slice(lignes.start - y0, lignes.stop - y0), slice(colonnes.start - x0, colonnes.stop - x0)),
+    )
+
+
+def regions_carres(x, y, demi_cote, hauteur, largeur):
+    """
+    Regroupe les carrés de demi-côté demi_cote centrés sur (x, y) en
+    rectangles (tranches lignes, colonnes) qui les contiennent tous,
+    limités à l'image. Les carrés proches (blocs voisins sur une grille
+    grossière) tombent dans le même rectangle ; un groupe plus grand
+    qu'une tuile de TAILLE_TUILE_REGIONS est découpé par tuiles, pour que
+    ses rectangles ne couvrent pas toute l'image dans un champ dense.
+    """
+    x0, x1 = np.maximum(x - demi_cote, 0), np.minimum(x + demi_cote, largeur - 1)
+    y0, y1 = np.maximum(y - demi_cote, 0), np.minimum(y + demi_cote, hauteur - 1)
+    dedans = (x0 <= x1) & (y0 <= y1)
+    x0, x1, y0, y1 = x0[dedans], x1[dedans], y0[dedans], y1[dedans]
+    if x0.size == 0:
+        return []
+
+    bloc = TAILLE_BLOC_REGIONS
+    bx0, bx1, by0, by1 = x0 // bloc, x1 // bloc, y0 // bloc, y1 // bloc
+    blocs = np.zeros((-(-hauteur // bloc), -(-largeur // bloc)), dtype=np.uint8)
+    for dy in range(int((by1 - by0).max()) + 1):
+        for dx in range(int((bx1 - bx0).max()) + 1):
+            blocs[np.minimum(by0 + dy, by1), np.minimum(bx0 + dx, bx1)] = 1
+    nombre, etiquettes, _, _ = cv.connectedComponentsWithStats(blocs, connectivity=8)
+    etiquette = etiquettes[by0, bx0]
+
+    # Chaque carré est coupé par les tuiles qu'il touche
+    tuile = TAILLE_TUILE_REGIONS
+    tuiles_par_ligne = -(-largeur // tuile)
+    tx0, tx1, ty0, ty1 = x0 // tuile, x1 // tuile, y0 // tuile, y1 // tuile
+    morceaux = []
+    for dy in range(int((ty1 - ty0).max()) + 1):
+        for dx in range(int((tx1 - tx0).max()) + 1):
+            ty, tx = ty0 + dy, tx0 + dx
+            garde = (ty <= ty1) & (tx <= tx1)
+            ty, tx = ty[garde], tx[garde]
+            morceaux.append((
+                (ty * tuiles_par_ligne + tx) * nombre + etiquette[garde],
+                np.maximum(y0[garde], ty * tuile), np.minimum(y1[garde], ty * tuile + tuile - 1),
+                np.maximum(x0[garde], tx * tuile), np.minimum(x1[garde], tx * tuile + tuile - 1),
+            ))
+    cle, y0, y1, x0, x1 = (np.concatenate(colonne) for colonne in zip(*morceaux))
+
+    # Rectangle englobant des morceaux de chaque groupe (composante, tuile)
+    ordre = np.argsort(cle, kind="stable")
+    debuts = np.flatnonzero(np.diff(cle[ordre], prepend=-1))
+    return [
+        (slice(int(ligne0), int(ligne1) + 1), slice(int(colonne0), int(colonne1) + 1))
+        for ligne0, ligne1, colonne0, colonne1 in zip(
+            np.minimum.reduceat(y0[ordre], debuts), np.maximum.reduceat(y1[ordre], debuts),
+            np.minimum.reduceat(x0[ordre], debuts), np.maximum.reduceat(x1[ordre], debuts),
+        )
+    ]
+
+
+def fusionner_empreintes(image, empreintes, tailles, erosions=None, travail=None):
+    """
+    Réduction multitaille à partir des empreintes des étoiles
+    (EmpreintesEtoiles, voir reduction.empreintes) : chaque étoile a sa
+    propre taille de noyau (tailles, par exemple donnée par une
+    CourbeNoyaux). Les étoiles sont groupées par taille ; pour chaque
+    groupe, masque, érosion et mélange ne sont calculés que dans les
+    régions autour des étoiles du groupe. Le temps dépend donc du nombre
+    d'étoiles de chaque groupe et non du nombre de groupes multiplié par
+    la taille de l'image.
+
+    Le masque de chaque étoile est son empreinte, posée à sa position
+    sous-pixel et déjà adoucie (pas de flou). Les groupes sont fusionnés
+    dans l'ordre croissant des tailles, sur l'image déjà fusionnée.
+
+    erosions : PyramideErosion de image (sinon chaque région est érodée
+    à part), interrogée pour chaque taille sur un même rectangle, celui
+    des régions de tous les groupes : la pyramide ne grandit qu'une fois. travail : tampon float32 de la forme de l'image, réutilisé
+    d'un appel à l'autre. La fusion y est faite sur place en float32,
+    sans passer par 8 bits, et c'est ce tampon qui est renvoyé (voir
+    en_uint8 pour l'affichage). Sans tampon, le résultat est en uint8.
+    """
+    hauteur, largeur = image.shape[:2]
+    tailles = np.asarray(tailles, dtype=np.intp)
+    x, y = empreintes.positions()
+    # Distance maximale entre le centre arrondi d'une étoile et un pixel de son masque
+    rayon = empreintes.demi_cote()
+
+    # Image de travail en float64 (mélanges exacts d'une image 8 bits),
+    # ou le tampon float32 donné
+    image_finale = None
+    if travail is not None:
+        np.copyto(travail, image)
+        image_finale = travail
+
+    # Étoiles et régions de chaque groupe
+    groupes = []
+    for kernel_size in np.unique(tailles).tolist():
+        choix = np.flatnonzero(tailles == kernel_size)
+        # Étoiles du groupe triées par ligne (numéros dans le catalogue)
+        etoiles = choix[np.argsort(y[choix], kind="stable")]
+        xs, ys = x[etoiles], y[etoiles]
+        with PROFILEUR.etape("régions"):
+            regions = regions_carres(xs, ys, rayon, hauteur, largeur)
+        if not regions:
+            continue
+        surface = sum((lignes.stop - lignes.start) * (colonnes.stop - colonnes.start) for lignes, colonnes in regions)
+        if surface > PART_MAX_REGIONS * hauteur * largeur:
+            # Groupe qui couvre presque toute l'image : une seule région
+            regions = [(slice(0, hauteur), slice(0, largeur))]
+        groupes.append((kernel_size, etoiles, xs, ys, regions))
+
+    if erosions is not None and groupes:
+        # Un seul rectangle pour toutes les tailles : demandé groupe par groupe,
+        # chaque agrandissement ferait oublier à la pyramide les tailles déjà calculées
+        toutes = [region for *_, regions in groupes for region in regions]
+        zone = (
+            min(lignes.start for lignes, _ in toutes), max(lignes.stop for lignes, _ in toutes),
+            min(colonnes.start for _, colonnes in toutes), max(colonnes.stop for _, colonnes in toutes),
+        )
+
+    for kernel_size, etoiles, xs, ys, regions in groupes:
+        PROFILEUR.compter("régions traitées", len(regions))
+        if image_finale is None:
+            image_finale = image.astype(np.float64)
+
+        if erosions is not None:
+            image_eroded_totale = erosions.erodee(kernel_size, zone)
+
+        # Tous les mélanges du groupe partent de l'image avant ce groupe :
+        # deux régions qui se chevauchent donnent les mêmes valeurs
+        resultats = []
+        for region in regions:
+            lignes, colonnes = region
+            # Étoiles du groupe dont l'empreinte touche la région (ys est trié)
+            debut = np.searchsorted(ys, lignes.start - rayon, side="left")
+            fin = np.searchsorted(ys, lignes.stop + rayon, side="left")
+            xr = xs[debut:fin]
+            proches = (xr + rayon >= colonnes.start) & (xr - rayon < colonnes.stop)
+            # Masque float32 entre 0 et 1, déjà adouci
+            with PROFILEUR.etape("masques"):
+                masque = empreintes.masque((lignes.stop - lignes.start, colonnes.stop - colonnes.start),
+                                           etoiles[debut:fin][proches], (lignes.start, colonnes.start))
+            if image.ndim == 3:
+                masque = masque[..., None]
+
+            if erosions is not None:
+                image_eroded = image_eroded_totale[region]
+            else:
+                bord, interieur = agrandir_region(region, kernel_size // 2, hauteur, largeur)
+                kernel = np.ones((kernel_size, kernel_size), np.uint8)
+                with PROFILEUR.etape("érosion"):
+                    image_eroded = cv.erode(image[bord], kernel)[interieur]
+
+            with PROFILEUR.etape("fusion"):
+                if travail is not None:
+                    # image + masque * (érodée - image), sans autre tableau que le résultat
+                    fusion = np.subtract(image_eroded, image_finale[region], dtype=np.float32)
+                    fusion *= masque
+                    fusion += image_finale[region]
+                    resultats.append(fusion)
+                else:
+                    image_eroded = image_eroded.astype(np.float32)
+                    resultats.append(masque * image_eroded + (1 - masque) * image_finale[region])
+
+        with PROFILEUR.etape("fusion"):
+            for region, resultat in zip(regions, resultats):
+                image_finale[region] = resultat
+
+    if travail is not None:
+        return travail
+    if image_finale is None:
+        return image.copy()
+    return np.clip(image_finale, 0, 255).astype(np.uint8)
+
+
+def en_uint8(image, tampon=None):
+    """
+    Conversion en 8 bits pour l'affichage (valeurs limitées à 0..255 puis
+    tronquées, comme np.clip(...).astype(np.uint8)). tampon : tableau
+    float32 de la forme de l'image qui évite une allocation.
+    """
+    return np.clip(image, 0, 255, out=tampon).astype(np.uint8)
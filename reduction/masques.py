@@ -0,0 +1,12 @@
+import numpy as np
+
+
+def positions_etoiles(sources):
+    """
+    Renvoie les colonnes x, y (entières, comme int(star['xcentroid']))
+    et mag du catalogue sous forme de tableaux NumPy.
+    """
+    x = np.trunc(np.asarray(sources["xcentroid"], dtype=np.float64)).astype(np.intp)
+    y = np.trunc(np.asarray(sources["ycentroid"], dtype=np.float64)).astype(np.intp)
+    mag = np.asarray(sources["mag"], dtype=np.float64)
+    return x, y, mag
@@ -0,0 +1,55 @@
+import numpy as np
+
+
+class CourbeNoyaux:
+    """
+    Taille du noyau d'érosion de chaque étoile en fonction de sa magnitude :
+    plus l'étoile est brillante (mag faible), plus le noyau est grand.
+
+    points : couples (magnitude, taille). En paliers (par défaut), une
+    étoile prend la taille du premier point dont la magnitude est
+    strictement plus grande que la sienne, et taille_defaut après le
+    dernier point. Avec interpolation=True, la taille varie linéairement
+    entre les points (constante avant le premier et après le dernier) et
+    est arrondie à l'impair le plus proche.
+
+    flux=True : les points sont donnés en flux au lieu de magnitudes
+    (mag = -2.5 log10(flux), comme la colonne mag de DAOStarFinder).
+    """
+
+    def __init__(self, points, taille_defaut=3, interpolation=False, flux=False):
+        points = [(float(v), int(t)) for v, t in points]
+        if flux:
+            points = [(-2.5 * np.log10(v), t) for v, t in points]
+        points.sort()
+        if not points:
+            raise ValueError("La courbe des noyaux a besoin d'au moins un point")
+        self.magnitudes = np.array([m for m, _ in points])
+        self.valeurs = np.array([t for _, t in points])
+        self.taille_defaut = taille_defaut
+        self.interpolation = interpolation
+
+    def __call__(self, mag):
+        """Taille du noyau pour chaque magnitude (tableau d'entiers impairs)."""
+        # Une magnitude inconnue (NaN) compte comme une étoile très faible
+        mag = np.asarray(mag, dtype=np.float64)
+        mag = np.where(np.isnan(mag), np.inf, mag)
+
+        if self.interpolation:
+            tailles = np.interp(mag, self.magnitudes, self.valeurs)
+            return np.maximum(2 * np.round((tailles - 1) / 2) + 1, 1).astype(np.intp)
+
+        valeurs = np.append(self.valeurs, self.taille_defaut)
+        return valeurs[np.searchsorted(self.magnitudes, mag, side="right")].astype(np.intp)
+
+    def tailles(self):
+        """Toutes les tailles que la courbe peut donner, dans l'ordre croissant."""
+        if self.interpolation:
+            plus_petite = max(2 * int(round((self.valeurs.min() - 1) / 2)) + 1, 1)
+            plus_grande = max(2 * int(round((self.valeurs.max() - 1) / 2)) + 1, 1)
+            return list(range(plus_petite, plus_grande + 1, 2))
+        return sorted(set(self.valeurs.tolist()) | {self.taille_defaut})
+
+
+# Courbe d'origine du projet : noyau 15 pour mag < -5, 3 sinon
+COURBE_NOYAUX = CourbeNoyaux([(-5, 15)], taille_defaut=3)
@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from reduction.fond import statistiques_sous_echantillon
+from reduction.tuiles import calculer_halo, decouper_tuiles, noyau_magnitude_defaut, traiter_tuile
+
+
+# Côté d'une tuile pour le traitement en parallèle : assez de tuiles pour
+# occuper tous les cœurs, assez grandes pour que le halo reste négligeable
+TAILLE_TUILE_PARALLELE = 1024
+
+# Tableaux partagés vus par chaque processus (remplis par _attacher_memoire)
+_memoire = {}
+
+
+def _attacher_memoire(nom_entree, forme, dtype, nom_sortie, parametres):
+    entree = shared_memory.SharedMemory(name=nom_entree)
+    sortie = shared_memory.SharedMemory(name=nom_sortie)
+    _memoire["blocs"] = (entree, sortie)
+    _memoire["entree"] = np.ndarray(forme, dtype=dtype, buffer=entree.buf)
+    _memoire["sortie"] = np.ndarray(forme[:2], dtype=np.uint8, buffer=sortie.buf)
+    _memoire["parametres"] = parametres
+
+
+def _traiter_tuile_partagee(tuile):
+    # Seules les tranches passent entre processus, les pixels restent en mémoire partagée
+    coeur, bord, interieur = tuile
+    p = _memoire["parametres"]
+    _memoire["sortie"][coeur], (x, y, mag) = traiter_tuile(
+        _memoire["entree"][bord], p["minimum"], p["maximum"], p["statistiques"], interieur,
+        p["fwhm"], p["threshold_sigma"], p["noyau_magnitude"]
+    )
+    lignes, colonnes = coeur
+    return x + colonnes.start, y + lignes.start, mag
+
+
+def reduire_image_parallele(data, nb_processus=None, taille_tuile=TAILLE_TUILE_PARALLELE,
+                            fwhm=2.0, threshold_sigma=0.7,
+                            noyau_magnitude=noyau_magnitude_defaut, noyaux=(3, 15)):
+    """
+    Réduction multitaille d'une image monochrome répartie sur plusieurs
+    processus. L'image et le résultat sont en mémoire partagée ; chaque
+    processus traite des tuiles avec halo (détection comprise) et écrit
+    leur cœur directement dans le résultat.
+
+    noyaux : tailles que noyau_magnitude peut donner (la plus grande fixe le halo).
+    Le résultat est identique bit à bit au traitement en un seul processus.
+    Renvoie (image finale en uint8, (x, y, mag) des étoiles détectées),
+    chaque étoile n'apparaissant qu'une fois même sur une couture.
+    """
+    if data.ndim != 2:
+        raise ValueError("Le traitement en parallèle attend une image monochrome (2 dimensions)")
+    if nb_processus is None:
+        nb_processus = os.cpu_count() or 1
+
+    hauteur, largeur = data.shape
+    parametres = {
+        "minimum": float(data.min()), "maximum": float(data.max()),
+        "statistiques": statistiques_sous_echantillon(data),
+        "fwhm": fwhm, "threshold_sigma": threshold_sigma, "noyau_magnitude": noyau_magnitude,
+    }
+    halo = calculer_halo(noyaux, fwhm)
+    tuiles = decouper_tuiles(hauteur, largeur, taille_tuile, halo)
+
+    entree = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    sortie = shared_memory.SharedMemory(create=True, size=max(hauteur * largeur, 1))
+    try:
+        np.ndarray(data.shape, dtype=data.dtype, buffer=entree.buf)[...] = data
+
+        with ProcessPoolExecutor(max_workers=nb_processus, initializer=_attacher_memoire,
+                                 initargs=(entree.name, data.shape, data.dtype, sortie.name, parametres)) as pool:
+            etoiles = list(pool.map(_traiter_tuile_partagee, tuiles))
+
+        image_finale = np.ndarray((hauteur, largeur), dtype=np.uint8, buffer=sortie.buf).copy()
+    finally:
+        entree.close()
+        entree.unlink()
+        sortie.close()
+        sortie.unlink()
+
+    x = np.concatenate([e[0] for e in etoiles])
+    y = np.concatenate([e[1] for e in etoiles])
+    mag = np.concatenate([e[2] for e in etoiles])
+    return image_finale, (x, y, mag)
@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+# Fichier de trace (variable d'environnement STAR_REDUCTION_PROFIL) : si elle
+# est définie, le chronométrage est actif dès le démarrage et erosion.py ou
+# l'interface écrivent la trace dans ce fichier à la fin
+FICHIER_TRACE = os.environ.get("STAR_REDUCTION_PROFIL")
+
+# Nombre maximal d'événements gardés pour la trace (les plus anciens sont oubliés)
+TAILLE_MAX_TRACE = 500_000
+
+
+class _EtapeInactive:
+    # Même objet pour toutes les étapes quand le chronométrage est coupé :
+    # ni allocation ni lecture de l'horloge
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_ETAPE_INACTIVE = _EtapeInactive()
+
+
+class _Etape:
+    __slots__ = ("profileur", "nom", "debut")
+
+    def __init__(self, profileur, nom):
+        self.profileur = profileur
+        self.nom = nom
+
+    def __enter__(self):
+        self.debut = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exception):
+        self.profileur._enregistrer(self.nom, self.debut, time.perf_counter_ns() - self.debut)
+        return False
+
+
+class Profileur:
+    """
+    Chronomètres et compteurs autour des étapes du traitement.
+
+        with PROFILEUR.etape("flou"):
+            ...
+        PROFILEUR.compter("régions traitées", len(regions))
+
+    Quand actif est faux, etape renvoie toujours le même gestionnaire de
+    contexte vide et compter ne fait rien : les appels peuvent rester dans
+    le code sans le ralentir.
+
+    Chaque étape chronométrée est gardée pour la trace (exporter_trace,
+    format JSON de chrome://tracing et Perfetto) et additionnée dans le
+    résumé de la mise à jour en cours (voir nouvelle_mise_a_jour et
+    resume). Une étape peut en contenir d'autres ; les étapes appelées
+    plusieurs fois (une fois par région par exemple) sont additionnées.
+    """
+
+    def __init__(self, actif=False, taille_max=TAILLE_MAX_TRACE):
+        self.actif = actif
+        self._verrou = threading.Lock()
+        self._origine = time.perf_counter_ns()
+        # (type, nom, début en ns, durée en ns ou valeur du compteur, thread)
+        self._evenements = deque(maxlen=taille_max)
+        self._compteurs = {}
+        # Résumé de la mise à jour en cours : nom -> [durée en ns, appels]
+        self._durees = {}
+        self._compteurs_mise_a_jour = {}
+
+    def etape(self, nom):
+        """Gestionnaire de contexte qui chronomètre le bloc sous le nom donné."""
+        if not self.actif:
+            return _ETAPE_INACTIVE
+        return _Etape(self, nom)
+
+    def compter(self, nom, n=1):
+        """Ajoute n au compteur nom (total de la session et de la mise à jour)."""
+        if not self.actif:
+            return
+        with self._verrou:
+            total = self._compteurs.get(nom, 0) + n
+            self._compteurs[nom] = total
+            self._compteurs_mise_a_jour[nom] = self._compteurs_mise_a_jour.get(nom, 0) + n
+            self._evenements.append(("C", nom, time.perf_counter_ns(), total, threading.get_ident()))
+
+    def nouvelle_mise_a_jour(self):
+        """Remet à zéro le résumé (appelé au début de chaque mise à jour)."""
+        with self._verrou:
+            self._durees = {}
+            self._compteurs_mise_a_jour = {}
+
+    def resume(self):
+        """
+        Résumé de la dernière mise à jour : liste de (nom, durée en ms,
+        nombre d'appels) dans l'ordre de la première fin de chaque étape,
+        et dictionnaire des compteurs.
+        """
+        with self._verrou:
+            durees = [(nom, duree / 1e6, appels) for nom, (duree, appels) in self._durees.items()]
+            return durees, dict(self._compteurs_mise_a_jour)
+
+    def texte_resume(self):
+        """Résumé de la dernière mise à jour sur quelques lignes (affichage)."""
+        durees, compteurs = self.resume()
+        lignes = [
+            f"{nom:<20} {duree:8.1f} ms" + (f"  ×{appels}" if appels > 1 else "")
+            for nom, duree, appels in durees
+        ]
+        lignes += [f"{nom:<20} {valeur:8d}" for nom, valeur in compteurs.items()]
+        return "\n".join(lignes)
+
+    def exporter_trace(self, chemin):
+        """
+        Écrit tous les événements gardés au format Chrome trace JSON (temps
+        en microsecondes, une ligne par thread).
+        """
+        pid = os.getpid()
+        with self._verrou:
+            evenements = list(self._evenements)
+
+        trace = []
+        for type_evenement, nom, debut, valeur, thread in evenements:
+            ts = (debut - self._origine) / 1000
+            if type_evenement == "X":
+                trace.append({"name": nom, "cat": "étape", "ph": "X", "ts": ts,
+                              "dur": valeur / 1000, "pid": pid, "tid": thread})
+            else:
+                trace.append({"name": nom, "cat": "compteur", "ph": "C", "ts": ts,
+                              "pid": pid, "tid": thread, "args": {nom: valeur}})
+
+        dossier = os.path.dirname(os.path.abspath(chemin))
+        os.makedirs(dossier, exist_ok=True)
+        with open(chemin, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return len(trace)
+
+    def vider(self):
+        """Oublie les événements, les compteurs et le résumé."""
+        with self._verrou:
+            self._evenements.clear()
+            self._compteurs.clear()
+            self._durees = {}
+            self._compteurs_mise_a_jour = {}
+
+    def _enregistrer(self, nom, debut, duree):
+        with self._verrou:
+            self._evenements.append(("X", nom, debut, duree, threading.get_ident()))
+            cumul = self._durees.setdefault(nom, [0, 0])
+            cumul[0] += duree
+            cumul[1] += 1
+
+
+# Profileur partagé par erosion.py, le module reduction et l'interface
+PROFILEUR = Profileur(actif=bool(FICHIER_TRACE))
@@ -0,0 +1,365 @@
+"""
+Réduction des étoiles sans interface : StarReducer sépare la détection
+(detect), les masques (mask) et la réduction (reduce), chacune avec son
+propre résultat (Detection, Masques, Reduction). erosion.py, main.py et
+l'interface utilisateur n'en sont que des clients.
+
+Les dépendances lourdes (photutils, astropy, OpenCV) ne sont importées
+qu'à la création du premier StarReducer : importer ce module est rapide.
+"""
+import math
+
+import numpy as np
+
+from reduction.noyaux import COURBE_NOYAUX
+from reduction.profilage import PROFILEUR
+
+# PSF taille moyenne des étoiles (FWHM des étoiles trop faibles pour être mesurée)
+FWHM_PSF = 2.0
+
+
+def ignorer_avertissements_detection():
+    """DAOStarFinder sans étoile ne prévient plus (une image vide n'est pas une erreur)."""
+    import warnings
+    from photutils.utils import NoDetectionsWarning
+    warnings.filterwarnings("ignore", category=NoDetectionsWarning)
+
+
+class Detection:
+    """
+    Résultat de StarReducer.detect : sources (catalogue DAOStarFinder,
+    None si aucune étoile), seuil (en nombre de sigma), fwhm (en pixels
+    de l'image), x, y (positions entières) et mag (magnitudes ramenées à
+    la pleine résolution) de chaque étoile.
+    """
+
+    def __init__(self, sources, seuil, fwhm):
+        from reduction.masques import positions_etoiles
+
+        self.sources = sources
+        self.seuil = seuil
+        self.fwhm = fwhm
+        if sources is None:
+            self.x = self.y = np.empty(0, dtype=np.intp)
+            self.mag = np.empty(0)
+        else:
+            self.x, self.y, self.mag = positions_etoiles(sources)
+
+    def __len__(self):
+        return len(self.mag)
+
+
+class Masques:
+    """
+    Résultat de StarReducer.mask : empreintes des étoiles (EmpreintesEtoiles)
+    et taille du noyau d'érosion de chaque étoile (noyaux, à l'échelle de
+    l'image). Le masque de toutes les étoiles, le rectangle de ses pixels
+    non nuls (zone) et ses régions ne sont calculés qu'à la première
+    demande (masque), puis gardés.
+    """
+
+    def __init__(self, detection, empreintes, noyaux, forme):
+        self.detection = detection
+        self.empreintes = empreintes
+        self.noyaux = noyaux
+        self.forme = forme
+        self.zone = None
+        self.regions = []
+        self._masque = None
+
+    def __len__(self):
+        return len(self.noyaux)
+
+    def masque(self):
+        """Masque float32 (hauteur, largeur) de toutes les étoiles, entre 0 et 1."""
+        if self._masque is None:
+            from reduction.erosions import zone_masque
+            from reduction.fusion import regions_etoiles
+
+            # Empreinte de chaque étoile à son centroïde sous-pixel, déjà adoucie
+            with PROFILEUR.etape("masques"):
+                self._masque = self.empreintes.masque(self.forme)
+            # Seuls les pixels couverts par une empreinte peuvent changer
+            with PROFILEUR.etape("régions"):
+                self.zone = zone_masque(self._masque)
+                self.regions = regions_etoiles([self._masque], 0)
+        return self._masque
+
+    def masque_noyau(self, taille):
+        """Masque 8 bits (0 à 255) des étoiles dont le noyau a cette taille."""
+        return (self.empreintes.masque(self.forme, self.noyaux == taille) * 255).astype(np.uint8)
+
+
+class Reduction:
+    """
+    Résultat de StarReducer.reduce : image réduite (float32, ou uint8 pour
+    la réduction multitaille de toute une image 8 bits sans tampons, comme
+    erosion.py), zone (y0, y1, x0, x1) qu'elle couvre et nombre d'étoiles
+    traitées. Avec des tampons, image est une vue du tampon de travail,
+    valable jusqu'au prochain reduce.
+    """
+
+    def __init__(self, image, zone, nombre_etoiles, tampon=None):
+        self.image = image
+        self.zone = zone
+        self.nombre_etoiles = nombre_etoiles
+        self._tampon = tampon
+
+    def en_uint8(self):
+        """Image réduite en 8 bits (valeurs limitées à 0..255)."""
+        from reduction.fusion import en_uint8
+
+        if self.image.dtype == np.uint8:
+            return self.image
+        return en_uint8(self.image, self._tampon)
+
+
+class StarReducer:
+    """
+    Réduction des étoiles d'une image qui ne change pas, en trois étapes
+    réutilisables : detect (catalogue au seuil demandé), mask (empreinte
+    et noyau de chaque étoile) et reduce (érosion et fusion, de toute
+    l'image ou d'une zone).
+
+    image : image à réduire, monochrome ou couleur (hauteur, largeur, 3),
+    en uint8 ou en float32 entre 0 et 255. image_detection : image sur
+    laquelle les étoiles sont détectées (par défaut la luminance de image).
+
+    Statistiques de fond, catalogues (voir CacheDetection), images érodées
+    (voir PyramideErosion), empreintes et masques sont gardés : un nouveau
+    seuil ou un nouveau noyau ne refait que ce qui en dépend.
+
+    echelle : taille de l'image par rapport à l'image d'origine (aperçu
+    réduit). FWHM et noyaux, exprimés en pixels de l'image d'origine, sont
+    ramenés à cette échelle. Avec tampons=True, les tableaux float32 de
+    la fusion sont alloués une fois et réutilisés d'un reduce à l'autre.
+
+    fond : estimation du fond avant la détection, "global" (médiane de
+    l'image) ou "carte" (fond variable, voir reduction.fond). statistiques :
+    (moyenne, mediane, std) du fond global déjà estimées (tuile d'une
+    image plus grande, voir reduction.tuiles).
+    """
+
+    def __init__(self, image, image_detection=None, fwhm=FWHM_PSF, courbe_noyaux=COURBE_NOYAUX, echelle=1.0,
+                 sigma=3.0, seuil_min=None, cache_disque=None, tampons=False, fond="global",
+                 statistiques=None):
+        from reduction.erosions import PyramideErosion
+
+        self.image = image
+        self.echelle = echelle
+        self.courbe_noyaux = courbe_noyaux
+        # DAOStarFinder a besoin d'au moins un pixel de largeur
+        self.fwhm = max(fwhm * echelle, 1.0)
+        self.fond = fond
+        self._parametres_detection = {"sigma": sigma, "seuil_min": seuil_min, "cache_disque": cache_disque,
+                                      "taille_boite": self.taille_boite(), "statistiques": statistiques}
+        self.cache_detection = self._creer_cache_detection(image, image_detection)
+        self._image_detection = None
+        # L'image ne change pas : ses érosions servent à tous les réglages
+        self.erosions = PyramideErosion(image)
+
+        # Caches de détection des autres fonds de la même image (changer_fond)
+        self._caches_fond = {}
+        self._detection = None
+        self._masques = None
+        self._garder_tampons = tampons
+        self._travail = None
+        self._tampon = None
+
+    def _creer_cache_detection(self, image, image_detection):
+        from reduction.couleur import luminance
+        from reduction.detection import CacheDetection
+
+        if image_detection is None:
+            image_detection = luminance(image)
+        # Une image float32 sert directement à la détection (sans copie en float64)
+        return CacheDetection(image_detection, fond=self.fond, **self._parametres_detection)
+
+    def changer_image(self, image, image_detection=None):
+        """
+        Passe à une autre image (image suivante d'une séquence) en gardant
+        les tableaux des érosions et les tampons s'ils ont la bonne forme.
+        Statistiques de fond et catalogues ne seront calculés qu'au prochain
+        detect : une image dont les étoiles sont suivies (voir
+        reduction.sequence) n'en a pas besoin.
+        """
+        self.erosions.changer_image(image)
+        if self._travail is not None and self._travail.shape != image.shape:
+            self._travail = None
+            self._tampon = None
+        self.image = image
+        self._image_detection = image_detection
+        # Statistiques données pour l'image précédente seulement
+        self._parametres_detection["statistiques"] = None
+        self.cache_detection = None
+        self._caches_fond.clear()
+        self._detection = None
+        self._masques = None
+
+    def changer_fond(self, fond):
+        """
+        Détecte désormais les étoiles avec une autre estimation du fond.
+        Statistiques et catalogues de chaque fond sont gardés : revenir au
+        fond précédent ne refait aucun calcul.
+        """
+        if fond == self.fond:
+            return
+        cache = self._cache()
+        self._caches_fond[self.fond] = cache
+        self.fond = fond
+        self.cache_detection = self._caches_fond.pop(fond, None)
+        if self.cache_detection is None:
+            from reduction.detection import CacheDetection
+
+            self.cache_detection = CacheDetection(cache.image_float, fond=fond, **self._parametres_detection)
+        self._detection = None
+        self._masques = None
+
+    def _cache(self):
+        # Cache de détection de l'image courante, recréé après changer_image
+        if self.cache_detection is None:
+            self.cache_detection = self._creer_cache_detection(self.image, self._image_detection)
+            self._image_detection = None
+        return self.cache_detection
+
+    def taille_boite(self):
+        """Côté des boîtes de la carte du fond (en pixels de l'image d'origine) ramené à l'échelle."""
+        from reduction.fond import COTE_MIN_BOITE, TAILLE_BOITE
+
+        return max(int(round(TAILLE_BOITE * self.echelle)), COTE_MIN_BOITE)
+
+    def noyau(self, noyau):
+        """Taille de noyau (en pixels de l'image d'origine) ramenée à l'échelle, impaire."""
+        return max(int(round(noyau * self.echelle)), 1) | 1
+
+    def magnitude(self, mag):
+        # La somme des pixels d'une étoile diminue comme echelle², on ramène
+        # la magnitude à celle mesurée en pleine résolution
+        return mag + 5 * math.log10(self.echelle)
+
+    def tampons(self):
+        """Renvoie (travail, tampon), deux tableaux float32 de la forme de l'image."""
+        if not self._garder_tampons:
+            return np.empty(self.image.shape, dtype=np.float32), None
+        if self._travail is None:
+            self._travail = np.empty(self.image.shape, dtype=np.float32)
+            self._tampon = np.empty(self.image.shape, dtype=np.float32)
+        return self._travail, self._tampon
+
+    def detect(self, threshold_sigma):
+        """Étoiles détectées au seuil donné (en nombre de sigma)."""
+        sources = self._cache().detecter(threshold_sigma, self.fwhm)
+        if self._detection is None or self._detection.sources is not sources or \
+                self._detection.seuil != threshold_sigma:
+            detection = Detection(sources, threshold_sigma, self.fwhm)
+            detection.mag = self.magnitude(detection.mag)
+            self._detection = detection
+        return self._detection
+
+    def mask(self, detection):
+        """
+        Empreintes des étoiles (FWHM et pic mesurés sur l'image) et noyau
+        de chaque étoile donné par la courbe des noyaux. Gardés tant que
+        les sources ne changent pas.
+        """
+        from reduction.empreintes import empreintes_etoiles
+
+        if self._masques is not None and self._masques.detection.sources is detection.sources:
+            return self._masques
+        cache = self._cache()
+        empreintes = empreintes_etoiles(detection.sources, cache.image_soustraite, cache.std, self.fwhm)
+        # Taille du noyau de chaque étoile, ramenée à l'échelle de l'image
+        noyaux = self.courbe_noyaux(detection.mag)
+        tailles = {t: self.noyau(t) for t in np.unique(noyaux).tolist()}
+        noyaux = np.array([tailles[t] for t in noyaux.tolist()], dtype=np.intp)
+        self._masques = Masques(detection, empreintes, noyaux, self.image.shape[:2])
+        return self._masques
+
+    def noyau_simple(self, masques, noyau):
+        """
+        Noyau unique de la réduction simple, donné par la dernière étoile
+        du catalogue : noyau remplace la taille par défaut de la courbe.
+        """
+        taille = int(self.courbe_noyaux(masques.detection.mag[-1]))
+        return self.noyau(noyau | 1 if taille == self.courbe_noyaux.taille_defaut else taille)
+
+    def reduce(self, masques, noyau=None, zone=None):
+        """
+        Érosion et fusion à travers les empreintes. noyau None : réduction
+        multitaille (chaque étoile a son noyau) ; sinon un seul noyau pour
+        toutes les étoiles (voir noyau_simple). zone (y0, y1, x0, x1) :
+        seule cette partie de l'image est calculée, exacte.
+        """
+        hauteur, largeur = self.image.shape[:2]
+        y0, y1, x0, x1 = (0, hauteur, 0, largeur) if zone is None else zone
+        cadre = (slice(y0, y1), slice(x0, x1))
+        if noyau is None:
+            image = self._reduire_multitaille(masques, zone, cadre)
+        else:
+            image = self._reduire_simple(masques, noyau, cadre)
+        tampon = None if self._tampon is None else self._tampon[cadre]
+        return Reduction(image, (y0, y1, x0, x1), len(masques), tampon)
+
+    def _reduire_simple(self, masques, noyau, cadre):
+        travail, _ = self.tampons()
+        donnees = self.image
+        y0, y1 = cadre[0].start, cadre[0].stop
+        x0, x1 = cadre[1].start, cadre[1].stop
+
+        # Hors des régions des étoiles, copie de l'image d'origine
+        np.copyto(travail[cadre], donnees[cadre])
+        if len(masques) == 0:
+            return travail[cadre]
+
+        masque_flou = masques.masque()
+        # Régions des étoiles limitées à la zone demandée
+        regions = []
+        for lignes, colonnes in masques.regions:
+            r0, r1 = max(lignes.start, y0), min(lignes.stop, y1)
+            c0, c1 = max(colonnes.start, x0), min(colonnes.stop, x1)
+            if r0 < r1 and c0 < c1:
+                regions.append((slice(r0, r1), slice(c0, c1)))
+        # Érosion (gardée, calculée seulement autour des étoiles)
+        image_eroded = self.erosions.erodee(self.noyau_simple(masques, noyau), masques.zone)
+        # Fusion région par région, sur place dans l'image de travail :
+        # travail = donnees + masque * (érodée - donnees)
+        with PROFILEUR.etape("fusion"):
+            for region in regions:
+                resultat = travail[region]
+                np.subtract(image_eroded[region], donnees[region], out=resultat)
+                # Masque commun aux canaux d'une image couleur (diffusé sur le dernier axe)
+                masque = masque_flou[region] if donnees.ndim == 2 else masque_flou[region][..., None]
+                np.multiply(resultat, masque, out=resultat)
+                np.add(resultat, donnees[region], out=resultat)
+        return travail[cadre]
+
+    def _reduire_multitaille(self, masques, zone, cadre):
+        from reduction.fusion import fusionner_empreintes
+
+        donnees = self.image
+        if len(masques) == 0:
+            return donnees[cadre]
+        empreintes, noyaux = masques.empreintes, masques.noyaux
+
+        if zone is not None:
+            # Zone agrandie de tout ce qui agit sur ses pixels (empreintes,
+            # demi-noyau) : le calcul sur ce morceau est exact dans la zone
+            hauteur, largeur = donnees.shape[:2]
+            y0, y1, x0, x1 = zone
+            demi_cote = empreintes.demi_cote()
+            marge = demi_cote + int(noyaux.max()) // 2
+            b0, b1 = max(y0 - marge, 0), min(y1 + marge, hauteur)
+            c0, c1 = max(x0 - marge, 0), min(x1 + marge, largeur)
+            x, y = empreintes.positions()
+            proches = (x + demi_cote >= c0) & (x - demi_cote < c1) & (y + demi_cote >= b0) & (y - demi_cote < b1)
+            bord = (slice(b0, b1), slice(c0, c1))
+            travail, _ = self.tampons()
+            fusionner_empreintes(donnees[bord], empreintes.extraire(proches, (b0, c0)), noyaux[proches],
+                                 travail=travail[bord])
+            return travail[cadre]
+
+        # Pour chaque taille : érosion (gardée) et fusion seulement autour des
+        # étoiles de cette taille. Sans tampons, une image 8 bits est fusionnée
+        # en float64 et rendue en 8 bits, comme erosion.py l'a toujours fait
+        travail = self.tampons()[0] if self._garder_tampons or donnees.dtype != np.uint8 else None
+        return fusionner_empreintes(donnees, empreintes, noyaux, erosions=self.erosions, travail=travail)
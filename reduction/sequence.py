@@ -0,0 +1,236 @@
+"""
+Réduction d'une séquence de poses alignées du même champ : DAOStarFinder
+ne tourne que sur l'image de référence, les étoiles des images suivantes
+sont retrouvées à partir de ses positions.
+"""
+import numpy as np
+
+from reduction.empreintes import EmpreintesEtoiles
+from reduction.noyaux import COURBE_NOYAUX
+from reduction.profilage import PROFILEUR
+from reduction.reducteur import FWHM_PSF, Detection, Masques, StarReducer
+
+# Niveaux de cv.pyrDown avant la corrélation de phase (décalage global) :
+# l'erreur de ce décalage reste bien sous DEMI_FENETRE_CENTROIDE pixels
+NIVEAUX_DECALAGE = 1
+
+# Réponse minimale de la corrélation de phase (pic de corrélation entre 0 et 1) ;
+# en dessous, l'image ne ressemble pas à la référence et elle est détectée à nouveau
+REPONSE_MIN = 0.1
+
+# Décalage maximal (part du plus petit côté de l'image) : au-delà, trop
+# d'étoiles sont entrées dans le champ et l'image devient la référence
+PART_MAX_DECALAGE = 0.1
+
+# Demi-côté de la fenêtre du centroïde local et nombre de recentrages
+DEMI_FENETRE_CENTROIDE = 3
+ITERATIONS_CENTROIDE = 2
+
+# Étoiles les plus brillantes dont les centroïdes fixent le décalage global
+ETOILES_DECALAGE = 200
+
+SUIVIS = ("centroides", "decalage")
+
+
+def image_decalage(image, niveaux=NIVEAUX_DECALAGE):
+    """Image de détection réduite niveaux fois de moitié (float32), pour mesurer_decalage."""
+    import cv2 as cv
+
+    image = np.asarray(image, dtype=np.float32)
+    for _ in range(niveaux):
+        image = cv.pyrDown(image)
+    return image
+
+
+def mesurer_decalage(reference, image, niveaux=NIVEAUX_DECALAGE, fenetre=None):
+    """
+    Décalage global (dx, dy), en pixels, d'une image de détection par
+    rapport à la référence (image_decalage de la référence) par corrélation
+    de phase sur les images réduites. fenetre : fenêtre de Hann de la
+    taille de reference (calculée si None). Renvoie (dx, dy, reponse).
+    """
+    import cv2 as cv
+
+    if fenetre is None:
+        fenetre = cv.createHanningWindow((reference.shape[1], reference.shape[0]), cv.CV_32F)
+    (dx, dy), reponse = cv.phaseCorrelate(reference, image_decalage(image, niveaux), fenetre)
+    facteur = 2 ** niveaux
+    return dx * facteur, dy * facteur, reponse
+
+
+def affiner_centroides(image, x, y, demi=DEMI_FENETRE_CENTROIDE, iterations=ITERATIONS_CENTROIDE):
+    """
+    Centroïde de chaque étoile dans une fenêtre de côté 2 * demi + 1 autour
+    de (x, y), pondéré par les pixels au-dessus de la médiane de la fenêtre
+    (fond local). La fenêtre est recentrée iterations fois. Une étoile sans
+    signal garde sa position ; une étoile ne bouge pas de plus de demi pixels.
+    """
+    hauteur, largeur = image.shape[:2]
+    x0 = np.asarray(x, dtype=np.float64)
+    y0 = np.asarray(y, dtype=np.float64)
+    xc, yc = x0.copy(), y0.copy()
+    if len(xc) == 0:
+        return xc, yc
+
+    d = np.arange(-demi, demi + 1)
+    plat = image.reshape(-1)
+    for _ in range(iterations):
+        # Pixels de la fenêtre de chaque étoile (indices limités au bord de l'image)
+        cx = np.rint(xc).astype(np.intp)
+        cy = np.rint(yc).astype(np.intp)
+        colonnes = np.clip(cx[:, None] + d, 0, largeur - 1)
+        lignes = np.clip(cy[:, None] + d, 0, hauteur - 1)
+        fenetres = plat[lignes[:, :, None] * largeur + colonnes[:, None, :]].astype(np.float32)
+
+        fond = np.median(fenetres.reshape(len(xc), -1), axis=1)
+        poids = np.maximum(fenetres - fond[:, None, None], 0)
+        total = poids.sum(axis=(1, 2))
+        signal = total > 0
+        total[~signal] = 1
+        # Centroïde dans les coordonnées des pixels (indices limités compris)
+        xn = (poids.sum(axis=1) * colonnes).sum(axis=1) / total
+        yn = (poids.sum(axis=2) * lignes).sum(axis=1) / total
+        xc = np.where(signal, np.clip(xn, x0 - demi, x0 + demi), xc)
+        yc = np.where(signal, np.clip(yn, y0 - demi, y0 + demi), yc)
+    return xc, yc
+
+
+class SequenceReducer:
+    """
+    Réduction d'images alignées du même champ, l'une après l'autre (reduce,
+    ou suivre puis self.reducteur.reduce).
+
+    La première image (ou une image trop différente de la référence) est
+    réduite comme par StarReducer : statistiques de fond, DAOStarFinder,
+    mesure des empreintes. Pour les suivantes, le décalage global par
+    rapport à la référence est mesuré par corrélation de phase, puis :
+      - suivi="centroides" : chaque étoile est recentrée par un centroïde
+        local autour de sa position décalée ;
+      - suivi="decalage" : toutes les étoiles sont déplacées du même
+        décalage, affiné par la médiane des déplacements des étoiles les
+        plus brillantes.
+    Magnitudes, noyaux et formes des empreintes restent ceux de la
+    référence ; seuls les centres bougent. Les tableaux des érosions (et
+    les tampons de fusion avec tampons=True) servent à toutes les images.
+
+    Les étoiles qui sortent du champ sont ignorées ; celles qui y entrent
+    ne sont pas réduites avant la prochaine référence (décalage de plus de
+    PART_MAX_DECALAGE du champ).
+    """
+
+    def __init__(self, threshold_sigma=0.7, fwhm=FWHM_PSF, courbe_noyaux=COURBE_NOYAUX, sigma=3.0,
+                 suivi="centroides", cache_disque=None, tampons=False, fond="global"):
+        if suivi not in SUIVIS:
+            raise ValueError(f"Suivi inconnu : {suivi} (possibles : {', '.join(SUIVIS)})")
+        self.threshold_sigma = threshold_sigma
+        self.fwhm = fwhm
+        self.courbe_noyaux = courbe_noyaux
+        self.sigma = sigma
+        self.suivi = suivi
+        self.cache_disque = cache_disque
+        self.tampons = tampons
+        self.fond = fond
+
+        self.reducteur = None
+        # Référence réduite pour la corrélation de phase, sa fenêtre de Hann et ses masques
+        self._reference = None
+        self._fenetre = None
+        self._masques_reference = None
+        # Dernière image : ses étoiles, leurs numéros dans le catalogue de la
+        # référence et son décalage (None pour une référence)
+        self.detection = None
+        self.masques = None
+        self.etoiles_reference = None
+        self.decalage = None
+
+    def suivre(self, image, image_detection=None):
+        """
+        Passe à l'image suivante de la séquence (voir StarReducer pour image
+        et image_detection) : étoiles détectées si c'est une nouvelle
+        référence, suivies sinon. Renvoie ses Masques ; self.reducteur
+        travaille désormais sur cette image.
+        """
+        from reduction.couleur import luminance
+
+        if image_detection is None:
+            image_detection = luminance(image)
+
+        decalage = None
+        if self._reference is not None and image.shape == self.reducteur.image.shape:
+            with PROFILEUR.etape("décalage"):
+                dx, dy, reponse = mesurer_decalage(self._reference, image_detection, fenetre=self._fenetre)
+            limite = PART_MAX_DECALAGE * min(image.shape[:2])
+            if reponse >= REPONSE_MIN and abs(dx) <= limite and abs(dy) <= limite:
+                decalage = (dx, dy)
+
+        if decalage is None:
+            self._nouvelle_reference(image, image_detection)
+        else:
+            self.reducteur.changer_image(image, image_detection)
+            with PROFILEUR.etape("suivi"):
+                self.detection, self.masques, self.etoiles_reference, decalage = self._suivre(
+                    image_detection, *decalage)
+        self.decalage = decalage
+        return self.masques
+
+    def reduce(self, image, image_detection=None, noyau=None):
+        """Réduit l'image suivante de la séquence (voir suivre et StarReducer.reduce)."""
+        masques = self.suivre(image, image_detection)
+        return self.reducteur.reduce(masques, noyau)
+
+    def _nouvelle_reference(self, image, image_detection):
+        if self.reducteur is None or self.reducteur.image.shape != image.shape:
+            self.reducteur = StarReducer(image, image_detection, fwhm=self.fwhm, courbe_noyaux=self.courbe_noyaux,
+                                         sigma=self.sigma, cache_disque=self.cache_disque, tampons=self.tampons,
+                                         fond=self.fond)
+        else:
+            self.reducteur.changer_image(image, image_detection)
+        self.detection = self.reducteur.detect(self.threshold_sigma)
+        self.masques = self.reducteur.mask(self.detection)
+        self.etoiles_reference = np.arange(len(self.masques))
+        import cv2 as cv
+
+        self._reference = image_decalage(image_detection)
+        self._fenetre = cv.createHanningWindow((self._reference.shape[1], self._reference.shape[0]), cv.CV_32F)
+        self._masques_reference = self.masques
+
+    def _suivre(self, image_detection, dx, dy):
+        """
+        Detection et Masques de l'image suivie, numéros de ses étoiles dans
+        le catalogue de la référence et décalage (dx, dy) affiné.
+        """
+        reference = self._masques_reference
+        empreintes = reference.empreintes
+        hauteur, largeur = image_detection.shape[:2]
+        x, y = empreintes.x + dx, empreintes.y + dy
+        # Le décalage est affiné sur les étoiles encore dans le champ à leur position prévue
+        champ = np.flatnonzero((x >= 0) & (x <= largeur - 1) & (y >= 0) & (y <= hauteur - 1))
+        if len(champ) > 0:
+            brillantes = champ[np.argsort(reference.detection.mag[champ], kind="stable")[:ETOILES_DECALAGE]]
+            # Suivi "decalage" : seules les plus brillantes servent, seules elles sont recentrées
+            # (suivi "centroides" : toutes, une étoile au bord peut revenir dans le champ)
+            recentrees = np.arange(len(x)) if self.suivi == "centroides" else brillantes
+            xc, yc = x.copy(), y.copy()
+            xc[recentrees], yc[recentrees] = affiner_centroides(image_detection, x[recentrees], y[recentrees])
+            # Décalage affiné : médiane des déplacements des étoiles les plus brillantes
+            dx += float(np.median(xc[brillantes] - x[brillantes]))
+            dy += float(np.median(yc[brillantes] - y[brillantes]))
+            if self.suivi == "centroides":
+                x, y = xc, yc
+            else:
+                x, y = empreintes.x + dx, empreintes.y + dy
+
+        # Étoiles encore dans le champ
+        dedans = np.flatnonzero((x >= 0) & (x <= largeur - 1) & (y >= 0) & (y <= hauteur - 1))
+        sources = reference.detection.sources
+        if sources is not None:
+            sources = sources[dedans]
+            sources["xcentroid"] = x[dedans]
+            sources["ycentroid"] = y[dedans]
+        detection = Detection(sources, self.threshold_sigma, reference.detection.fwhm)
+        detection.mag = reference.detection.mag[dedans]
+
+        suivies = EmpreintesEtoiles(x[dedans], y[dedans], empreintes.rayons[dedans], empreintes.bords[dedans],
+                                    empreintes.table)
+        masques = Masques(detection, suivies, reference.noyaux[dedans], reference.forme)
+        return detection, masques, dedans, (dx, dy)
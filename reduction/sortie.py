@@ -0,0 +1,185 @@
+"""
+Écriture des résultats : image finale en FITS compressé par tuiles, en
+float32 (toute la dynamique de l'image d'origine, avec son en-tête), et
+aperçus PNG facultatifs. Les fichiers sont écrits dans un thread
+d'entrées/sorties pendant que le calcul continue (EcrivainFichiers).
+"""
+import os
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+# Compressions par tuiles des FITS (voir astropy.io.fits.CompImageHDU).
+# GZIP_2 (octets réordonnés) compresse mieux les float32 ; sans
+# quantification, seules les compressions GZIP gardent les valeurs exactes
+COMPRESSIONS = ("GZIP_2", "GZIP_1", "RICE_1")
+COMPRESSION = "GZIP_2"
+
+# Côté des tuiles de compression (en pixels)
+TAILLE_TUILE_FITS = 256
+
+# Écritures en attente au plus : au-delà, le calcul attend le thread
+# d'écriture (la mémoire des images à écrire reste bornée)
+ECRITURES_EN_ATTENTE = 8
+
+# Mots-clés propres au format, recalculés à l'écriture (pas recopiés depuis l'en-tête d'origine)
+MOTS_CLES_STRUCTURE = ("SIMPLE", "XTENSION", "BITPIX", "NAXIS", "EXTEND", "PCOUNT", "GCOUNT",
+                       "BZERO", "BSCALE", "BLANK", "CHECKSUM", "DATASUM")
+
+
+class ReglagesSortie:
+    """
+    Fichiers écrits pour chaque image : png (original, masques, image
+    érodée et image finale en 8 bits) et fits (image finale en FITS
+    compressé, en float32 et dans les unités de l'image d'origine).
+    quantification : niveau de quantification des float32 (voir
+    CompImageHDU, obligatoire pour RICE_1) ; None garde les valeurs exactes.
+    """
+
+    def __init__(self, png=True, fits=False, compression=COMPRESSION, quantification=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Compression inconnue : {compression} (possibles : {', '.join(COMPRESSIONS)})")
+        if compression == "RICE_1" and quantification is None:
+            raise ValueError("RICE_1 compresse des float32 quantifiés : donner une quantification")
+        self.png = png
+        self.fits = fits
+        self.compression = compression
+        self.quantification = quantification
+
+
+def entete_sortie(entete, mots_cles):
+    """
+    Copie de l'en-tête d'origine sans ses mots-clés de structure, avec les
+    mots-clés du traitement (mots_cles : {nom: (valeur, commentaire)})
+    et une ligne HISTORY.
+    """
+    from astropy.io import fits
+
+    sortie = fits.Header() if entete is None else entete.copy()
+    for nom in list(sortie.keys()):
+        if nom.rstrip("0123456789") in MOTS_CLES_STRUCTURE:
+            del sortie[nom]
+    sortie["REDDATE"] = (datetime.now().isoformat(timespec="seconds"), "date de la reduction des etoiles")
+    for nom, (valeur, commentaire) in mots_cles.items():
+        sortie[nom] = (valeur, commentaire)
+    sortie.add_history("Etoiles reduites par star-reduction (erosion et fusion multitaille)")
+    return sortie
+
+
+def ecrire_fits_compresse(chemin, image, entete=None, compression=COMPRESSION, quantification=None):
+    """
+    Écrit image (hauteur, largeur) ou (hauteur, largeur, 3) en FITS
+    compressé par tuiles. Une image couleur est rangée canaux en premier
+    (3, hauteur, largeur), comme les FITS couleur. Le fichier est écrit à
+    côté puis renommé : un fichier interrompu ne remplace jamais l'ancien.
+    """
+    from astropy.io import fits
+
+    if image.ndim == 3:
+        image = np.moveaxis(image, -1, 0)
+        tuile = (1, TAILLE_TUILE_FITS, TAILLE_TUILE_FITS)
+    else:
+        tuile = (TAILLE_TUILE_FITS, TAILLE_TUILE_FITS)
+    # Tuiles limitées à la taille de l'image (petites images)
+    tuile = tuple(min(t, n) for t, n in zip(tuile, image.shape))
+    hdu = fits.CompImageHDU(np.ascontiguousarray(image), header=entete, compression_type=compression,
+                            tile_shape=tuile, quantize_level=0.0 if quantification is None else quantification)
+    temporaire = chemin + ".tmp"
+    try:
+        fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(temporaire, overwrite=True)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        if os.path.exists(temporaire):
+            os.remove(temporaire)
+        raise
+
+
+class EcrivainFichiers:
+    """
+    Écritures de fichiers faites dans l'ordre par un seul thread
+    d'entrées/sorties (asynchrone=True), ou tout de suite. Chaque écriture
+    appartient à un groupe (en général le dossier de sortie d'une image) :
+    attendre(groupe) attend ses écritures et relance leur première erreur.
+
+    Les tableaux donnés ne doivent plus être modifiés avant la fin de
+    leur écriture (copier ceux qui servent encore au calcul).
+    """
+
+    def __init__(self, asynchrone=True, en_attente_max=ECRITURES_EN_ATTENTE):
+        self.en_attente_max = en_attente_max
+        self._pool = None
+        if asynchrone:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ecriture")
+        # (groupe, tâche) dans l'ordre de soumission
+        self._taches = deque()
+        self._erreurs = {}
+
+    def soumettre(self, groupe, fonction, *args, **kwargs):
+        if self._pool is None:
+            fonction(*args, **kwargs)
+            return
+        # Trop d'écritures en attente : on attend la plus ancienne
+        while len(self._taches) >= self.en_attente_max:
+            self._terminer(*self._taches.popleft())
+        self._taches.append((groupe, self._pool.submit(fonction, *args, **kwargs)))
+
+    def png(self, groupe, chemin, image):
+        from reduction.couleur import enregistrer_png
+        from reduction.profilage import PROFILEUR
+
+        def ecrire():
+            with PROFILEUR.etape("écriture"):
+                if not enregistrer_png(chemin, image):
+                    raise OSError(f"Écriture impossible : {chemin}")
+
+        self.soumettre(groupe, ecrire)
+
+    def fits(self, groupe, chemin, image, entete=None, reglages=None):
+        from reduction.profilage import PROFILEUR
+
+        reglages = ReglagesSortie(fits=True) if reglages is None else reglages
+
+        def ecrire():
+            with PROFILEUR.etape("écriture FITS"):
+                ecrire_fits_compresse(chemin, image, entete, reglages.compression, reglages.quantification)
+
+        self.soumettre(groupe, ecrire)
+
+    def _terminer(self, groupe, tache):
+        erreur = tache.exception()
+        if erreur is not None:
+            self._erreurs.setdefault(groupe, erreur)
+
+    def attendre(self, groupe=None):
+        """Attend les écritures du groupe (toutes si None) et relance leur première erreur."""
+        restantes = deque()
+        for g, tache in self._taches:
+            if groupe is None or g == groupe:
+                self._terminer(g, tache)
+            else:
+                restantes.append((g, tache))
+        self._taches = restantes
+        if groupe is None:
+            erreurs = list(self._erreurs.values())
+            self._erreurs.clear()
+        else:
+            erreurs = [self._erreurs.pop(groupe)] if groupe in self._erreurs else []
+        if erreurs:
+            raise erreurs[0]
+
+    def fermer(self):
+        """Attend toutes les écritures puis arrête le thread."""
+        try:
+            self.attendre()
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.fermer()
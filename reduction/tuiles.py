@@ -0,0 +1,225 @@
+import math
+import os
+import tempfile
+
+import cv2 as cv
+import numpy as np
+from astropy.io import fits
+
+from reduction.empreintes import DEMI_COTE_MAX, DEMI_FENETRE_FWHM
+from reduction.fond import statistiques_sous_echantillon
+from reduction.noyaux import COURBE_NOYAUX
+from reduction.reducteur import StarReducer
+
+
+# Côté d'une tuile (sans le halo), en pixels
+TAILLE_TUILE = 2048
+
+
+def calculer_halo(noyaux, fwhm):
+    """
+    Largeur du bord ajouté autour de chaque tuile pour que son cœur soit
+    identique au traitement de l'image entière.
+
+    Un pixel du cœur dépend de l'érosion (demi-noyau le plus grand), des
+    empreintes des étoiles proches (plus grand demi-côté possible), de la
+    détection de ces étoiles (convolution et centroïde de DAOStarFinder)
+    et de la mesure de leur FWHM (fenêtre autour du centre).
+    """
+    marge_detection = 2 * (int(math.ceil(1.5 * fwhm)) + 1)
+    return max(max(noyaux) // 2, DEMI_COTE_MAX + 1 + max(marge_detection, DEMI_FENETRE_FWHM))
+
+
+def decouper_tuiles(hauteur, largeur, taille, halo):
+    """
+    Renvoie pour chaque tuile (coeur, bord, interieur) :
+    coeur : tranches de l'image écrites par la tuile,
+    bord : tranches lues (cœur + halo, limitées à l'image),
+    interieur : position du cœur dans la tuile lue.
+    """
+    tuiles = []
+    for y0 in range(0, hauteur, taille):
+        for x0 in range(0, largeur, taille):
+            y1 = min(y0 + taille, hauteur)
+            x1 = min(x0 + taille, largeur)
+            by0, bx0 = max(y0 - halo, 0), max(x0 - halo, 0)
+            by1, bx1 = min(y1 + halo, hauteur), min(x1 + halo, largeur)
+            tuiles.append((
+                (slice(y0, y1), slice(x0, x1)),
+                (slice(by0, by1), slice(bx0, bx1)),
+                (slice(y0 - by0, y1 - by0), slice(x0 - bx0, x1 - bx0)),
+            ))
+    return tuiles
+
+
+class DonneesMisesAEchelle:
+    """
+    Pixels d'une image FITS projetée en mémoire sans mise à l'échelle
+    (fits.open(..., do_not_scale_image_data=True)) : chaque tranche lue
+    reçoit BSCALE et BZERO, et ses pixels BLANK deviennent NaN, comme
+    astropy le fait pour l'image entière. Les entiers non signés usuels
+    (uint16 des caméras : BZERO = 32768) restent des entiers. astropy
+    refuse de projeter en mémoire une image mise à l'échelle.
+    """
+
+    def __init__(self, brutes, entete):
+        self.brutes = brutes
+        self.shape = brutes.shape
+        self.ndim = brutes.ndim
+        self.bscale = entete.get("BSCALE", 1)
+        self.bzero = entete.get("BZERO", 0)
+        self.blank = entete.get("BLANK") if brutes.dtype.kind == "i" else None
+        bits = 8 * brutes.dtype.itemsize
+        # Entiers non signés stockés en signés décalés de 2^(bits-1)
+        self.non_signe = (brutes.dtype.kind == "i" and bits > 8 and self.bscale == 1
+                          and self.bzero == 2 ** (bits - 1) and self.blank is None)
+
+    def __getitem__(self, cle):
+        brutes = np.asarray(self.brutes[cle])
+        if self.non_signe:
+            # Décalage de 2^(bits-1) : seul le bit de signe change
+            signe = np.array(1 << (8 * brutes.dtype.itemsize - 1)).astype(brutes.dtype.newbyteorder("="))
+            return (brutes.astype(brutes.dtype.newbyteorder("=")) ^ signe).view(f"u{brutes.dtype.itemsize}")
+        if self.bscale == 1 and self.bzero == 0 and self.blank is None:
+            return brutes
+        # float32 pour les entiers de 8 et 16 bits, float64 au-delà (comme astropy)
+        valeurs = brutes.astype(np.float32 if brutes.dtype.itemsize <= 2 else np.float64)
+        if self.bscale != 1:
+            valeurs *= self.bscale
+        if self.bzero != 0:
+            valeurs += self.bzero
+        if self.blank is not None:
+            valeurs[brutes == self.blank] = np.nan
+        return valeurs
+
+
+def min_max_par_bandes(data, pixels_bande=TAILLE_TUILE * TAILLE_TUILE):
+    """Minimum et maximum de l'image lus par bandes de lignes (pixels BLANK ignorés)."""
+    hauteur, largeur = data.shape
+    lignes = max(pixels_bande // largeur, 1)
+    minimum, maximum = np.inf, -np.inf
+    for y in range(0, hauteur, lignes):
+        bande = data[y:y + lignes]
+        minimum = min(minimum, float(np.nanmin(bande)))
+        maximum = max(maximum, float(np.nanmax(bande)))
+    return minimum, maximum
+
+
+def noyau_magnitude_defaut(mag):
+    # Même règle que StarReducer (courbe COURBE_NOYAUX)
+    return COURBE_NOYAUX(mag)
+
+
+def traiter_tuile(tuile, minimum, maximum, statistiques, interieur,
+                  fwhm, threshold_sigma, noyau_magnitude):
+    """
+    Réduction d'une tuile lue avec son halo par les étapes de StarReducer
+    (detect, mask, reduce), avec les statistiques de fond (moyenne,
+    mediane, std) de l'image entière. Renvoie le cœur de la tuile en uint8
+    et les étoiles (x, y, mag) dont le centre est dans ce cœur, en
+    coordonnées du cœur. Une étoile vue par plusieurs tuiles n'appartient
+    donc qu'à une seule.
+    """
+    tuile_float = tuile.astype(np.float64)
+    # Pixels BLANK (NaN, voir DonneesMisesAEchelle) au minimum de l'image :
+    # ni DAOStarFinder ni la conversion en 8 bits ne voient de NaN
+    np.nan_to_num(tuile_float, copy=False, nan=minimum)
+
+    # Même conversion en 8 bits que sur l'image entière (min et max globaux)
+    image = ((tuile_float - minimum) / (maximum - minimum) * 255).astype('uint8')
+
+    reducteur = StarReducer(image, tuile_float, fwhm=fwhm, courbe_noyaux=noyau_magnitude,
+                            statistiques=statistiques)
+    detection = reducteur.detect(threshold_sigma)
+    lignes, colonnes = interieur
+    x, y = detection.x, detection.y
+    dans_coeur = (y >= lignes.start) & (y < lignes.stop) & (x >= colonnes.start) & (x < colonnes.stop)
+    etoiles = (x[dans_coeur] - colonnes.start, y[dans_coeur] - lignes.start, detection.mag[dans_coeur])
+
+    reduction = reducteur.reduce(reducteur.mask(detection))
+    return reduction.en_uint8()[interieur], etoiles
+
+
+def ouvrir_sortie(chemin, hauteur, largeur, header=None):
+    """
+    Prépare l'image de sortie (uint8) sur le disque et la renvoie projetée
+    en mémoire : un FITS pour l'extension .fits, sinon un fichier brut
+    temporaire converti en PNG à la fin.
+    """
+    if chemin.lower().endswith((".fits", ".fit", ".fts")):
+        entete = fits.Header() if header is None else header.copy()
+        # On ne garde que les mots-clés qui ne décrivent pas les données
+        for cle in ("BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "NAXIS3", "BZERO", "BSCALE", "BLANK", "EXTEND"):
+            entete.remove(cle, ignore_missing=True)
+        hdu = fits.PrimaryHDU(data=np.zeros((1, 1), dtype=np.uint8), header=entete)
+        hdu.header["NAXIS1"] = largeur
+        hdu.header["NAXIS2"] = hauteur
+
+        # On écrit l'en-tête puis on agrandit le fichier à la taille des données
+        # (sans allouer l'image en mémoire)
+        hdu.header.tofile(chemin, overwrite=True)
+        taille = len(hdu.header.tostring()) + hauteur * largeur
+        taille = ((taille + 2879) // 2880) * 2880
+        with open(chemin, "rb+") as f:
+            f.seek(taille - 1)
+            f.write(b"\0")
+
+        hdul = fits.open(chemin, mode="update", memmap=True)
+        return hdul[0].data, hdul
+
+    fd, brut = tempfile.mkstemp(suffix=".raw", dir=os.path.dirname(os.path.abspath(chemin)))
+    os.close(fd)
+    return np.memmap(brut, dtype=np.uint8, mode="w+", shape=(hauteur, largeur)), brut
+
+
+def fermer_sortie(chemin, sortie, ressource):
+    if isinstance(ressource, fits.HDUList):
+        ressource.close()
+        return
+    # PNG : encodé depuis le fichier projeté en mémoire puis fichier brut supprimé
+    sortie.flush()
+    cv.imwrite(chemin, sortie)
+    del sortie
+    os.remove(ressource)
+
+
+def reduire_fits_par_tuiles(chemin_fits, chemin_sortie, taille_tuile=TAILLE_TUILE,
+                            fwhm=2.0, threshold_sigma=0.7, noyau_magnitude=None, noyaux=(3, 15)):
+    """
+    Réduction multitaille d'une image FITS monochrome trop grande pour la
+    mémoire. Les données sont lues avec memmap=True (mises à l'échelle
+    tuile par tuile, voir DonneesMisesAEchelle) et traitées par tuiles
+    avec halo ; le résultat est écrit au fur et à mesure dans chemin_sortie
+    (FITS ou PNG). La mémoire utilisée dépend de la taille des tuiles et
+    non de celle de l'image. noyaux : tailles que noyau_magnitude peut
+    donner (la plus grande fixe le halo).
+
+    Renvoie le nombre d'étoiles détectées dans les cœurs des tuiles.
+    """
+    if noyau_magnitude is None:
+        noyau_magnitude = noyau_magnitude_defaut
+
+    halo = calculer_halo(noyaux, fwhm)
+
+    with fits.open(chemin_fits, memmap=True, do_not_scale_image_data=True) as hdul:
+        if hdul[0].data is None or hdul[0].data.ndim != 2:
+            raise ValueError("Le traitement par tuiles attend une image FITS monochrome (2 dimensions)")
+        data = DonneesMisesAEchelle(hdul[0].data, hdul[0].header)
+
+        hauteur, largeur = data.shape
+        minimum, maximum = min_max_par_bandes(data)
+        statistiques = statistiques_sous_echantillon(data)
+
+        nombre_etoiles = 0
+        sortie, ressource = ouvrir_sortie(chemin_sortie, hauteur, largeur, hdul[0].header)
+        try:
+            for coeur, bord, interieur in decouper_tuiles(hauteur, largeur, taille_tuile, halo):
+                sortie[coeur], etoiles = traiter_tuile(
+                    data[bord], minimum, maximum, statistiques, interieur,
+                    fwhm, threshold_sigma, noyau_magnitude
+                )
+                nombre_etoiles += len(etoiles[0])
+        finally:
+            fermer_sortie(chemin_sortie, sortie, ressource)
+
+    return nombre_etoiles